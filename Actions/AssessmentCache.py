@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import threading
+import time
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+ASSESSMENT_CACHE_SIZE = int(os.getenv("ASSESSMENT_CACHE_SIZE", 256))
+ASSESSMENT_CACHE_TTL = float(os.getenv("ASSESSMENT_CACHE_TTL", 300))
+# NOTIFY channel fed by the triggers in README.md, empty disables LISTEN (TTL only).
+ASSESSMENT_CACHE_CHANNEL = os.getenv("ASSESSMENT_CACHE_CHANNEL", "assessment_changed")
+
+
+class AssessmentCache:
+    """
+        In process read through cache of built assessment bundles (Grader.build_assessment_ output), keyed by assessment id.
+        Entries live ttl seconds, the least recently used is evicted past max_size.
+        Changes to Assessments/Questions/Choices arrive as NOTIFY <channel> '<assessment_id>' on a dedicated
+        LISTEN connection, drained on every lookup. Losing that connection clears the cache.
+    """
+    def __init__(self, db, max_size: int = ASSESSMENT_CACHE_SIZE, ttl: float = ASSESSMENT_CACHE_TTL,
+                 channel: Optional[str] = ASSESSMENT_CACHE_CHANNEL, clock=time.monotonic):
+        self.db = db
+        self.max_size = max_size
+        self.ttl = ttl
+        self.channel = channel
+        self.clock = clock
+        self.listener = None
+        self.listen_retry_at = 0.0
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0, "resets": 0}
+
+    def _listen(self):
+        if not self.channel or self.db is None or self.listener is not None or self.clock() < self.listen_retry_at:
+            return
+        try:
+            self.listener = self.db.listen(self.channel)
+        except RuntimeError as e:
+            # Entries still expire after ttl, try again once the cache has turned over
+            self.listen_retry_at = self.clock() + self.ttl
+            logger.error("unable to LISTEN on %s, assessment cache falls back to ttl: %s", self.channel, e)
+
+    def poll(self):
+        """
+            Apply pending invalidations. A payload that is not an assessment id clears the whole cache.
+        """
+        with self.lock:
+            self._listen()
+            if self.listener is None:
+                return
+            try:
+                self.listener.poll()
+                notifies = list(self.listener.notifies)
+                del self.listener.notifies[:]
+            except Exception as e:
+                # Notifications may have been missed while the connection was down
+                logger.error("assessment cache listener lost, clearing cache: %s", e)
+                self.listener = None
+                self.entries.clear()
+                self.counters["resets"] += 1
+                return
+            for notify in notifies:
+                try:
+                    assessment_id = int(notify.payload)
+                except (TypeError, ValueError):
+                    self.entries.clear()
+                    self.counters["resets"] += 1
+                    continue
+                if self.entries.pop(assessment_id, None) is not None:
+                    self.counters["invalidations"] += 1
+
+    def cached_ids(self) -> list:
+        """
+            Ids currently cached and fresh, the context query skips loading them.
+        """
+        self.poll()
+        now = self.clock()
+        with self.lock:
+            return [aid for aid, (_, expires) in self.entries.items() if expires > now]
+
+    def get_many(self, assessment_ids: list) -> dict:
+        """
+            Returns dict {assessment_id: bundle} for the fresh entries only
+        """
+        self.poll()
+        found, now = {}, self.clock()
+        with self.lock:
+            for aid in assessment_ids:
+                entry = self.entries.get(aid)
+                if entry is not None and entry[1] <= now:
+                    del self.entries[aid]
+                    self.counters["expired"] += 1
+                    entry = None
+                if entry is None:
+                    self.counters["misses"] += 1
+                    continue
+                self.entries.move_to_end(aid)
+                self.counters["hits"] += 1
+                found[aid] = entry[0]
+        return found
+
+    def put_many(self, bundles: dict):
+        expires = self.clock() + self.ttl
+        with self.lock:
+            for aid, bundle in bundles.items():
+                self.entries[aid] = (bundle, expires)
+                self.entries.move_to_end(aid)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def resolve(self, assessment_ids: list, assessments: list, questions: list,
+                build: Callable, load: Callable) -> Optional[dict]:
+        """
+            Assemble the bundles of a session from rows just fetched, the cache, and a reload of whatever is left
+            (entries invalidated between the context query and now).
+            Params: assessment_ids (list), assessments/questions (rows fetched for the uncached ids),
+                    build(assessments, questions) -> {id: bundle}, load(ids) -> (assessments, questions)
+
+            Returns dict {assessment_id: bundle} or None when an assessment could not be built
+        """
+        wanted = list(dict.fromkeys(assessment_ids))
+        fresh = build(assessments, questions) if assessments else {}
+        if fresh is None:
+            return None
+        self.put_many(fresh)
+        bundles = dict(fresh)
+        bundles.update(self.get_many([aid for aid in wanted if aid not in bundles]))
+        missing = [aid for aid in wanted if aid not in bundles]
+        if missing:
+            reloaded = build(*load(missing))
+            if reloaded is None:
+                return None
+            self.put_many(reloaded)
+            bundles.update(reloaded)
+        if any(aid not in bundles for aid in wanted):
+            return None
+        return bundles
+
+    def metrics(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            counters["size"] = len(self.entries)
+            counters["listening"] = self.listener is not None
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        return counters
+
+
+_assessment_cache: Optional[AssessmentCache] = None
+_assessment_cache_lock = threading.Lock()
+
+
+def get_assessment_cache(db) -> AssessmentCache:
+    """
+        Process wide AssessmentCache, shared by every message handled by this worker.
+    """
+    global _assessment_cache
+    with _assessment_cache_lock:
+        if _assessment_cache is None:
+            _assessment_cache = AssessmentCache(db)
+        return _assessment_cache
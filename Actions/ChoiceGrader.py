@@ -0,0 +1,90 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+import logging
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+SHORT_ANSWER = "short_answer"
+ANSWER_COLUMNS = ['id', 'assessment_id', 'student_id', 'question_id', 'choice_id', 'answer_text']
+KEY_COLUMNS = ['assessment_id', 'question_id', 'correct_choice_id', 'question_points', 'question_type']
+UPSERT_COLUMNS = ['assessment_student_id', 'student_id', 'question_id', 'choice_id', 'answer_text', 'is_correct', 'points']
+
+
+# Columnar grading of choice questions, one join against the answer key instead of a dict per answer.
+class ChoiceGrader:
+    def __init__(self, key: pd.DataFrame):
+        self.key = key.astype({'correct_choice_id': 'Int64', 'question_points': 'float64'})
+
+    @classmethod
+    def from_build(cls, assessment: Optional[dict]) -> "ChoiceGrader":
+        """
+            Answer key from Grader.build_assessment_ output.
+            Params: assessment dict{id: {questions: {question_id: {...}}}}
+        """
+        rows = [
+            (aid, qid, q.get('choice_id'), q.get('points'), q.get('question_type'))
+            for aid, kl in assessment.items() for qid, q in kl['questions'].items()
+        ]
+        return cls(pd.DataFrame.from_records(rows, columns=KEY_COLUMNS))
+
+    @classmethod
+    def from_questions(cls, assessment_questions: Optional[list]) -> "ChoiceGrader":
+        """
+            Answer key straight from State.get_assessment_questions rows, the last correct choice per question wins
+            like build_assessment_.
+        """
+        frame = pd.DataFrame.from_records(assessment_questions, columns=['assessment_id', 'question_id', 'choice_id', 'points', 'question_type'])
+        frame = frame.drop_duplicates(subset=['assessment_id', 'question_id'], keep='last')
+        return cls(frame.set_axis(KEY_COLUMNS, axis=1))
+
+    def grade(self, session: Optional[list]) -> tuple:
+        """
+            Grade every choice answer of a session at once.
+            Params: session list(dict{id, assessment_id, student_id, question_id, choice_id, answer_text})
+
+            Returns Tuple
+            (DataFrame[UPSERT_COLUMNS] in session order, ndarray(bool) True where the item is a short_answer)
+            Short answer rows are left ungraded (is_correct False, points 0).
+        """
+        answers = pd.DataFrame.from_records(session, columns=ANSWER_COLUMNS)
+        merged = answers.merge(self.key, how='left', on=['assessment_id', 'question_id'], sort=False)
+        unknown = merged['question_type'].isna()
+        if unknown.any():
+            missing = merged.loc[unknown, ['assessment_id', 'question_id']].drop_duplicates().values.tolist()
+            raise KeyError(f"questions missing from assessment build: {missing}")
+        is_short = merged['question_type'].eq(SHORT_ANSWER).to_numpy()
+        choice_id = merged['choice_id'].astype('Int64')
+        is_correct = (choice_id == merged['correct_choice_id']).fillna(False).to_numpy(dtype=bool) & ~is_short
+        graded = pd.DataFrame({
+            'assessment_student_id': merged['id'],
+            'student_id': merged['student_id'],
+            'question_id': merged['question_id'],
+            'choice_id': pd.Series([None] * len(merged), dtype=object),
+            'answer_text': pd.Series([None] * len(merged), dtype=object),
+            'is_correct': is_correct,
+            'points': np.where(is_correct, merged['question_points'].to_numpy(dtype='float64', na_value=0.0), 0.0),
+        }, columns=UPSERT_COLUMNS)
+        return (graded, is_short)
+
+    @staticmethod
+    def to_updates(graded: pd.DataFrame) -> list:
+        """
+            Same dict rows Grader.grade_ always produced, with native python scalars for psycopg2.
+        """
+        return graded.to_dict('records')
+
+    @staticmethod
+    def totals(graded_list: Optional[list]) -> dict:
+        """
+            Per student score totals with one group-by.
+
+            Returns Object
+            dict {student_id: {"score": float} }
+        """
+        frame = pd.DataFrame.from_records(graded_list, columns=['student_id', 'points'])
+        sums = frame.astype({'points': 'float64'}).groupby('student_id', sort=False)['points'].sum()
+        return {student_id: {"score": score} for student_id, score in zip(sums.index.tolist(), sums.tolist())}
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import threading
+import unicodedata
+import re
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+GRADE_CACHE_SIZE = int(os.getenv("GRADE_CACHE_SIZE", 10000))
+GRADE_CACHE_PERSIST = os.getenv("GRADE_CACHE_PERSIST", "1") == "1"
+_EDGE_PUNCTUATION = " \t\n\r.,;:!?\"'`()[]{}"
+
+
+def normalize_answer(answer_text: Optional[str]) -> str:
+    """
+        Fold trivially different answers onto one key.
+        "Photosynthesis." and "  photosynthesis" both become "photosynthesis".
+    """
+    if answer_text is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(answer_text)).casefold()
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+def question_version(question: Optional[dict]) -> str:
+    """
+        Version of a question derived from what the grade depends on: text, expected answer and points.
+        Any edit produces a new version, so stale grades are never served.
+    """
+    raw = "|".join(str(question.get(k)) for k in ("question_text", "answer_text", "points"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class GradeCache:
+    """
+        Two tier cache of model grades.
+        Tier 1: in process LRU, Tier 2: stu_tracker.Grade_cache through the db client.
+        Key: (question_id, question_version, sha256(normalized answer_text), model_id)
+    """
+    def __init__(self, db, max_size: int = GRADE_CACHE_SIZE, persist: bool = GRADE_CACHE_PERSIST):
+        self.db = db
+        self.max_size = max_size
+        self.persist = persist and db is not None
+        self.entries: OrderedDict = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def key(self, question: dict, answer_text: Optional[str], model_id: Optional[str]) -> tuple:
+        answer_key = hashlib.sha256(normalize_answer(answer_text).encode("utf-8")).hexdigest()
+        return (question['question_id'], question_version(question), answer_key, model_id)
+
+    def _check_version(self, question: dict):
+        question_id, version = question['question_id'], question_version(question)
+        with self.lock:
+            known = self.versions.get(question_id)
+            self.versions[question_id] = version
+        if known is not None and known != version:
+            self.invalidate_question(question_id, keep_version=version)
+
+    def get_many(self, lookups: list) -> dict:
+        """
+            Resolve many lookups, the LRU first and the misses with one db round trip.
+            Params: lookups list(tuple(question, answer_text, model_id))
+
+            Returns dict {key: {score, feedback}} for hits only
+        """
+        found, missing = {}, []
+        for question, answer_text, model_id in lookups:
+            self._check_version(question)
+            key = self.key(question, answer_text, model_id)
+            with self.lock:
+                value = self.entries.get(key)
+                if value is not None:
+                    self.entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    found[key] = value
+                    continue
+            missing.append(key)
+        wanted = set(missing)
+        if missing and self.persist:
+            try:
+                for row in self.db.get_grade_cache(missing) or []:
+                    key = (row['question_id'], row['question_version'], row['answer_key'], row['model_id'])
+                    if key in found or key not in wanted:
+                        continue
+                    value = {"score": float(row['score']), "feedback": row['feedback']}
+                    found[key] = value
+                    with self.lock:
+                        self.counters["db_hits"] += 1
+                    self._remember(key, value)
+            except RuntimeError as e:
+                logger.error("unable to read grade cache: %s", e)
+        with self.lock:
+            self.counters["misses"] += len([k for k in missing if k not in found])
+        return found
+
+    def get(self, question: dict, answer_text: Optional[str], model_id: Optional[str]) -> Optional[dict]:
+        return self.get_many([(question, answer_text, model_id)]).get(self.key(question, answer_text, model_id))
+
+    def put(self, question: dict, answer_text: Optional[str], model_id: Optional[str], response: dict):
+        key = self.key(question, answer_text, model_id)
+        value = {"score": float(response["score"]), "feedback": response["feedback"]}
+        self._remember(key, value)
+        if self.persist:
+            try:
+                self.db.upsert_grade_cache([key + (value["score"], value["feedback"])])
+            except RuntimeError as e:
+                logger.error("unable to write grade cache: %s", e)
+
+    def _remember(self, key: tuple, value: dict):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate_question(self, question_id: int, keep_version: Optional[str] = None):
+        """
+            Drop every cached grade of question_id, except keep_version when given.
+        """
+        with self.lock:
+            stale = [k for k in self.entries if k[0] == question_id and k[1] != keep_version]
+            for k in stale:
+                del self.entries[k]
+            self.counters["invalidations"] += 1
+        if self.persist:
+            try:
+                self.db.delete_grade_cache(question_id, keep_version)
+            except RuntimeError as e:
+                logger.error("unable to invalidate grade cache: %s", e)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            counters["size"] = len(self.entries)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["memory_hits"] + counters["db_hits"]) / lookups if lookups else 0.0
+        return counters
+
+
+_grade_cache: Optional[GradeCache] = None
+_grade_cache_lock = threading.Lock()
+
+
+def get_grade_cache(db) -> GradeCache:
+    """
+        Process wide GradeCache, shared by every message handled by this worker.
+    """
+    global _grade_cache
+    with _grade_cache_lock:
+        if _grade_cache is None:
+            _grade_cache = GradeCache(db)
+        return _grade_cache
@@ -1,14 +1,18 @@
 from Models.AmazonModel import AmazonModel
 from Actions.GraderGenerator import GraderGenerator
 from Models.GeminModel import GeminiModel
-from Prompt.Prompt import Prompt
+from Prompt.Prompt import Prompt, BatchPrompt
+from Actions.GradeCache import get_grade_cache
+from Actions.ChoiceGrader import ChoiceGrader
 from S3.main import S3Instance
 from Config.Client import Client
-from typing import Optional
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
 from Prompt.Identity import get_context, get_identity_prompt, get_rules, get_instructions_prompt, get_examples_prompt
 import json
 import logging
 import os
+import numpy as np
 # --- Python logger ---
 logging.basicConfig(
     level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
@@ -23,6 +27,19 @@ ERROR = 'ERROR'
 MODEL_TYPE = 'GOOGLE'
 SUCCESS = 'SUCCESS'
 FAIL = 'FAIL'
+CACHE_HIT = 'CACHE_HIT'
+CACHE_MODEL_ID = f"{MODEL_TYPE}:{MODEL_ID}"
+# Upper bound of in-flight model calls per session, per provider.
+MAX_CONCURRENCY = {
+    "GOOGLE": int(os.getenv("GOOGLE_MAX_CONCURRENCY", 8)),
+    "AMZN": int(os.getenv("AMZN_MAX_CONCURRENCY", 4)),
+}
+# Short answers packed per prompt, 1 keeps one prompt per answer.
+BATCH_SIZE = int(os.getenv("GRADER_BATCH_SIZE", 1))
+# "question" batches answers to the same question, "assessment" mixes questions of one assessment.
+BATCH_SCOPE = os.getenv("GRADER_BATCH_SCOPE", "question")
+# Graded items handed to the checkpoint per write, a retry only grades what was not written yet.
+CHECKPOINT_SIZE = int(os.getenv("GRADER_CHECKPOINT_SIZE", 25))
 
 
 # Each class will load assessments and choices per session payload.
@@ -30,6 +47,7 @@ class Grader:
     def __init__(self, db, client: Client):
         self.db = db
         self.client = client
+        self.cache = get_grade_cache(db)
 
     def parse_assessments(self, sessions: Optional[list]) -> list:
         """
@@ -80,13 +98,120 @@ class Grader:
             logger.info("grade_non_agent", e)
             return None
     
-    def grade_(self, assessment: Optional[dict], session: Optional[list] ) -> tuple:
+    def grade_short_answer(self, kl: Optional[dict], question: Optional[dict], item: Optional[dict]) -> tuple:
+        """
+            Grade a single short_answer item with the model.
+            Params: kl (dict), question (dict), item (dict)
+
+            Returns Tuple
+            (dict | None, tuple)
+            dict {assessment_student_id, student_id, question_id, choice_id, answer_text, is_correct, feedback, points},
+            tuple(organization_id, input_tokens, output_tokens, MODEL_TYPE, MODEL_ID, FAIL/SUCCESS)
+        """
+        prompt = Prompt(kl, question, item['answer_text'])
+        grader_context = GraderGenerator(model_type=MODEL_TYPE, prompt=prompt, organization_id=self.client.get_orgainzation_id())
+        input_tokens = prompt.get_input_length()
+        model = grader_context.run_grade_model()
+        if model is None:
+            return (None, (self.client.get_orgainzation_id(), input_tokens, 0, MODEL_TYPE, MODEL_ID, FAIL))
+        output_tokens = model['output_tokens']
+        upsert = self.short_answer_upsert(question, item, model["response"])
+        self.cache.put(question, item['answer_text'], CACHE_MODEL_ID, model["response"])
+        return (upsert, (self.client.get_orgainzation_id(), input_tokens, output_tokens, MODEL_TYPE, MODEL_ID, SUCCESS))
+
+    def grade_short_answer_batch(self, kl: Optional[dict], entries: Optional[list]) -> tuple:
+        """
+            Grade several short_answer items of one assessment with a single BatchPrompt.
+            Params: kl (dict), entries list(tuple(index, question, item))
+
+            Returns Tuple
+            (dict{index: dict} | None, tuple)
+            None when any item could not be graded after re-requests.
+        """
+        prompt = BatchPrompt(kl, [(item['id'], question, item['answer_text']) for _, question, item in entries])
+        grader_context = GraderGenerator(model_type=MODEL_TYPE, prompt=prompt, organization_id=self.client.get_orgainzation_id())
+        model = grader_context.run_batch_grade_model()
+        # Ids may come back as strings, match them as ints
+        responses = {int(key): response for key, response in model["responses"].items()}
+        missing = [item['id'] for _, _, item in entries if int(item['id']) not in responses]
+        status = FAIL if missing else SUCCESS
+        usage = (self.client.get_orgainzation_id(), model["input_tokens"], model["output_tokens"], MODEL_TYPE, MODEL_ID, status)
+        if status == FAIL:
+            logger.warning("batch grade: no response for ids %s", missing)
+            return (None, usage)
+        for _, question, item in entries:
+            self.cache.put(question, item['answer_text'], CACHE_MODEL_ID, responses[int(item['id'])])
+        return ({index: self.short_answer_upsert(question, item, responses[int(item['id'])]) for index, question, item in entries}, usage)
+
+    def short_answer_upsert(self, question: Optional[dict], item: Optional[dict], response: Optional[dict]) -> dict:
+        is_correct_ = float(question['points'] / 2)
+        model_response_points = float(response["score"])
+        return {'assessment_student_id': item['id'], 'student_id': item['student_id'],
+                'question_id': question['question_id'],
+                'choice_id': None, 'answer_text': item['answer_text'],
+                'is_correct': True if float(model_response_points) > float(is_correct_) else False ,
+                'points' : model_response_points,
+                "feedback": response["feedback"]}
+
+    def batch_short_answers(self, short_items: list) -> list:
+        """
+            Group short answer items by GRADER_BATCH_SCOPE ("question" or "assessment")
+            and split every group into chunks of GRADER_BATCH_SIZE.
+
+            Returns list(tuple(kl, list(tuple(index, question, item))))
+        """
+        groups = {}
+        for index, kl, question, item in short_items:
+            key = (item['assessment_id'], item['question_id']) if BATCH_SCOPE == "question" else item['assessment_id']
+            if key not in groups:
+                groups[key] = (kl, [])
+            groups[key][1].append((index, question, item))
+        batches = []
+        for kl, entries in groups.values():
+            for i in range(0, len(entries), BATCH_SIZE):
+                batches.append((kl, entries[i:i + BATCH_SIZE]))
+        return batches
+
+    def resolve_cached(self, short_items: list, updates: list, model_usage: list) -> tuple:
+        """
+            Fill updates from the grade cache and fold duplicate answers of the session onto one model call.
+            Hits record a zero token CACHE_HIT row in model_usage.
+            Params: short_items list(tuple(index, kl, question, item)), updates (list), model_usage (list)
+
+            Returns Tuple
+            (list(tuple(index, kl, question, item)) still to grade, dict{leader_index: list(tuple(index, question, item))})
+        """
+        if len(short_items) == 0:
+            return (short_items, {})
+        hits = self.cache.get_many([(question, item['answer_text'], CACHE_MODEL_ID) for _, _, question, item in short_items])
+        remaining, leaders, followers = [], {}, {}
+        for index, kl, question, item in short_items:
+            key = self.cache.key(question, item['answer_text'], CACHE_MODEL_ID)
+            if key in hits:
+                updates[index] = self.short_answer_upsert(question, item, hits[key])
+                model_usage.append((self.client.get_orgainzation_id(), 0, 0, MODEL_TYPE, MODEL_ID, CACHE_HIT))
+            elif key in leaders:
+                followers.setdefault(leaders[key], []).append((index, question, item))
+            else:
+                leaders[key] = index
+                remaining.append((index, kl, question, item))
+        logger.info("grade cache: %s", self.cache.metrics())
+        return (remaining, followers)
+
+    def grade_(self, assessment: Optional[dict], session: Optional[list], checkpoint: Optional[Callable[[list], bool]] = None) -> tuple:
         """
             Grade session list given assessments.
             Call Bedrock API for inteligent, feedback driven responses.
+            Choice items are graded column wise by ChoiceGrader.
+            Short answer items are dispatched concurrently, bounded by MAX_CONCURRENCY[MODEL_TYPE],
+            and collected back in session order. With GRADER_BATCH_SIZE > 1 they are packed into batched prompts.
+            checkpoint(graded items) persists items as they are graded, every GRADER_CHECKPOINT_SIZE items.
+            When it returns False the items are offered again with the next chunk. After a model failure the
+            calls already in flight are still collected and checkpointed, the graded items are checkpointed
+            as well when a call raises (CircuitOpenError).
 
             Returns Tuple
-            (list(dict), 
+            (list(dict) | None when a model call failed, 
             list(tuples))
             dict {assessment_student_id, student_id, question_id, choice_id, answer_text, is_correct, feedback, points},
             tuples(organization_id, input_tokens, output_tokens, MODEL_TYPE, MODEL_ID, FAIL/SUCCESS) 
@@ -94,59 +219,74 @@ class Grader:
         try:
             if self.client is None or assessment is None or session is None:
                 return None
-            updates = []
+            session = list(session)
+            choice_frame, is_short = ChoiceGrader.from_build(assessment).grade(session)
+            updates = [None] * len(session)
             model_usage = []
-            for item in session:
+            choice_positions = np.flatnonzero(~is_short)
+            for index, upsert in zip(choice_positions.tolist(), ChoiceGrader.to_updates(choice_frame.iloc[choice_positions])):
+                updates[index] = upsert
+            short_items = []
+            for index in np.flatnonzero(is_short).tolist():
+                item = session[index]
                 kl = assessment[item['assessment_id']]
-                question = kl['questions'][item['question_id']]
-                if question['question_type'] == "short_answer":
-                    prompt = Prompt(kl, question, item['answer_text'])
-                    grader_context = GraderGenerator(model_type=MODEL_TYPE, prompt=prompt)
-                    input_tokens = prompt.get_input_length()
-                    model = grader_context.run_grade_model()
-                    output_tokens = model['output_tokens']
-                    if model is None:
-                        model_usage.append((self.client.get_orgainzation_id(), input_tokens, 0, MODEL_TYPE, MODEL_ID, FAIL ))
-                        return None
-                    else:
-                        model_usage.append((self.client.get_orgainzation_id(),input_tokens, output_tokens, MODEL_TYPE, MODEL_ID, SUCCESS))
-                        is_correct_ = float(question['points'] / 2)
-                        model_response_points = float(model["response"]["score"])
-                        upsert = {'assessment_student_id': item['id'], 'student_id': item['student_id'],
-                                  'question_id': question['question_id'], 
-                                  'choice_id': None, 'answer_text': item['answer_text'], 
-                                  'is_correct': True if float(model_response_points) > float(is_correct_) else False , 
-                                  'points' : model_response_points,
-                                  "feedback": model["response"]["feedback"]}
-                        updates.append(upsert)
+                short_items.append((index, kl, kl['questions'][item['question_id']], item))
+            short_items, followers = self.resolve_cached(short_items, updates, model_usage)
+            unsaved = [upsert for upsert in updates if upsert is not None]
+            self.checkpoint_(checkpoint, unsaved)
+            if len(short_items) == 0:
+                return (updates, model_usage)
+            failed = False
+            executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY.get(MODEL_TYPE, 1), thread_name_prefix="grader")
+            try:
+                if BATCH_SIZE > 1:
+                    pending = [(None, executor.submit(self.grade_short_answer_batch, kl, entries)) for kl, entries in self.batch_short_answers(short_items)]
                 else:
-                    if item['choice_id'] is None:
-                        upsert = { 'assessment_student_id': item['id'], 'student_id': item['student_id'],
-                                  'question_id': question['question_id'], 
-                                  'choice_id': None, 'answer_text': None, 'is_correct': False, 'points' : 0}
-                        updates.append(upsert)
-                        continue
-                        # Incorrect
-                    if question['choice_id'] == item['choice_id']:
-                        logger.info(f"simple grader called")
-                        upsert = { 'assessment_student_id': item['id'], 'student_id': item['student_id'],
-                                  'question_id': question['question_id'], 
-                                  'choice_id': None, 'answer_text': None, 'is_correct': True, 'points' : question['points'] }
-                        updates.append(upsert)
-                        continue
-                    else:
-                        upsert = { 'assessment_student_id': item['id'], 'student_id': item['student_id'],
-                                  'question_id': question['question_id'], 
-                                  'choice_id': None, 'answer_text': None, 'is_correct': False,'points' : 0}
-                        updates.append(upsert)
+                    pending = [(index, executor.submit(self.grade_short_answer, kl, question, item)) for index, kl, question, item in short_items]
+                for index, future in pending:
+                    graded, usage = future.result()
+                    if index is not None and graded is not None:
+                        graded = {index: graded}
+                    model_usage.append(usage)
+                    if graded is None:
+                        if checkpoint is None:
+                            return (None, model_usage)
+                        failed = True
                         continue
-                        # incorrect
+                    for index, upsert in graded.items():
+                        updates[index] = upsert
+                        unsaved.append(upsert)
+                        for f_index, question, item in followers.get(index, []):
+                            updates[f_index] = self.short_answer_upsert(question, item, {"score": upsert['points'], "feedback": upsert['feedback']})
+                            unsaved.append(updates[f_index])
+                            model_usage.append((self.client.get_orgainzation_id(), 0, 0, MODEL_TYPE, MODEL_ID, CACHE_HIT))
+                    if len(unsaved) >= CHECKPOINT_SIZE:
+                        self.checkpoint_(checkpoint, unsaved)
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+                # Items graded before a failure are paid for, keep them out of the retry
+                self.checkpoint_(checkpoint, unsaved)
+            if failed:
+                return (None, model_usage)
             return (updates, model_usage)
         except RuntimeError as e:
             logger.error(f"unable to grade assessment with error: {e}")
             return False
          
     
+    def checkpoint_(self, checkpoint: Optional[Callable[[list], bool]], unsaved: list):
+        """
+            Hand the unsaved graded items to checkpoint in chunks of CHECKPOINT_SIZE,
+            the ones of a failed chunk are kept for the next call.
+        """
+        if checkpoint is None:
+            return
+        while len(unsaved) > 0:
+            chunk = unsaved[:CHECKPOINT_SIZE]
+            if not checkpoint(chunk):
+                return
+            del unsaved[:len(chunk)]
+
     def graded_details(self, graded_list: Optional[list]) -> Optional[dict]:
         """
             Create a map of graded students responses by mapping { student: {Object} }
@@ -156,8 +296,4 @@ class Grader:
             Returns Object
             dict {student_id: {....} }
         """
-        details = { i['student_id']: {"score": 0} for i in graded_list}
-        for i in graded_list:
-            if details[i['student_id']]:
-                details[i['student_id']]['score'] += i['points']
-        return details
\ No newline at end of file
+        return ChoiceGrader.totals(graded_list)
\ No newline at end of file
@@ -1,8 +1,15 @@
-from Models.AmazonModel import AmazonModel
-from Models.GeminModel import GeminiModel
-from Prompt.Prompt import Prompt
+from Models.AmazonModel import AmazonModel, amazon_provider
+from Models.GeminModel import GeminiModel, gemini_provider
+from Prompt.Prompt import Prompt, BatchPrompt
+from Prompt.PromptCache import get_context_cache, PROMPT_CACHE
+from Models.Admission import admission, EXPECTED_OUTPUT_TOKENS
+from Models.JsonScanner import JsonScanner
+from Models.Provider import GenerationConfig, run_sync, stream_json
+from Models.Retry import RetryPolicy, get_breaker, classify, PROVIDER_FAILURES, PARSE
+from Models.Schemas import GradeResult, GradeBatch, validate_json, batch_rows
 from typing import Optional
 import json
+import os
 import re
 from json import JSONDecodeError
 import logging
@@ -12,14 +19,26 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 MAX_RETRY = 2
+# Stream generations and stop at the first complete JSON value
+STREAMING = os.getenv("GRADER_STREAMING", "0") == "1"
+# Send the grading JSON schema to the provider (Gemini response_schema, Bedrock forced tool call)
+STRUCTURED_OUTPUT = os.getenv("GRADER_STRUCTURED_OUTPUT", "0") == "1"
+
+
+def estimate_output_tokens(text: str) -> int:
+    compressed = "".join(text.split())
+    return (len(compressed) + 2) // 4
 
 logger = logging.getLogger(__name__)
 
 ## This is my actions Generator to call bedrock model
 class GraderGenerator:
-    def __init__(self, model_type:Optional[str], prompt: Optional[Prompt] ):
+    def __init__(self, model_type:Optional[str], prompt: Optional[Prompt], organization_id: Optional[int] = None):
         self.model_type = model_type
         self.prompt = prompt
+        self.organization_id = organization_id
+        self.last_error = None
+        self.last_kind = None
 
     def gemini_parser(self, response: Optional[str]) -> str:
         match = re.search(r"\{.*\}", response, re.DOTALL)
@@ -40,33 +59,197 @@ class GraderGenerator:
             logger.error("unable to parse response: %s", e)
             return False
 
+    def response_schema(self, prompt) -> Optional[type]:
+        if not STRUCTURED_OUTPUT:
+            return None
+        return GradeBatch if isinstance(prompt, BatchPrompt) else GradeResult
+
+    def parse_grade(self, response: Optional[str]) -> Optional[GradeResult]:
+        """
+            Structured replies validate as they are, prompt only replies go through gemini_parser first.
+        """
+        if response is None:
+            return None
+        if STRUCTURED_OUTPUT:
+            grade = validate_json(GradeResult, response)
+            if grade is not None:
+                return grade
+        return validate_json(GradeResult, self.gemini_parser(response))
+
+    def parse_batch(self, response: Optional[str]) -> list:
+        """
+            Returns the valid GradeBatchItem rows of a batch reply.
+        """
+        if response is None:
+            return []
+        rows = batch_rows(response) if STRUCTURED_OUTPUT else []
+        return rows or batch_rows(self.array_parser(response))
+
+    def array_parser(self, response: Optional[str]) -> str:
+        match = re.search(r"\[.*\]", response, re.DOTALL)
+        if match:
+            return match.group(0)
+        return None
+
+    def generate(self, prompt) -> Optional[tuple]:
+        """
+            Single model call admitted through the process wide rate limits (Models/Admission.py).
+            Queues while the provider or organization is out of requests/tokens for the minute,
+            the token estimate is corrected with real usage afterwards.
+            Fails fast with CircuitOpenError while the provider breaker is open (Models/Retry.py).
+            Params: prompt (Prompt | BatchPrompt)
+
+            Returns Tuple
+            (generation (str), output_tokens (int)) or None on invalid response, self.last_kind tells why.
+        """
+        breaker = get_breaker(self.model_type)
+        breaker.before_call()
+        input_tokens = prompt.get_input_length()
+        ticket = admission.acquire(self.model_type, self.organization_id, input_tokens + EXPECTED_OUTPUT_TOKENS)
+        generation, self.last_error = None, None
+        try:
+            generation = self.call_model(prompt)
+        finally:
+            admission.settle(ticket, input_tokens + ((generation[1] or 0) if generation else 0))
+        self.last_kind = None if generation is not None else classify(self.last_error)
+        if self.last_kind in PROVIDER_FAILURES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return generation
+
+    def stream_model(self, prompt) -> Optional[tuple]:
+        """
+            Streaming model call that stops reading at the first complete {score, feedback} object
+            (a JSON array for BatchPrompt) and cancels the rest of the generation.
+            Params: prompt (Prompt | BatchPrompt)
+
+            Returns Tuple
+            (json text (str), estimated output tokens (int)) or None
+        """
+        if self.model_type == "AMZN":
+            provider = amazon_provider
+            config = GenerationConfig(temp=0.7, top_p=0.9, max_gen_len=3000, system_prefix=prompt.get_prefix() if PROMPT_CACHE else None,
+                                      response_schema=self.response_schema(prompt))
+            text = prompt.get_suffix() if PROMPT_CACHE else prompt.get_prompt()
+        elif self.model_type == "GOOGLE":
+            provider = gemini_provider
+            context_cache = get_context_cache(self.model_type)
+            handle = context_cache.handle_for(prompt.get_prefix(), prompt.prefix_tokens) if context_cache else None
+            config = GenerationConfig(cached_content=handle, response_schema=self.response_schema(prompt))
+            text = prompt.get_suffix() if handle else prompt.get_prompt()
+        else:
+            return None
+        scanner = JsonScanner("[") if isinstance(prompt, BatchPrompt) else JsonScanner("{", required=("score", "feedback"))
+        try:
+            json_text, read = run_sync(stream_json(provider.astream(text, config), scanner))
+        except Exception as e:
+            logger.error("streaming %s generation failed: %s", self.model_type, e)
+            self.last_error = e
+            return None
+        logger.info("Model %s streamed %s chars, json found: %s", self.model_type, len(read), json_text is not None)
+        # Unparsable streams are handed back whole so the caller can classify them as PARSE failures
+        return (json_text if json_text is not None else read, estimate_output_tokens(read))
+
+    def call_model(self, prompt) -> Optional[tuple]:
+        """
+            Single model call.
+            With PROMPT_CACHE=1 the prompt prefix is served from the provider context cache
+            (Gemini cached content, Bedrock cachePoint) and only the suffix is sent.
+            With GRADER_STRUCTURED_OUTPUT=1 the reply is constrained to the grading schema (Models/Schemas.py).
+            Params: prompt (Prompt | BatchPrompt)
+
+            Returns Tuple
+            (generation (str), output_tokens (int)) or None on invalid response
+        """
+        if STREAMING:
+            return self.stream_model(prompt)
+        schema = self.response_schema(prompt)
+        if self.model_type == "AMZN":
+            if PROMPT_CACHE:
+                model = AmazonModel(prompt.get_suffix(), temp=0.7, top_p=0.9, max_gen_len=3000, system_prefix=prompt.get_prefix(), response_schema=schema)
+            else:
+                model = AmazonModel(prompt.get_prompt(), temp=0.7, top_p=0.9, max_gen_len=3000, response_schema=schema)
+            if model.valid_response():
+                logger.info(f"Model AMZN generated:  {model.total_token()}")
+                return (self.amazon_parser(model.get_generation()), model.output_token())
+            self.last_error = model.error
+            return None
+        if self.model_type == "GOOGLE":
+            context_cache = get_context_cache(self.model_type)
+            handle = context_cache.handle_for(prompt.get_prefix(), prompt.prefix_tokens) if context_cache else None
+            if handle:
+                model = GeminiModel(prompt.get_suffix(), cached_content=handle, response_schema=schema)
+            else:
+                model = GeminiModel(prompt.get_prompt(), response_schema=schema)
+            if model.valid_response():
+                logger.info(f"Model GOOGLE generated:  {model.total_token()}")
+                return (model.get_generation(), model.total_token())
+            self.last_error = model.error
+            return None
+        return None
+
     def run_grade_model(self) -> Optional[dict]:
-        model, retry_count = None, 0
-        while retry_count <= MAX_RETRY:
-            logger.info("run_grade_model retry_count: %s", retry_count)
-            if self.model_type == "AMZN":
-                retry_count += 1
-                model = AmazonModel(self.prompt.get_prompt(), temp=0.7, top_p=0.9, max_gen_len=3000)
-                if model.valid_response():
-                    logger.info(f"Model AMZN generated:  {model.total_token()}")
-                    res = model.get_generation()
-                    if not self.parse_response(res):
-                        continue
-                    return dict({"response": res, "output_tokens": model.output_token()})
-                continue
-            if self.model_type == "GOOGLE":
-                retry_count += 1
-                model = GeminiModel(self.prompt.get_prompt())
-                if model.valid_response():
-                    logger.info(f"Model GOOGLE generated:  {model.total_token()}")
-                    res = model.get_generation()
-                    p = self.gemini_parser(res)
-                    logger.info("gemini_parser %s", p)
-                    if not self.parse_response(p):
-                        continue
-                    return dict({"response": json.loads(p), "output_tokens": model.total_token()})
-                continue
+        """
+            Grade a Prompt, retrying provider failures and unparsable replies with backoff and jitter.
+
+            Returns Object
+            { "response": {score, feedback}, "output_tokens": int } or None
+        """
+        policy = RetryPolicy(max_attempts=MAX_RETRY + 1)
+        for attempt in range(policy.max_attempts):
+            logger.info("run_grade_model retry_count: %s", attempt)
+            generation = self.generate(self.prompt)
+            if generation is not None:
+                res, output_tokens = generation
+                grade = self.parse_grade(res)
+                if grade is not None:
+                    return dict({"response": grade.model_dump(), "output_tokens": output_tokens})
+                self.last_kind = PARSE
+            if not policy.retryable(self.last_kind):
+                break
+            if attempt + 1 < policy.max_attempts:
+                policy.wait(attempt, self.last_kind)
 
         return None
-    
 
+    def run_batch_grade_model(self) -> Optional[dict]:
+        """
+            Grade a BatchPrompt, parse the JSON array of {id, score, feedback} back to ids.
+            Ids missing from a reply are re-requested on their own, up to MAX_RETRY times.
+            Replies without progress are retried with backoff and jitter.
+
+            Returns Object
+            { "responses": {id: {score, feedback}}, "input_tokens": int, "output_tokens": int, "requests": int }
+            Ids that could not be graded are absent from responses.
+        """
+        policy = RetryPolicy(max_attempts=MAX_RETRY + 1)
+        prompt, responses = self.prompt, {}
+        input_tokens, output_tokens, requests = 0, 0, 0
+        wanted = set(prompt.get_ids())
+        for attempt in range(policy.max_attempts):
+            if not wanted:
+                break
+            logger.info("run_batch_grade_model retry_count: %s, missing: %s", attempt, len(wanted))
+            requests += 1
+            input_tokens += prompt.get_input_length()
+            generation = self.generate(prompt)
+            progress = False
+            if generation is not None:
+                res, tokens = generation
+                output_tokens += tokens or 0
+                self.last_kind = PARSE
+                for row in self.parse_batch(res):
+                    if row.id not in wanted:
+                        continue
+                    responses[row.id] = {"score": row.score, "feedback": row.feedback}
+                    wanted.discard(row.id)
+                    progress = True
+            if wanted:
+                prompt = self.prompt.subset(wanted)
+            if not progress:
+                if not policy.retryable(self.last_kind):
+                    break
+                if attempt + 1 < policy.max_attempts:
+                    policy.wait(attempt, self.last_kind)
+        return dict({"responses": responses, "input_tokens": input_tokens, "output_tokens": output_tokens, "requests": requests})
@@ -1,10 +1,12 @@
 from Models.AmazonModel import AmazonModel
 from Models.GeminModel import GeminiModel
+from Models.Schemas import QuestionSet, validate_json
 from Prompt.PromptQ import PromptQ
 from S3.main import S3Instance
 from Config.Client import Client
 import json
 import logging
+import os
 # --- Python logger ---
 logging.basicConfig(
     level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
@@ -16,6 +18,8 @@ logger = logging.getLogger(__name__)
 DONE = 'DONE'
 ZERO = 0
 ERROR = 'ERROR'
+# Constrain question set replies to Models.Schemas.QuestionSet, off until the schema is checked against the PromptQ contract.
+STRUCTURED_OUTPUT = os.getenv("QUESTION_STRUCTURED_OUTPUT", "0") == "1"
 s3 = S3Instance("tracker-client-storage")
 
 class QuestionGeneration:
@@ -41,10 +45,11 @@ class QuestionGeneration:
                                 self.client.get_max_points(), self.client.get_question_count(), self.client.get_grade_level(),
                                 self.client.get_difficulty())
         model = None
+        response_schema = QuestionSet if STRUCTURED_OUTPUT else None
         if self.model_type == "AMZN":
-            model = AmazonModel(prompt=prompt.get_prompt(), temp=0.5, top_p=0.9, max_gen_len=3072)
+            model = AmazonModel(prompt=prompt.get_prompt(), temp=0.5, top_p=0.9, max_gen_len=3072, response_schema=response_schema)
         if self.model_type == "GOOGLE":
-            model = GeminiModel(prompt.get_prompt())
+            model = GeminiModel(prompt.get_prompt(), response_schema=response_schema)
             logger.info(f"Model generated: {model.total_token()}")
             
         return model
@@ -54,7 +59,11 @@ class QuestionGeneration:
 
 
     def save_model_results(self, model):
-        if model.valid_response():
+        valid = model.valid_response()
+        if valid and STRUCTURED_OUTPUT:
+            # Constrained to QuestionSet, a reply that does not validate is not stored
+            valid = validate_json(QuestionSet, model.get_generation()) is not None
+        if valid:
             s3.put_object(f"assessments/{self.client.get_s3_output_key()}", model.get_generation())
             self.db.update_question_task(("COMPLETE", model.total_token(), model.total_token(), self.client.get_output_key()))
         else:
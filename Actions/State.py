@@ -1,7 +1,7 @@
 from Models.AmazonModel import AmazonModel
 from Models.GeminModel import GeminiModel
 from Config.Client import Client
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 import datetime
 import json
 import logging
@@ -17,6 +17,8 @@ MODEL_ID  = os.getenv("MODEL_ID")
 DONE = 'DONE'
 ZERO = 0
 ERROR = 'ERROR'
+# Session answers loaded and graded per page, memory stays flat on large sessions.
+ANSWERS_PAGE_SIZE = int(os.getenv("GRADER_ANSWERS_PAGE_SIZE", 2000))
 
 # Observe and manage retries for failed attempts
 class State:
@@ -55,6 +57,36 @@ class State:
         except RuntimeError as e:
             logger.error(f"unable to get assessment questions: {e}")
     
+    def load_grading_context(self, cached_ids: Optional[list] = None) -> Optional[dict]:
+        """
+            Task upsert, item/student seeding and every read needed to grade the session in a single round trip.
+            Params: cached_ids (list), assessments already cached, their rows are not loaded.
+
+            Returns Object
+            { task: {id, status, attempts}, completed: int, items: list(dict), task_map: {item_key: item}, assessment_ids: list(int),
+              students: {student_id (str): {id, student_id, assessment_id}}, assessments: list(dict), questions: list(dict) }
+            None when there is no session to grade. A failed query raises RuntimeError, the caller retries the delivery.
+        """
+        if self.client is None:
+            return None
+        data = self.db.load_grading_context(self.client.get_session_token(), self.client.get_session_id(), MODEL_ID, cached_ids)
+        if data is None:
+            return None
+        data["task_map"] = {i['item_key']: i for i in data["items"]}
+        data["assessment_ids"] = [int(item['assessment_id']) for item in data["students"]]
+        data["students"] = {str(item['student_id']): item for item in data["students"]}
+        return data
+
+    def load_assessments(self, assessment_ids: list[int]) -> tuple:
+        """
+            Assessments and correct choices of assessment_ids, for bundles missing from the AssessmentCache.
+            Params: assessment_ids list(int)
+
+            Returns Tuple
+            (assessments list(dict), questions list(dict))
+        """
+        return (self.get_assessments(assessment_ids) or [], self.get_assessment_questions(assessment_ids) or [])
+
     def upsert_assessment_task(self)->Optional[dict]:
         """
             Idempotent insert/return for DB table stu_tracker.Assessment_grader_task.
@@ -72,6 +104,20 @@ class State:
             logger.error(f"Unable to upsert assessment task")
             return False
         
+    def release_assessment_task_attempt(self, task_id: Optional[int]) -> bool:
+        """
+            Undo the attempt increment of upsert_assessment_task for a deferred session.
+            Params: task_id (int)
+
+            Returns Boolean
+        """
+        try:
+            self.db.release_grader_task_attempt(task_id)
+            return True
+        except RuntimeError as e:
+            logger.error(f"Unable to release assessment task attempt: {e}")
+            return False
+
     def upsert_assessment_students(self, sessions: Optional[list], session_id: Optional[int])->Optional[bool]:
         """ 
             Idempotent insert to table stu_tracker.Assessments_students to prepare score uploads.
@@ -92,12 +138,13 @@ class State:
             logger.error(f"Unable to upsert assessment task")
             return None
     
-    def upsert_assessment_items(self, session_answers: Optional[list], task_id: Optional[int])->bool:
+    def upsert_assessment_items(self, session_answers: Optional[Iterable[dict]], task_id: Optional[int])->bool:
         """ 
             Idempotent insert to table stu_tracker.Grader_task_item. 
             Items need to be proccessed and marked as completed to finish this process.
-            Required session_answers reference by id and task_id
-            Params: session_answers (list), task_id(int)
+            Required session_answers reference by id and task_id, written in pages so a generator can be streamed in.
+            Legacy, on_message seeds the items with load_grading_context.
+            Params: session_answers (iterable of dict), task_id(int)
 
             Returns Boolean
              
@@ -151,53 +198,65 @@ class State:
             data = self.db.get_assessment_students(session_id)
             if data is None:
                 return None
-            smap = {f'{item['student_id']}': item for item in data }
+            smap = {f"{item['student_id']}": item for item in data }
             return smap
         except RuntimeError as e:
             logger.info("unable to get get_assessment_students:", e)
             return None
 
-    def upsert_grader_results(self, sessions: Optional[list[dict]], task_id: Optional[int], 
-                              task_map: Optional[dict], assessments_students: Optional[dict], session_items_graded_details: Optional[dict]) -> list:
-        """
-            Idempodent bulk update for the following table in order.
-            1. stu_tracker.Assessment_answers update -> points, choice_id, is_correct, feedback
-            2. stu_tracker.Grader_task_item udpate -> attempts, updated_at, status
-            3. stu_tracker.Assessment_grader_task udpate -> attempts, updated_at, status
-            4. stu_tracker.Assessments_students udpate -> student_id, assessment_id, session_id, score
+    def grader_rows(self, sessions: list[dict], task_map: dict, assessments_students: dict) -> tuple:
+        """
+            Graded items -> Assessment_answers rows and the Grader_task_item rows marking them COMPLETED.
 
-            Failure will result in a retry.
+            Returns Tuple
+            (an_rows list(tuple), gr_rows list(tuple))
+        """
+        current_date = datetime.datetime.now()
+        an_rows = [
+            (assessments_students[str(s['student_id'])]['id'], s['question_id'], s['choice_id'], s.get("answer_text"), s.get("is_correct"), s.get("feedback"), s.get("points"))
+            for s in sessions
+        ]
+        gr_rows = [
+            ('COMPLETED', current_date, task_map[s['assessment_student_id']]['item_key'])
+            for s in sessions
+        ]
+        return (an_rows, gr_rows)
 
-            Params: sessions (graded_items, list), task_id (int), task_map (dict), assessment_students (dict), session_items_graded_details (dict)
+    def checkpoint_grader_results(self, sessions: Optional[list[dict]], task_map: Optional[dict], assessments_students: Optional[dict]) -> bool:
+        """
+            Persist graded items right away (answers + Grader_task_item COMPLETED, one transaction).
+            A failed checkpoint leaves its items pending, they are graded again on the next delivery.
+            Params: sessions (graded items, list), task_map (dict), assessments_students (dict)
 
-            Returns list(dict)
-            Graded items
-            dict{ "answers_upserted","grader_items_updated", "assessment_task_updated", "update_assessment_session_score" }
+            Returns Boolean
         """
         try:
-            if len(sessions) == 0 or assessments_students is None:
-                return None
-            current_date = datetime.datetime.now()         
-            an_rows = [
-                (assessments_students[str(s['student_id'])]['id'], s['question_id'], s['choice_id'], s.get("answer_text"), s.get("is_correct"), s.get("feedback"), s.get("points"))
-                for s in sessions
-            ]
-            logger.info("an_rows", an_rows)
-            gr_rows = [
-                ('COMPLETED', current_date , task_map[s['assessment_student_id']]['item_key'])
-                for s in sessions
-            ]
+            if not sessions:
+                return True
+            an_rows, gr_rows = self.grader_rows(sessions, task_map, assessments_students)
+            res = self.db.checkpoint_items(an_rows, gr_rows)
+            logger.info("checkpoint: %s", res)
+            return True
+        except (RuntimeError, KeyError) as e:
+            logger.error("unable to checkpoint grader results: %s", e)
+            return False
 
-            tr_rows = [
-                (key, assessments_students[str(key)]['assessment_id'], self.client.get_session_id(), value['score']) for key, value in session_items_graded_details.items()
-            ]
-            res = self.db.bulk_update(an_rows, gr_rows, tr_rows, task_id)
-            return res
+    def finalize_grader_task(self, task_id: Optional[int]) -> Optional[dict]:
+        """
+            Score roll-up from the checkpointed answers, completes the task once no item is pending.
+            Params: task_id (int)
+
+            Returns Object
+            dict{pending, scores_updated, task_updated} or None
+        """
+        try:
+            if self.client is None:
+                return None
+            return self.db.finalize_grader_task(task_id, self.client.get_session_id())
         except RuntimeError as e:
-            logger.error("unable to upsert grader_results", e)
+            logger.error(f"Unable to finalize grader task: {e}")
             return None
 
-
     def update_llm_usage(self, usage: Optional[list[tuple]])->int:
         try:
             return self.db.update_llm_usage(usage)
@@ -222,6 +281,23 @@ class State:
             logger.error(f"Error found grade_assessment: {e}")
             return None
 
+    def iter_session_answers(self, item_keys: list, page_size: Optional[int] = None) -> Iterator[list]:
+        """
+            Page the answers of item_keys from stu_tracker.Session_answers, page_size keys per query,
+            so a session is graded one page at a time. Each page is a short read, no connection is held
+            while it is graded. A failed query raises RuntimeError, the items left stay pending for the retry.
+            Params: item_keys (list), page_size (int)
+
+            Yields list(dict)
+            dict{id, assessment_id, student_id, question_id, choice_id, answer_text}
+        """
+        if self.client is None:
+            return
+        page_size = page_size or ANSWERS_PAGE_SIZE
+        keys = sorted(int(key) for key in item_keys)
+        for start in range(0, len(keys), page_size):
+            yield self.db.get_session_answers_by_item_key(keys[start:start + page_size]) or []
+
     def get_sessions_answers(self) ->list:
         """
             Get session answers from stu_tracker.Session_answers.
@@ -0,0 +1,110 @@
+# test_assessment_cache.py
+import types
+import pytest
+
+from Actions.AssessmentCache import AssessmentCache
+
+
+# ---------- Fakes / helpers ----------
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Listener:
+    def __init__(self):
+        self.notifies = []
+        self.fail = False
+
+    def poll(self):
+        if self.fail:
+            raise OSError("connection lost")
+
+    def notify(self, payload):
+        self.notifies.append(types.SimpleNamespace(channel="assessment_changed", payload=payload))
+
+
+class _FakeDb:
+    def __init__(self, fail=False):
+        self.listener = _Listener()
+        self.fail = fail
+        self.listens = 0
+
+    def listen(self, channel):
+        self.listens += 1
+        if self.fail:
+            raise RuntimeError("Database listen failed")
+        return self.listener
+
+
+def _build(assessments, questions):
+    return {a["id"]: dict(a, questions={q["question_id"]: q for q in questions if q["assessment_id"] == a["id"]}) for a in assessments}
+
+
+def _rows(*ids):
+    return [{"id": i, "title": f"A{i}"} for i in ids], [{"assessment_id": i, "question_id": i * 10} for i in ids]
+
+
+@pytest.fixture
+def cache():
+    return AssessmentCache(_FakeDb(), max_size=2, ttl=60, clock=_Clock())
+
+
+# ---------- Tests ----------
+
+def test_second_session_skips_the_load(cache):
+    loads = []
+    bundles = cache.resolve([1, 2], *_rows(1, 2), _build, lambda ids: loads.append(ids))
+    assert set(bundles) == {1, 2} and bundles[1]["questions"] == {10: {"assessment_id": 1, "question_id": 10}}
+    assert sorted(cache.cached_ids()) == [1, 2]
+
+    # Context query skipped both ids, nothing fetched and nothing reloaded
+    again = cache.resolve([1, 2], [], [], _build, lambda ids: loads.append(ids))
+    assert again[2] is bundles[2] and loads == []
+    assert cache.metrics()["hits"] == 2
+
+
+def test_notify_invalidates_and_reloads(cache):
+    cache.resolve([1, 2], *_rows(1, 2), _build, None)
+    cache.db.listener.notify("1")
+    assert cache.cached_ids() == [2]
+
+    cache.put_many(_build(*_rows(1)))
+    cache.db.listener.notify("1")
+    # Invalidated after the context query ran: reloaded on the spot
+    bundles = cache.resolve([1, 2], [], [], _build, lambda ids: _rows(*ids))
+    assert set(bundles) == {1, 2}
+    assert cache.metrics()["invalidations"] == 2
+
+
+def test_ttl_and_size_bound(cache):
+    cache.put_many(_build(*_rows(1, 2)))
+    cache.get_many([1])
+    cache.put_many(_build(*_rows(3)))
+    # 2 was least recently used
+    assert sorted(cache.cached_ids()) == [1, 3]
+    cache.clock.now = 61
+    assert cache.get_many([1, 3]) == {}
+    assert cache.metrics()["expired"] == 2 and cache.metrics()["evictions"] == 1
+
+
+def test_lost_listener_clears_cache(cache):
+    cache.put_many(_build(*_rows(1)))
+    cache.db.listener.fail = True
+    assert cache.cached_ids() == []
+    assert cache.metrics()["resets"] == 1
+    cache.db.listener.fail = False
+    cache.cached_ids()
+    assert cache.db.listens == 2
+
+
+def test_listen_failure_falls_back_to_ttl():
+    db = _FakeDb(fail=True)
+    cache = AssessmentCache(db, ttl=60, clock=_Clock())
+    cache.put_many(_build(*_rows(1)))
+    assert cache.cached_ids() == [1] and cache.cached_ids() == [1]
+    assert db.listens == 1
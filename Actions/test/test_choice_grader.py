@@ -0,0 +1,68 @@
+# test_choice_grader.py
+from decimal import Decimal
+import pytest
+
+from Actions.ChoiceGrader import ChoiceGrader
+
+
+# ---------- Fakes / helpers ----------
+
+def _build():
+    return {
+        1: {"id": 1, "questions": {
+            10: {"question_id": 10, "question_type": "multiple_choice", "choice_id": 100, "points": Decimal("2")},
+            11: {"question_id": 11, "question_type": "short_answer", "choice_id": None, "points": Decimal("5")},
+        }},
+        2: {"id": 2, "questions": {
+            20: {"question_id": 20, "question_type": "multiple_choice", "choice_id": 200, "points": 1},
+        }},
+    }
+
+
+def _session():
+    return [
+        {"id": 1, "assessment_id": 1, "student_id": 7, "question_id": 10, "choice_id": 100, "answer_text": None},
+        {"id": 2, "assessment_id": 1, "student_id": 7, "question_id": 11, "choice_id": None, "answer_text": "words"},
+        {"id": 3, "assessment_id": 2, "student_id": 8, "question_id": 20, "choice_id": 201, "answer_text": None},
+        {"id": 4, "assessment_id": 2, "student_id": 8, "question_id": 20, "choice_id": None, "answer_text": None},
+        {"id": 5, "assessment_id": 2, "student_id": 7, "question_id": 20, "choice_id": 200, "answer_text": None},
+    ]
+
+
+# ---------- Tests ----------
+
+def test_grade_matches_dict_rows():
+    graded, is_short = ChoiceGrader.from_build(_build()).grade(_session())
+    assert is_short.tolist() == [False, True, False, False, False]
+
+    updates = ChoiceGrader.to_updates(graded)
+    assert updates[0] == {"assessment_student_id": 1, "student_id": 7, "question_id": 10, "choice_id": None,
+                          "answer_text": None, "is_correct": True, "points": 2.0}
+    assert [u["is_correct"] for u in updates] == [True, False, False, False, True]
+    assert [u["points"] for u in updates] == [2.0, 0.0, 0.0, 0.0, 1.0]
+    # psycopg2 cannot adapt numpy scalars
+    assert type(updates[0]["assessment_student_id"]) is int and type(updates[0]["is_correct"]) is bool
+
+
+def test_from_questions_keeps_last_correct_choice():
+    rows = [
+        {"assessment_id": 1, "question_id": 10, "choice_id": 99, "points": 2, "question_type": "multiple_choice"},
+        {"assessment_id": 1, "question_id": 10, "choice_id": 100, "points": 2, "question_type": "multiple_choice"},
+    ]
+    graded, _ = ChoiceGrader.from_questions(rows).grade(_session()[:1])
+    assert graded["is_correct"].tolist() == [True]
+
+
+def test_unknown_question_raises():
+    session = [{"id": 1, "assessment_id": 3, "student_id": 7, "question_id": 30, "choice_id": 1, "answer_text": None}]
+    with pytest.raises(KeyError):
+        ChoiceGrader.from_build(_build()).grade(session)
+
+
+def test_totals():
+    graded = [
+        {"student_id": 7, "points": Decimal("2")},
+        {"student_id": 8, "points": 0},
+        {"student_id": 7, "points": 1.5},
+    ]
+    assert ChoiceGrader.totals(graded) == {7: {"score": 3.5}, 8: {"score": 0.0}}
@@ -0,0 +1,91 @@
+# test_grade_cache.py
+import pytest
+
+from Actions.GradeCache import GradeCache, normalize_answer, question_version
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeDB:
+    """In memory stand-in for the stu_tracker.Grade_cache methods of PostgresClient."""
+    def __init__(self):
+        self.rows = {}
+        self.reads = 0
+
+    def get_grade_cache(self, keys):
+        self.reads += 1
+        return [
+            {"question_id": k[0], "question_version": k[1], "answer_key": k[2], "model_id": k[3], "score": v[0], "feedback": v[1]}
+            for k, v in self.rows.items() if k in keys
+        ]
+
+    def upsert_grade_cache(self, params):
+        for row in params:
+            self.rows[tuple(row[:4])] = tuple(row[4:])
+        return len(params)
+
+    def delete_grade_cache(self, question_id, keep_version=None):
+        for k in [k for k in self.rows if k[0] == question_id and k[1] != keep_version]:
+            del self.rows[k]
+
+
+def _question(text="What do plants do?", points=2):
+    return {"question_id": 10, "question_text": text, "points": points, "answer_text": None}
+
+
+# ---------- Tests ----------
+
+@pytest.mark.parametrize("raw", ["photosynthesis", "Photosynthesis.", "  PHOTOSYNTHESIS! ", "photosynthesis\n"])
+def test_normalize_answer(raw):
+    assert normalize_answer(raw) == "photosynthesis"
+
+
+def test_question_version_changes_with_points():
+    assert question_version(_question()) == question_version(_question())
+    assert question_version(_question()) != question_version(_question(points=3))
+
+
+def test_memory_then_db_tier():
+    db = _FakeDB()
+    cache = GradeCache(db, max_size=10)
+    cache.put(_question(), "Photosynthesis", "GOOGLE:m", {"score": 2, "feedback": "good"})
+
+    assert cache.get(_question(), "photosynthesis.", "GOOGLE:m") == {"score": 2.0, "feedback": "good"}
+    assert db.reads == 0
+
+    # A fresh process only has the persistent tier.
+    cold = GradeCache(db, max_size=10)
+    assert cold.get(_question(), "photosynthesis", "GOOGLE:m")["feedback"] == "good"
+    assert cold.get(_question(), "photosynthesis", "GOOGLE:m")["feedback"] == "good"
+    assert db.reads == 1
+    metrics = cold.metrics()
+    assert (metrics["db_hits"], metrics["memory_hits"], metrics["misses"]) == (1, 1, 0)
+
+
+def test_model_id_is_part_of_key():
+    cache = GradeCache(None)
+    cache.put(_question(), "x", "GOOGLE:a", {"score": 1, "feedback": "f"})
+    assert cache.get(_question(), "x", "GOOGLE:b") is None
+    assert cache.metrics()["misses"] == 1
+
+
+def test_lru_eviction():
+    cache = GradeCache(None, max_size=2)
+    for answer in ["a", "b", "c"]:
+        cache.put(_question(), answer, "m", {"score": 1, "feedback": answer})
+    assert cache.get(_question(), "a", "m") is None
+    assert cache.get(_question(), "c", "m")["feedback"] == "c"
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_question_edit_invalidates():
+    db = _FakeDB()
+    cache = GradeCache(db)
+    cache.put(_question(), "x", "m", {"score": 1, "feedback": "old"})
+    cache.get(_question(), "x", "m")
+
+    edited = _question(text="What do plants do with light?")
+    assert cache.get(edited, "x", "m") is None
+    assert cache.metrics()["invalidations"] == 1
+    assert cache.metrics()["size"] == 0
+    assert db.rows == {}
@@ -0,0 +1,247 @@
+# test_grader.py
+import threading
+import time
+import pytest
+
+import Actions.Grader as mod
+from Actions.GradeCache import GradeCache
+from Models.Retry import CircuitOpenError
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeClient:
+    def get_orgainzation_id(self):
+        return 7
+
+
+def _assessment():
+    return {
+        1: {
+            "id": 1, "title": "Quiz", "description": "d", "subject_title": "s", "max_score": 10,
+            "questions": {
+                10: {"question_id": 10, "question_type": "short_answer", "question_text": "Why?", "points": 2, "choice_id": None},
+                11: {"question_id": 11, "question_type": "multiple_choice", "question_text": "Pick", "points": 1, "choice_id": 99},
+            },
+        }
+    }
+
+
+def _session():
+    return [
+        {"id": 1, "assessment_id": 1, "student_id": 100, "question_id": 10, "choice_id": None, "answer_text": "slow"},
+        {"id": 2, "assessment_id": 1, "student_id": 100, "question_id": 11, "choice_id": 99, "answer_text": None},
+        {"id": 3, "assessment_id": 1, "student_id": 101, "question_id": 10, "choice_id": None, "answer_text": "fast"},
+        {"id": 4, "assessment_id": 1, "student_id": 101, "question_id": 11, "choice_id": 98, "answer_text": None},
+    ]
+
+
+class _FakeGenerator:
+    """Stand-in for GraderGenerator, records peak concurrency."""
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    fail_on = None
+
+    def __init__(self, model_type=None, prompt=None, organization_id=None):
+        self.prompt = prompt
+
+    def run_grade_model(self):
+        cls = _FakeGenerator
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        answer = self.prompt.student_response
+        time.sleep(0.05 if answer == "slow" else 0.01)
+        with cls.lock:
+            cls.active -= 1
+        if answer == cls.fail_on:
+            return None
+        return {"response": {"score": 1.5, "feedback": answer}, "output_tokens": 3}
+
+
+@pytest.fixture(autouse=True)
+def _fake_generator(monkeypatch):
+    _FakeGenerator.active, _FakeGenerator.peak, _FakeGenerator.fail_on = 0, 0, None
+    monkeypatch.setattr(mod, "GraderGenerator", _FakeGenerator)
+    monkeypatch.setitem(mod.MAX_CONCURRENCY, mod.MODEL_TYPE, 4)
+    monkeypatch.setattr(mod, "get_grade_cache", lambda db: GradeCache(None))
+
+
+# ---------- Tests ----------
+
+def test_results_keep_session_order():
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, model_usage = grader.grade_(_assessment(), _session())
+
+    assert [u["assessment_student_id"] for u in updates] == [1, 2, 3, 4]
+    assert updates[0]["feedback"] == "slow" and updates[2]["feedback"] == "fast"
+    assert updates[1]["is_correct"] is True and updates[3]["is_correct"] is False
+    assert len(model_usage) == 2
+    assert all(u[0] == 7 and u[5] == mod.SUCCESS for u in model_usage)
+
+
+def test_short_answers_run_concurrently():
+    grader = mod.Grader(db=None, client=_FakeClient())
+    grader.grade_(_assessment(), _session())
+    assert _FakeGenerator.peak == 2
+
+
+def test_concurrency_is_bounded(monkeypatch):
+    monkeypatch.setitem(mod.MAX_CONCURRENCY, mod.MODEL_TYPE, 1)
+    grader = mod.Grader(db=None, client=_FakeClient())
+    grader.grade_(_assessment(), _session())
+    assert _FakeGenerator.peak == 1
+
+
+def test_model_failure_returns_none_with_usage():
+    _FakeGenerator.fail_on = "fast"
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, model_usage = grader.grade_(_assessment(), _session())
+    assert updates is None
+    assert mod.FAIL in [u[5] for u in model_usage]
+
+
+def test_graded_items_are_checkpointed_in_chunks(monkeypatch):
+    monkeypatch.setattr(mod, "CHECKPOINT_SIZE", 1)
+    saved = []
+    grader = mod.Grader(db=None, client=_FakeClient())
+    grader.grade_(_assessment(), _session(), checkpoint=lambda graded: saved.append(graded) or True)
+
+    # Choice items first, then every short answer as soon as it is graded
+    assert [u["assessment_student_id"] for chunk in saved[:2] for u in chunk] == [2, 4]
+    assert sorted(u["assessment_student_id"] for chunk in saved[2:] for u in chunk) == [1, 3]
+    assert [len(chunk) for chunk in saved] == [1, 1, 1, 1]
+
+
+def test_failed_checkpoint_is_offered_again():
+    saved, results = [], [False, True]
+    grader = mod.Grader(db=None, client=_FakeClient())
+    grader.grade_(_assessment(), _session(), checkpoint=lambda graded: saved.append(graded) or results.pop(0))
+
+    assert [len(chunk) for chunk in saved] == [2, 4]
+
+
+def test_model_failure_keeps_graded_items():
+    _FakeGenerator.fail_on = "fast"
+    saved = []
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, model_usage = grader.grade_(_assessment(), _session(), checkpoint=lambda graded: saved.append(graded) or True)
+    assert updates is None
+    # Usage of the successful call is still reported
+    assert sorted(u[5] for u in model_usage) == sorted([mod.SUCCESS, mod.FAIL])
+
+    # The slow answer still in flight is collected and written, the failed one stays pending
+    assert sorted(u["assessment_student_id"] for chunk in saved for u in chunk) == [1, 2, 4]
+
+
+def test_graded_items_are_checkpointed_when_a_call_raises(monkeypatch):
+    monkeypatch.setattr(mod, "CHECKPOINT_SIZE", 10)
+    run_grade_model = _FakeGenerator.run_grade_model
+
+    def _run(self):
+        if self.prompt.student_response == "fast":
+            raise CircuitOpenError("open", 5)
+        return run_grade_model(self)
+    monkeypatch.setattr(_FakeGenerator, "run_grade_model", _run)
+    saved = []
+    grader = mod.Grader(db=None, client=_FakeClient())
+    with pytest.raises(CircuitOpenError):
+        grader.grade_(_assessment(), _session(), checkpoint=lambda graded: saved.append(graded) or True)
+
+    # The slow answer was graded before the circuit opened and is not graded again
+    assert sorted(u["assessment_student_id"] for chunk in saved for u in chunk) == [1, 2, 4]
+
+
+def test_batched_prompts_rerequest_missing(monkeypatch):
+    import json
+    import Actions.GraderGenerator as gen
+    calls = []
+
+    def _generate(self, prompt):
+        calls.append(prompt.get_prompt())
+        # First reply drops id 3, second reply only carries id 3.
+        ids = [1] if len(calls) == 1 else [3]
+        rows = [{"id": i, "score": 2, "feedback": f"ok {i}"} for i in ids]
+        return ("Sure! " + json.dumps(rows) + " done", 4)
+
+    monkeypatch.setattr(mod, "GraderGenerator", gen.GraderGenerator)
+    monkeypatch.setattr(gen.GraderGenerator, "generate", _generate)
+    monkeypatch.setattr(mod, "BATCH_SIZE", 10)
+
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, model_usage = grader.grade_(_assessment(), _session())
+
+    assert len(calls) == 2
+    assert "id: 1" in calls[0] and "id: 3" in calls[0] and calls[0].count("Question: Why?") == 1
+    assert "id: 1" not in calls[1] and "id: 3" in calls[1]
+    assert updates[0]["feedback"] == "ok 1" and updates[2]["feedback"] == "ok 3"
+    assert updates[2]["is_correct"] is True
+    assert model_usage == [(7, model_usage[0][1], 8, mod.MODEL_TYPE, mod.MODEL_ID, mod.SUCCESS)]
+
+
+def test_batch_ids_returned_as_strings_are_matched(monkeypatch, caplog):
+    replies = {}
+
+    class _BatchGenerator:
+        def __init__(self, model_type=None, prompt=None, organization_id=None):
+            pass
+
+        def run_batch_grade_model(self):
+            return {"responses": dict(replies), "input_tokens": 5, "output_tokens": 4, "requests": 1}
+
+    monkeypatch.setattr(mod, "GraderGenerator", _BatchGenerator)
+    grader = mod.Grader(db=None, client=_FakeClient())
+    question = _assessment()[1]["questions"][10]
+    entries = [(0, question, _session()[0]), (2, question, _session()[2])]
+
+    replies.update({"1": {"score": 2, "feedback": "ok 1"}, "3": {"score": 1, "feedback": "ok 3"}})
+    graded, usage = grader.grade_short_answer_batch(_assessment()[1], entries)
+    assert graded[0]["feedback"] == "ok 1" and graded[2]["feedback"] == "ok 3"
+    assert usage[5] == mod.SUCCESS
+
+    replies.pop("3")
+    with caplog.at_level("WARNING"):
+        graded, usage = grader.grade_short_answer_batch(_assessment()[1], entries)
+    assert graded is None and usage[5] == mod.FAIL
+    assert "no response for ids [3]" in caplog.text
+
+
+def test_structured_batch_reply_drops_invalid_rows(monkeypatch):
+    import json
+    import Actions.GraderGenerator as gen
+    calls = []
+
+    def _generate(self, prompt):
+        calls.append(self.response_schema(prompt))
+        # Structured reply: schema wrapper object, id 3 comes back without feedback the first time
+        rows = [{"id": 1, "score": 2, "feedback": "ok 1"}, {"id": 3, "score": 1}] if len(calls) == 1 else [{"id": 3, "score": 1, "feedback": "ok 3"}]
+        return (json.dumps({"results": rows}), 4)
+
+    monkeypatch.setattr(mod, "GraderGenerator", gen.GraderGenerator)
+    monkeypatch.setattr(gen.GraderGenerator, "generate", _generate)
+    monkeypatch.setattr(gen, "STRUCTURED_OUTPUT", True)
+    monkeypatch.setattr(mod, "BATCH_SIZE", 10)
+
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, _ = grader.grade_(_assessment(), _session())
+
+    assert calls == [gen.GradeBatch, gen.GradeBatch]
+    assert updates[0]["feedback"] == "ok 1" and updates[2]["feedback"] == "ok 3"
+
+
+def test_duplicate_answers_graded_once():
+    session = _session()
+    session[2]["answer_text"] = " Slow. "
+    grader = mod.Grader(db=None, client=_FakeClient())
+    updates, model_usage = grader.grade_(_assessment(), session)
+
+    assert updates[2]["feedback"] == "slow" and updates[2]["answer_text"] == " Slow. "
+    assert [u[5] for u in model_usage] == [mod.SUCCESS, mod.CACHE_HIT]
+    assert model_usage[1][1:3] == (0, 0)
+
+    # A second session is served from the LRU without any model call.
+    _FakeGenerator.peak = 0
+    updates, model_usage = grader.grade_(_assessment(), _session()[:1])
+    assert _FakeGenerator.peak == 0
+    assert updates[0]["feedback"] == "slow" and model_usage[0][5] == mod.CACHE_HIT
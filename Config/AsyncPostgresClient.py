@@ -0,0 +1,430 @@
+import os
+import re
+import json
+import time
+import itertools
+from contextlib import asynccontextmanager
+from typing import Iterable, Optional
+import asyncpg
+from dotenv import load_dotenv
+from Config.QueryMetrics import QueryMetrics
+from Config.PostgresClient import (
+    GRADING_CONTEXT_QUERY, FINALIZE_GRADER_TASK_QUERY, PREPARED_STATEMENTS, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX, POSTGRES_POOL_TIMEOUT,
+    POSTGRES_PREPARED, SLOW_QUERY_MS, COPY_THRESHOLD, TASK_ITEM_PAGE_SIZE, numbered
+)
+import logging
+
+# --- 1. Set up basic logging to stdout ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+load_dotenv()
+# asyncpg prepares every statement it runs and keeps this many per connection, 0 behind a transaction pooling pgbouncer.
+STATEMENT_CACHE_SIZE = int(os.getenv("POSTGRES_STATEMENT_CACHE_SIZE", 256)) if POSTGRES_PREPARED else 0
+
+
+def positional(query: str, names: list, types: Optional[dict] = None) -> str:
+    """
+        %(name)s placeholders -> $1, $2 ... in the order of names, cast to types[name] when given.
+        psycopg2 sends literals, asyncpg prepares the statement and needs a type for every parameter
+        the server cannot infer (SELECT $1, $1 || 'x').
+    """
+    types = types or {}
+    for i, name in enumerate(names):
+        cast = f"::{types[name]}" if name in types else ""
+        query = query.replace(f"%({name})s", f"${i + 1}{cast}")
+    return query
+
+
+_CONTEXT_PARAMS = ["session_token", "session_id", "model_id", "cached_ids"]
+# cached_ids is cast in the query itself
+_CONTEXT_TYPES = {"session_token": "text", "session_id": "bigint", "model_id": "text"}
+_GRADING_CONTEXT_QUERY = positional(GRADING_CONTEXT_QUERY, _CONTEXT_PARAMS, _CONTEXT_TYPES)
+_FINALIZE_GRADER_TASK_QUERY = positional(FINALIZE_GRADER_TASK_QUERY, ["task_id", "session_id"])
+
+
+async def _init_connection(conn):
+    # json / jsonb columns come back decoded, like psycopg2
+    for name in ("json", "jsonb"):
+        await conn.set_type_codec(name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+class AsyncPostgresClient:
+    """
+        asyncio twin of PostgresClient on an asyncpg pool, same method names as coroutines.
+        Queries use $n placeholders and run as prepared statements (asyncpg statement cache),
+        bulk writes go through unnest() array parameters or COPY, independent calls can be
+        awaited together with asyncio.gather and run on separate pooled connections.
+
+        db = await AsyncPostgresClient.create()
+    """
+    def __init__(self, min_size: int = POSTGRES_POOL_MIN, max_size: int = POSTGRES_POOL_MAX, timeout: float = POSTGRES_POOL_TIMEOUT):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pool: Optional[asyncpg.Pool] = None
+        self.metrics = QueryMetrics()
+
+    @classmethod
+    async def create(cls, **kwargs) -> "AsyncPostgresClient":
+        client = cls(**kwargs)
+        await client.connect()
+        return client
+
+    async def connect(self):
+        try:
+            logger.info("Attempting to connect to PostgreSQL database (asyncpg).")
+            self.pool = await asyncpg.create_pool(
+                host=os.getenv("POSTGRES_URL"),
+                port=os.getenv("POSTGRES_PORT"),
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                database=os.getenv("POSTGRES_DB_NAME"),
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                init=_init_connection
+            )
+            logger.info("Successfully connected to PostgreSQL database, pool %s-%s.", self.min_size, self.max_size)
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.error("Failed to connect to PostgreSQL database.")
+            logger.exception(e)
+            raise RuntimeError("Database connection failed") from e
+
+    @asynccontextmanager
+    async def _acquire(self):
+        try:
+            async with self.pool.acquire(timeout=self.timeout) as conn:
+                yield conn
+        except TimeoutError as e:
+            raise RuntimeError(f"No database connection available after {self.timeout}s") from e
+
+    @asynccontextmanager
+    async def _instrument(self, name: str, query, params=None):
+        result = {"rows": 0}
+        started = time.perf_counter()
+        try:
+            yield result
+        except Exception:
+            self.metrics.record(name, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        slow = elapsed_ms >= SLOW_QUERY_MS
+        self.metrics.record(name, elapsed_ms, result["rows"], slow=slow)
+        if slow:
+            logger.warning("Slow query %s took %.1fms (%s rows): %s params: %s", name, elapsed_ms, result["rows"], query, params)
+
+    def get_metrics(self) -> dict:
+        pool = {"max_size": self.max_size}
+        if self.pool is not None:
+            pool["size"] = self.pool.get_size()
+            pool["idle"] = self.pool.get_idle_size()
+        return {"queries": self.metrics.snapshot(), "pool": pool}
+
+    async def fetch_one(self, query, *params, name: str = "fetch_one"):
+        try:
+            async with self._instrument(name, query, params) as result, self._acquire() as conn:
+                row = await conn.fetchrow(query, *params)
+                result["rows"] = int(row is not None)
+                return dict(row) if row is not None else None
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error(f"Failed to execute query: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed") from e
+
+    async def fetch_all(self, query, *params, name: str = "fetch_all"):
+        try:
+            async with self._instrument(name, query, params) as result, self._acquire() as conn:
+                rows = await conn.fetch(query, *params)
+                result["rows"] = len(rows)
+                return [dict(r) for r in rows]
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error(f"Failed to execute query: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed") from e
+
+    async def execute_res(self, query, *params, name: str = "execute"):
+        """
+            Returns the affected row count parsed from the command tag ("UPDATE 3" -> 3).
+        """
+        try:
+            async with self._instrument(name, query, params) as result, self._acquire() as conn:
+                tag = await conn.execute(query, *params)
+                result["rows"] = affected(tag)
+                return result["rows"]
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error(f"Failed to execute command: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database command failed") from e
+
+    async def execute(self, query, *params, name: str = "execute"):
+        await self.execute_res(query, *params, name=name)
+
+    async def get_assessments(self, ids: list[int]):
+        _, query = PREPARED_STATEMENTS["get_assessments"]
+        return await self.fetch_all(numbered(query), [int(i) for i in ids], name="get_assessments")
+
+    async def get_assessment_questions(self, ids: list[int]):
+        _, query = PREPARED_STATEMENTS["get_assessment_questions"]
+        return await self.fetch_all(numbered(query), [int(i) for i in ids], name="get_assessment_questions")
+
+    async def get_session_answers_by_item_key(self, item_keys: list[int]):
+        _, query = PREPARED_STATEMENTS["get_session_answers_by_item_key"]
+        return await self.fetch_all(numbered(query), [int(i) for i in item_keys], name="get_session_answers_by_item_key")
+
+    async def get_session_answers(self, session_token: str):
+        query = """
+            SELECT id, assessment_id, student_id, question_id, choice_id, answer_text
+            FROM stu_tracker.Session_answers WHERE session_token = $1;
+        """
+        return await self.fetch_all(query, session_token, name="get_session_answers")
+
+    async def load_grading_context(self, session_token: str, session_id: int, model_id: str, cached_ids: Optional[list] = None):
+        data = await self.fetch_one(_GRADING_CONTEXT_QUERY, session_token, session_id, model_id,
+                                    [int(i) for i in cached_ids or []], name="load_grading_context")
+        if data is None or data["task"] is None:
+            return None
+        return data
+
+    async def update_llm_usage(self, params):
+        query = """
+            INSERT INTO stu_tracker.LLM_usage (organization_id, input_tokens, output_tokens, model, provider, status)
+            VALUES ($1, $2, $3, $4, $5, $6);
+        """
+        try:
+            async with self._instrument("update_llm_usage", query, f"{len(params)} rows") as result, self._acquire() as conn:
+                # executemany pipelines the rows over one prepared statement
+                await conn.executemany(query, params)
+                result["rows"] = len(params)
+                return len(params)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error("unable to update llm usage: %s", e)
+            return None
+
+    async def get_grade_cache(self, keys: list[tuple]):
+        query = """
+            SELECT question_id, question_version, answer_key, model_id, score, feedback
+            FROM stu_tracker.Grade_cache
+            WHERE question_id = ANY($1) AND answer_key = ANY($2) AND model_id = ANY($3);
+        """
+        return await self.fetch_all(query, list({k[0] for k in keys}), list({k[2] for k in keys}), list({k[3] for k in keys}),
+                                    name="get_grade_cache")
+
+    async def upsert_grade_cache(self, params):
+        query = """
+            INSERT INTO stu_tracker.Grade_cache (question_id, question_version, answer_key, model_id, score, feedback)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (question_id, question_version, answer_key, model_id) DO UPDATE SET
+                score    = EXCLUDED.score,
+                feedback = EXCLUDED.feedback;
+        """
+        try:
+            async with self._instrument("upsert_grade_cache", query, f"{len(params)} rows") as result, self._acquire() as conn:
+                await conn.executemany(query, params)
+                result["rows"] = len(params)
+                return len(params)
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error(f"Failed to execute query: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed") from e
+
+    async def delete_grade_cache(self, question_id: int, keep_version: str = None):
+        query = """
+            DELETE FROM stu_tracker.Grade_cache
+            WHERE question_id = $1 AND ($2::text IS NULL OR question_version <> $2);
+        """
+        return await self.execute_res(query, question_id, keep_version, name="delete_grade_cache")
+
+    async def get_grader_task_items(self, task_id: int):
+        query = """
+            SELECT id, item_key, task_id, status, attempts FROM stu_tracker.Grader_task_item
+            WHERE task_id = $1 AND status IN ('PENDING', 'FAILED_RETRYABLE')
+        """
+        return await self.fetch_all(query, task_id, name="get_grader_task_items")
+
+    async def get_grader_task_id(self, session_token):
+        query = """ SELECT id, status, attempts FROM stu_tracker.Assessment_grader_task WHERE session_token = $1;"""
+        return await self.fetch_one(query, session_token, name="get_grader_task_id")
+
+    async def create_grader_task(self, params):
+        query = """
+            INSERT INTO stu_tracker.Assessment_grader_task (session_token, model_id)
+            VALUES ($1, $2) ON CONFLICT(session_token, model_id) DO UPDATE SET attempts = Assessment_grader_task.attempts + 1 RETURNING attempts, status, id;
+        """
+        return await self.fetch_one(query, *params, name="create_grader_task")
+
+    async def release_grader_task_attempt(self, task_id: int):
+        query = """
+            UPDATE stu_tracker.Assessment_grader_task SET attempts = GREATEST(attempts - 1, 0) WHERE id = $1;
+        """
+        return await self.execute_res(query, task_id, name="release_grader_task_attempt")
+
+    async def delete_grader_task(self, session_token):
+        query = """
+            DELETE FROM stu_tracker.Assessment_grader_task WHERE session_token = $1;
+        """
+        await self.execute(query, session_token, name="delete_grader_task")
+
+    async def delete_assessment_session(self, session_token):
+        query = """
+            DELETE FROM stu_tracker.Assessment_sessions WHERE session_token = $1;
+        """
+        await self.execute(query, session_token, name="delete_assessment_session")
+
+    async def get_assessment_students(self, session_id):
+        query = """ SELECT id, student_id, assessment_id FROM stu_tracker.Assessments_students WHERE session_id = $1;"""
+        return await self.fetch_all(query, session_id, name="get_assessment_students")
+
+    async def upsert_assessment_students(self, params):
+        query = """
+            INSERT INTO stu_tracker.Assessments_students (session_id, student_id, score, assessment_id, subject_id)
+            SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::numeric[], $4::bigint[], $5::bigint[])
+            ON CONFLICT (student_id, assessment_id, session_id) DO UPDATE SET
+                score = EXCLUDED.score
+            RETURNING session_id, student_id, id;
+        """
+        return await self.fetch_all(query, *columns(params, 5), name="upsert_assessment_students")
+
+    async def create_grader_task_item(self, sessions: Iterable[dict], model: str, task_id: int, page_size: int = TASK_ITEM_PAGE_SIZE) -> int:
+        """
+            Idempotent insert of one Grader_task_item per session answer, page_size rows per statement and transaction.
+            Returns int, rows written
+        """
+        query = """
+            INSERT INTO stu_tracker.Grader_task_item(item_key, task_id, idempotency_key)
+            SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::text[])
+            ON CONFLICT (task_id, item_key) DO UPDATE SET idempotency_key = EXCLUDED.idempotency_key;
+        """
+        rows = ((s['id'], task_id, f"{model}:{s['id']}") for s in sessions)
+        written = 0
+        while True:
+            page = list(itertools.islice(rows, page_size))
+            if not page:
+                return written
+            try:
+                async with self._instrument("create_grader_task_item", query, f"{len(page)} rows") as result, self._acquire() as conn:
+                    result["rows"] = affected(await conn.execute(query, *columns(page, 3)))
+                    written += result["rows"]
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+                logger.error(f"Failed to execute command: {query}")
+                logger.exception(e)
+                raise RuntimeError("Database command failed") from e
+
+    async def checkpoint_items(self, an_rows, gr_rows) -> dict:
+        """
+            Same contract as PostgresClient.checkpoint_items: answers and their items COMPLETED in one transaction.
+        """
+        use_copy = len(an_rows) >= COPY_THRESHOLD
+        try:
+            async with self._instrument("checkpoint_items", f"checkpoint_items ({'copy' if use_copy else 'unnest'})", f"{len(an_rows)} answers") as result, \
+                    self._acquire() as conn:
+                result["rows"] = len(an_rows)
+                async with conn.transaction():
+                    answers_count = await self._merge_answers(conn, an_rows, use_copy)
+                    items_count = await self._merge_grader_items(conn, gr_rows, use_copy)
+                    if answers_count != len(an_rows) or items_count != len(gr_rows):
+                        raise RuntimeError(f"Partial checkpoint: {answers_count}/{len(an_rows)} answers, {items_count}/{len(gr_rows)} items")
+                    return {"answers_upserted": answers_count, "grader_items_updated": items_count}
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error("Checkpoint rolled back: %s", e)
+            raise RuntimeError("Database command failed") from e
+
+    async def finalize_grader_task(self, task_id: int, session_id: int) -> dict:
+        try:
+            async with self._instrument("finalize_grader_task", _FINALIZE_GRADER_TASK_QUERY, (task_id, session_id)) as result, \
+                    self._acquire() as conn:
+                async with conn.transaction():
+                    data = dict(await conn.fetchrow(_FINALIZE_GRADER_TASK_QUERY, task_id, session_id))
+                result["rows"] = data["scores_updated"]
+                return data
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+            logger.error("Finalize rolled back: %s", e)
+            raise RuntimeError("Database command failed") from e
+
+    async def _stage(self, conn, table: str, source: str, cols: list, rows: list):
+        await conn.execute(f"CREATE TEMP TABLE {table} ON COMMIT DROP AS SELECT {', '.join(cols)} FROM {source} WITH NO DATA;")
+        await conn.copy_records_to_table(table, records=rows, columns=cols)
+
+    async def _run_merge(self, conn, query: str, params: list) -> int:
+        return affected(await conn.execute(query + ";", *params))
+
+    async def _merge_answers(self, conn, rows, use_copy: bool) -> int:
+        cols = ["assessment_student_id", "question_id", "choice_id", "answer_text", "is_correct", "feedback", "points"]
+        if use_copy:
+            await self._stage(conn, "tmp_assessment_answers", "stu_tracker.Assessment_answers", cols, rows)
+            source, params = f"SELECT {', '.join(cols)} FROM tmp_assessment_answers", []
+        else:
+            source = "SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::boolean[], $6::text[], $7::numeric[])"
+            params = columns(rows, 7)
+        query = f"""
+            INSERT INTO stu_tracker.Assessment_answers ({', '.join(cols)})
+            {source}
+            ON CONFLICT (assessment_student_id, question_id, choice_id) DO UPDATE SET
+                choice_id   = EXCLUDED.choice_id,
+                answer_text = EXCLUDED.answer_text,
+                is_correct  = EXCLUDED.is_correct,
+                feedback    = EXCLUDED.feedback,
+                points      = EXCLUDED.points"""
+        return await self._run_merge(conn, query, params)
+
+    async def _merge_grader_items(self, conn, rows, use_copy: bool) -> int:
+        if use_copy:
+            await self._stage(conn, "tmp_grader_task_item", "stu_tracker.Grader_task_item", ["status", "updated_at", "item_key"], rows)
+            source, params = "tmp_grader_task_item", []
+        else:
+            source = "unnest($1::text[], $2::timestamp[], $3::bigint[]) AS u(status, updated_at, item_key)"
+            params = columns(rows, 3)
+        query = f"""
+            UPDATE stu_tracker.Grader_task_item AS g
+            SET
+                status = v.status,
+                attempts = g.attempts + 1,
+                updated_at = v.updated_at
+            FROM (SELECT status, updated_at, item_key FROM {source}) AS v
+            WHERE g.item_key = v.item_key"""
+        return await self._run_merge(conn, query, params)
+
+    async def listen(self, channel: str, callback):
+        """
+            Dedicated connection (outside the pool) calling callback(payload) on NOTIFY channel.
+            Returns the connection, close it to stop listening.
+        """
+        try:
+            conn = await asyncpg.connect(
+                host=os.getenv("POSTGRES_URL"),
+                port=os.getenv("POSTGRES_PORT"),
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                database=os.getenv("POSTGRES_DB_NAME")
+            )
+            await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+            logger.info("Listening on %s", channel)
+            return conn
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.error("Failed to LISTEN on %s", channel)
+            logger.exception(e)
+            raise RuntimeError("Database listen failed") from e
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            logger.info("PostgreSQL connection pool closed.")
+
+
+def affected(tag: Optional[str]) -> int:
+    """
+        Row count of a command tag: "INSERT 0 5" -> 5, "UPDATE 3" -> 3.
+    """
+    match = re.search(r"(\d+)$", tag or "")
+    return int(match.group(1)) if match else 0
+
+
+def columns(rows: list, width: int) -> list:
+    """
+        Row tuples -> one list per column, for unnest() array parameters.
+    """
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(col) for col in zip(*rows)]
@@ -1,10 +1,20 @@
 import os
+from typing import Iterable, Optional
 from contextlib import contextmanager
 import psycopg2
 from psycopg2.extras import RealDictCursor, execute_values
-from psycopg2 import OperationalError, ProgrammingError, Error
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2 import OperationalError, ProgrammingError, InterfaceError, Error
 from dotenv import load_dotenv
-import datetime
+from Config.QueryMetrics import QueryMetrics
+import csv
+import io
+import itertools
+import random
+import re
+import sys
+import threading
+import time
 import logging
 
 # --- 1. Set up basic logging to stdout ---
@@ -15,24 +25,218 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Connections kept open / allowed per process, checkout waits up to POSTGRES_POOL_TIMEOUT seconds when all are busy.
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", 1))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", 10))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 30))
+# Connections idle longer than this are pinged before being handed out.
+POSTGRES_HEALTH_CHECK_IDLE = float(os.getenv("POSTGRES_HEALTH_CHECK_IDLE", 30))
+# Server side prepared statements for the hot queries, turn off behind a transaction pooling pgbouncer.
+POSTGRES_PREPARED = os.getenv("POSTGRES_PREPARED", "1") == "1"
+# checkpoint_items switches to COPY + set based merges from this many answer rows.
+COPY_THRESHOLD = int(os.getenv("POSTGRES_COPY_THRESHOLD", 500))
+# Queries slower than this (ms) are logged with their parameters.
+SLOW_QUERY_MS = float(os.getenv("POSTGRES_SLOW_QUERY_MS", 200))
+# Share of slow SELECTs re-run under EXPLAIN (ANALYZE, BUFFERS), 0 disables.
+EXPLAIN_SAMPLE_RATE = float(os.getenv("POSTGRES_EXPLAIN_SAMPLE_RATE", 0))
+# Rows per statement/transaction in create_grader_task_item (legacy, items are seeded by GRADING_CONTEXT_QUERY).
+TASK_ITEM_PAGE_SIZE = int(os.getenv("POSTGRES_TASK_ITEM_PAGE_SIZE", 1000))
+# NULL marker in the COPY CSV stream, keeps empty strings distinct from NULL.
+COPY_NULL = "\\N"
+
+# name -> (argument types, query with %s placeholders). Prepared once per connection on checkout,
+# array parameters keep a single plan whatever the number of ids.
+PREPARED_STATEMENTS = {
+    "get_assessments": (("int[]",), """
+        SELECT ast.id, ast.title, ast.max_score, ast.easy_score, ast.description, sj.title AS subject_title
+        FROM stu_tracker.Assessments ast
+        LEFT JOIN stu_tracker.Subjects sj ON sj.id = ast.subject_id
+        WHERE ast.id = ANY(%s)
+    """),
+    "get_assessment_questions": (("int[]",), """
+        SELECT
+        q.assessment_id AS assessment_id,
+        q.id AS question_id,
+        q.question_text,
+        c.id AS choice_id,
+        c.question_id,
+        c.is_correct,
+        q.points,
+        q.question_type
+        FROM stu_tracker.Choices c
+        INNER JOIN stu_tracker.Questions q ON c.question_id = q.id
+        WHERE q.assessment_id = ANY(%s) AND c.is_correct = TRUE
+        ORDER BY c.question_id, c.order_number
+    """),
+    "get_session_answers_by_item_key": (("int[]",), """
+        SELECT id, assessment_id, student_id, question_id, choice_id, answer_text
+        FROM stu_tracker.Session_answers WHERE id = ANY(%s)
+    """),
+}
+
+
+# One round trip context load for on_message, see PostgresClient.load_grading_context.
+GRADING_CONTEXT_QUERY = """
+    WITH task AS (
+        INSERT INTO stu_tracker.Assessment_grader_task (session_token, model_id)
+        VALUES (%(session_token)s, %(model_id)s)
+        ON CONFLICT (session_token, model_id) DO UPDATE SET attempts = Assessment_grader_task.attempts + 1
+        RETURNING id, status, attempts
+    ),
+    existing_items AS (
+        SELECT g.id, g.item_key, g.task_id, g.status, g.attempts
+        FROM stu_tracker.Grader_task_item g JOIN task t ON g.task_id = t.id
+        WHERE g.status IN ('PENDING', 'FAILED_RETRYABLE')
+    ),
+    completed_items AS (
+        SELECT count(*) AS n
+        FROM stu_tracker.Grader_task_item g JOIN task t ON g.task_id = t.id
+        WHERE g.status = 'COMPLETED'
+    ),
+    seed AS (
+        SELECT sa.id, sa.assessment_id, sa.student_id
+        FROM stu_tracker.Session_answers sa
+        WHERE sa.session_token = %(session_token)s
+          AND NOT EXISTS (SELECT 1 FROM existing_items)
+          AND (SELECT n FROM completed_items) = 0
+    ),
+    new_items AS (
+        INSERT INTO stu_tracker.Grader_task_item (item_key, task_id, idempotency_key)
+        SELECT s.id, t.id, %(model_id)s || ':' || s.id FROM seed s, task t
+        ON CONFLICT (task_id, item_key) DO NOTHING
+        RETURNING id, item_key, task_id, status, attempts
+    ),
+    new_students AS (
+        INSERT INTO stu_tracker.Assessments_students (session_id, student_id, score, assessment_id, subject_id)
+        SELECT DISTINCT %(session_id)s, s.student_id, 0, s.assessment_id, NULL::int FROM seed s
+        ON CONFLICT (student_id, assessment_id, session_id) DO UPDATE SET score = EXCLUDED.score
+        RETURNING id, student_id, assessment_id
+    ),
+    items AS (
+        SELECT * FROM existing_items
+        UNION ALL
+        SELECT * FROM new_items
+    ),
+    students AS (
+        SELECT id, student_id, assessment_id FROM stu_tracker.Assessments_students WHERE session_id = %(session_id)s
+        UNION
+        SELECT id, student_id, assessment_id FROM new_students
+    ),
+    assessments AS (
+        SELECT ast.id, ast.title, ast.max_score, ast.easy_score, ast.description, sj.title AS subject_title
+        FROM stu_tracker.Assessments ast
+        LEFT JOIN stu_tracker.Subjects sj ON sj.id = ast.subject_id
+        WHERE ast.id IN (SELECT assessment_id FROM students) AND NOT ast.id = ANY(%(cached_ids)s::int[])
+    ),
+    questions AS (
+        SELECT q.assessment_id, q.id AS question_id, q.question_text, c.id AS choice_id,
+               c.is_correct, q.points, q.question_type, c.order_number
+        FROM stu_tracker.Choices c
+        INNER JOIN stu_tracker.Questions q ON c.question_id = q.id
+        WHERE q.assessment_id IN (SELECT assessment_id FROM students) AND c.is_correct = TRUE
+          AND NOT q.assessment_id = ANY(%(cached_ids)s::int[])
+    )
+    SELECT
+        (SELECT row_to_json(t) FROM task t) AS task,
+        (SELECT n FROM completed_items) AS completed,
+        (SELECT COALESCE(json_agg(i), '[]') FROM items i) AS items,
+        (SELECT COALESCE(json_agg(s), '[]') FROM students s) AS students,
+        (SELECT COALESCE(json_agg(a), '[]') FROM assessments a) AS assessments,
+        (SELECT COALESCE(json_agg(q ORDER BY q.question_id, q.order_number), '[]') FROM questions q) AS questions;
+"""
+# Score roll-up from the checkpointed answers, the task is completed only once none of its items is left to grade.
+FINALIZE_GRADER_TASK_QUERY = """
+    WITH pending AS (
+        SELECT count(*) AS n FROM stu_tracker.Grader_task_item
+        WHERE task_id = %(task_id)s AND status IN ('PENDING', 'FAILED_RETRYABLE')
+    ),
+    totals AS (
+        SELECT st.id, COALESCE(SUM(aa.points), 0) AS score
+        FROM stu_tracker.Assessments_students st
+        LEFT JOIN stu_tracker.Assessment_answers aa ON aa.assessment_student_id = st.id
+        WHERE st.session_id = %(session_id)s
+        GROUP BY st.id
+    ),
+    scores AS (
+        UPDATE stu_tracker.Assessments_students st SET score = t.score
+        FROM totals t
+        WHERE st.id = t.id AND (SELECT n FROM pending) = 0
+        RETURNING st.id
+    ),
+    task AS (
+        UPDATE stu_tracker.Assessment_grader_task SET status = 'COMPLETED', updated_at = now()
+        WHERE id = %(task_id)s AND (SELECT n FROM pending) = 0
+        RETURNING id
+    )
+    SELECT
+        (SELECT n FROM pending) AS pending,
+        (SELECT count(*) FROM scores) AS scores_updated,
+        (SELECT count(*) FROM task) AS task_updated;
+"""
+
+
+def is_select(query: str) -> bool:
+    """
+        Only plain reads are EXPLAIN ANALYZEd, ANALYZE runs the statement again.
+    """
+    head = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    return head == "SELECT" or (head == "WITH" and not re.search(r"\b(INSERT|UPDATE|DELETE)\b", query, re.IGNORECASE))
+
+
+def numbered(query: str) -> str:
+    """
+        %s placeholders -> $1, $2 ... for PREPARE.
+    """
+    parts = query.split("%s")
+    return "".join(part + (f"${i + 1}" if i < len(parts) - 1 else "") for i, part in enumerate(parts))
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+        psycopg2 connection carrying the pool bookkeeping: last checkout time and the names of
+        the statements prepared on it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = 0.0
+        self.prepared = set()
+
+
 class PostgresClient:
-    def __init__(self):
-        self.conn = None
+    """
+        Thread safe client over a psycopg2 ThreadedConnectionPool.
+        Every fetch/execute checks a connection out for the duration of the call, so several grading
+        threads can share one client. _get_cursor runs in autocommit, _get_cursor_transaction scopes a
+        transaction to its own checkout.
+    """
+    def __init__(self, min_size: int = POSTGRES_POOL_MIN, max_size: int = POSTGRES_POOL_MAX, timeout: float = POSTGRES_POOL_TIMEOUT):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pool = None
+        # ThreadedConnectionPool raises when exhausted, the semaphore makes checkout wait instead
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.statements = dict(PREPARED_STATEMENTS)
+        self.metrics = QueryMetrics()
+        self.usage = {"in_use": 0, "checkouts": 0, "discarded": 0}
+        self.usage_lock = threading.Lock()
         self._connect()
     
     def _connect(self):
-        """Internal method to handle the database connection and logging."""
+        """Internal method to create the connection pool and logging."""
         try:
             logger.info("Attempting to connect to PostgreSQL database.")
-            self.conn = psycopg2.connect(
+            self.pool = ThreadedConnectionPool(
+                self.min_size,
+                self.max_size,
                 host=os.getenv("POSTGRES_URL"),
                 port=os.getenv("POSTGRES_PORT"),
                 user=os.getenv("POSTGRES_USER"),
                 password=os.getenv("POSTGRES_PASSWORD"),
-                dbname=os.getenv("POSTGRES_DB_NAME")
+                dbname=os.getenv("POSTGRES_DB_NAME"),
+                connection_factory=PooledConnection
             )
-            self.conn.autocommit = True
-            logger.info("Successfully connected to PostgreSQL database.")
+            logger.info("Successfully connected to PostgreSQL database, pool %s-%s.", self.min_size, self.max_size)
         except OperationalError as e:
             # This handles connection-related errors
             logger.error("Failed to connect to PostgreSQL database.")
@@ -41,69 +245,255 @@ class PostgresClient:
         except Exception as e:
             logger.exception("An unexpected error occurred during database connection.")
             raise RuntimeError("Database connection failed") from e
-        
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < POSTGRES_HEALTH_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as curr:
+                curr.execute("SELECT 1;")
+            return True
+        except (OperationalError, InterfaceError):
+            logger.warning("Discarding broken pooled connection.")
+            return False
+
+    def _getconn(self):
+        for _ in range(self.max_size + 1):
+            conn = self.pool.getconn()
+            try:
+                # Before the ping, SELECT 1 outside autocommit opens a transaction and the switch then fails
+                if not conn.closed and not conn.autocommit:
+                    conn.autocommit = True
+                if self._healthy(conn):
+                    if POSTGRES_PREPARED and not self.statements.keys() <= conn.prepared:
+                        self._prepare(conn)
+                    return conn
+            except BaseException:
+                # Not handed to _checkout yet, give it back here or the pool runs out
+                self.pool.putconn(conn, close=True)
+                raise
+            self.pool.putconn(conn, close=True)
+        raise RuntimeError("Database connection failed")
+
+    def _prepare(self, conn):
+        """
+            PREPARE the registered statements missing on a connection, in one round trip.
+        """
+        missing = [name for name in self.statements if name not in conn.prepared]
+        sql = "".join(
+            f"PREPARE {name} ({', '.join(self.statements[name][0])}) AS {numbered(self.statements[name][1]).strip()};"
+            for name in missing
+        )
+        with conn.cursor() as curr:
+            curr.execute(sql)
+        conn.prepared.update(missing)
+
+    def register_prepared(self, name: str, types: tuple, query: str):
+        """
+            Add a statement to the registry, it is prepared on each connection at its next checkout.
+        """
+        self.statements[name] = (types, query)
+
+    def fetch_prepared(self, name: str, params: tuple):
+        """
+            EXECUTE a registered statement, the plain query when POSTGRES_PREPARED is off.
+            Params: name (str), params (tuple)
+
+            Returns list(RealDictRow)
+        """
+        types, query = self.statements[name]
+        try:
+            with self._instrument(name, query, params) as result, self._checkout() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    if name in conn.prepared:
+                        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(types))});", params)
+                    else:
+                        cursor.execute(query, params)
+                    logger.debug(f"Executed prepared {name} with params: {params}")
+                    rows = cursor.fetchall()
+                    result["rows"] = len(rows)
+                    return rows
+        except (OperationalError, ProgrammingError) as e:
+            logger.error(f"Failed to execute prepared query: {name}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed") from e
+
     @contextmanager
-    def _get_cursor_transaction(self, cursor_factory=None):
-        if not self.conn or self.conn.closed:
-            logger.warning("Datebase connection is closed.")
-            self._connect()
-        self.conn.autocommit = False
-        curr = self.conn.cursor(cursor_factory=cursor_factory)
+    def _checkout(self):
+        """
+            Borrow a healthy connection for the block, it goes back to the pool clean (no open transaction)
+            or is closed when it broke during the block.
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise RuntimeError(f"No database connection available after {self.timeout}s")
+        conn, broken = None, False
         try:
-            yield curr
-            self.conn.commit()
-        except Exception:
-            self.conn.rollback()
-            logger.exception("Transaction rolled back due to errors")
+            conn = self._getconn()
+            with self.usage_lock:
+                self.usage["in_use"] += 1
+                self.usage["checkouts"] += 1
+            yield conn
+        except (OperationalError, InterfaceError):
+            broken = True
             raise
         finally:
-            curr.close()
+            if conn is not None:
+                broken = broken or conn.closed != 0
+                if not broken and conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                conn.last_used = time.monotonic()
+                with self.usage_lock:
+                    self.usage["in_use"] -= 1
+                    self.usage["discarded"] += int(broken)
+                self.pool.putconn(conn, close=broken)
+            self.slots.release()
+        
+    @contextmanager
+    def _get_cursor_transaction(self, cursor_factory=None):
+        """
+            Transaction scoped to its own checkout.
+        """
+        with self._checkout() as conn:
+            conn.autocommit = False
+            curr = conn.cursor(cursor_factory=cursor_factory)
+            try:
+                yield curr
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                logger.exception("Transaction rolled back due to errors")
+                raise
+            except BaseException:
+                # KeyboardInterrupt/GeneratorExit: end the transaction before autocommit is restored
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                curr.close()
+                if not conn.closed:
+                    conn.autocommit = True
     
+    @contextmanager
     def _get_cursor(self, cursor_factory=None):
-        """Internal helper to get a cursor and handle potential connection issues."""
-        if not self.conn or self.conn.closed:
-            logger.warning("Database connection is closed. Attempting to reconnect...")
-            self._connect()
-        return self.conn.cursor(cursor_factory=cursor_factory)
+        """Internal helper to get an autocommit cursor on a pooled connection for the block."""
+        with self._checkout() as conn:
+            with conn.cursor(cursor_factory=cursor_factory) as curr:
+                yield curr
+
+    def listen(self, channel: str):
+        """
+            Dedicated autocommit connection (outside the pool) subscribed to channel.
+            Call poll() on it and read .notifies to receive NOTIFY payloads without blocking.
+        """
+        try:
+            conn = psycopg2.connect(
+                host=os.getenv("POSTGRES_URL"),
+                port=os.getenv("POSTGRES_PORT"),
+                user=os.getenv("POSTGRES_USER"),
+                password=os.getenv("POSTGRES_PASSWORD"),
+                dbname=os.getenv("POSTGRES_DB_NAME")
+            )
+            conn.autocommit = True
+            with conn.cursor() as curr:
+                curr.execute(f"LISTEN {psycopg2.extensions.quote_ident(channel, conn)};")
+            logger.info("Listening on %s", channel)
+            return conn
+        except (OperationalError, ProgrammingError) as e:
+            logger.error("Failed to LISTEN on %s", channel)
+            logger.exception(e)
+            raise RuntimeError("Database listen failed") from e
+
+    @contextmanager
+    def _instrument(self, name: str, query, params=None):
+        """
+            Time the block into self.metrics under name, set result["rows"] inside the block.
+            Past SLOW_QUERY_MS the statement is logged with its parameters, and a sample of slow
+            SELECTs is re-run under EXPLAIN (ANALYZE, BUFFERS).
+        """
+        result = {"rows": 0}
+        started = time.perf_counter()
+        try:
+            yield result
+        except Exception:
+            self.metrics.record(name, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        slow = elapsed_ms >= SLOW_QUERY_MS
+        self.metrics.record(name, elapsed_ms, result["rows"], slow=slow)
+        if slow:
+            logger.warning("Slow query %s took %.1fms (%s rows): %s params: %s", name, elapsed_ms, result["rows"], query, params)
+            if EXPLAIN_SAMPLE_RATE > 0 and is_select(query) and random.random() < EXPLAIN_SAMPLE_RATE:
+                self._explain(name, query, params)
+
+    def _explain(self, name: str, query, params=None):
+        try:
+            with self._get_cursor() as cursor:
+                cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query.strip().rstrip(';')}", params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.metrics.record_plan(name, plan)
+            logger.warning("Plan for slow query %s:\n%s", name, plan)
+        except (OperationalError, ProgrammingError, RuntimeError) as e:
+            logger.error("unable to explain slow query %s: %s", name, e)
+
+    def get_metrics(self) -> dict:
+        """
+            Per query name {count, errors, rows, slow, total_ms, avg_ms, max_ms, buckets, last_plan} and pool usage.
+        """
+        with self.usage_lock:
+            pool = dict(self.usage, max_size=self.max_size)
+        return {"queries": self.metrics.snapshot(), "pool": pool}
 
-    def fetch_one(self, query, params=None):
+    def fetch_one(self, query, params=None, name: Optional[str] = None):
+        name = name or sys._getframe(1).f_code.co_name
         try:
-            with self._get_cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._instrument(name, query, params) as result, self._get_cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(query, params)
                 logger.debug(f"Executed query: {query} with params: {params}")
-                return cursor.fetchone()
+                row = cursor.fetchone()
+                result["rows"] = int(row is not None)
+                return row
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute query: {query}")
             logger.exception(e)
             raise RuntimeError("Database query failed") from e
 
-    def fetch_all(self, query, params=None):
+    def fetch_all(self, query, params=None, name: Optional[str] = None):
+        name = name or sys._getframe(1).f_code.co_name
         try:
-            with self._get_cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._instrument(name, query, params) as result, self._get_cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute(query, params)
                 logger.debug(f"Executed query: {query} with params: {params}")
-                return cursor.fetchall()
+                rows = cursor.fetchall()
+                result["rows"] = len(rows)
+                return rows
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute query: {query}")
             logger.exception(e)
             raise RuntimeError("Database query failed") from e
 
-    def execute(self, query, params=None):
+    def execute(self, query, params=None, name: Optional[str] = None):
+        name = name or sys._getframe(1).f_code.co_name
         try:
-            with self._get_cursor() as cursor:
+            with self._instrument(name, query, params) as result, self._get_cursor() as cursor:
                 cursor.execute(query, params)
-                logger.info(f"Executed command: {query} with params: {params}")
+                logger.debug(f"Executed command: {query} with params: {params}")
+                result["rows"] = cursor.rowcount
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute command: {query}")
             logger.exception(e)
             raise RuntimeError("Database command failed") from e
     
-    def execute_res(self, query, params=None):
+    def execute_res(self, query, params=None, name: Optional[str] = None):
+        name = name or sys._getframe(1).f_code.co_name
         try:
-            with self._get_cursor() as cursor:
+            with self._instrument(name, query, params) as result, self._get_cursor() as cursor:
                 cursor.execute(query, params)
-                logger.info(f"Executed command: {query} with params: {params}")
+                logger.debug(f"Executed command: {query} with params: {params}")
                 affected = cursor.rowcount
+                result["rows"] = affected
                 return affected
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute command: {query}")
@@ -133,15 +523,7 @@ class PostgresClient:
         return dict(data)
 
     def get_assessments(self, ids: list[int]):
-        params = ", ".join([f'{id}' for id in ids])
-        query = f"""
-        SELECT ast.id, ast.title, ast.max_score, ast.easy_score, ast.description, sj.title AS subject_title
-        FROM stu_tracker.Assessments ast
-        LEFT JOIN stu_tracker.Subjects 
-        sj ON sj.id = ast.subject_id 
-        WHERE ast.id IN ({params})
-        """
-        data = self.fetch_all(query)
+        data = self.fetch_prepared("get_assessments", ([int(i) for i in ids],))
         if data is None:
             return None
         return [dict(row) for row in data]
@@ -159,51 +541,93 @@ class PostgresClient:
 
 
     def get_session_answers_by_item_key(self, item_keys: list[int]):
-        params = ", ".join([f'{id}' for id in item_keys])
-        query = f"""
-            SELECT id, assessment_id, student_id, question_id, choice_id, answer_text
-            FROM stu_tracker.Session_answers WHERE id IN ({params});
-        """
-        data = self.fetch_all(query)
+        data = self.fetch_prepared("get_session_answers_by_item_key", ([int(i) for i in item_keys],))
         if data is None:
             return None
         return [dict(row) for row in data]
 
     def update_llm_usage(self, params):
+        query = """
+            INSERT INTO stu_tracker.LLM_usage (organization_id, input_tokens, output_tokens, model, provider, status)
+            VALUES %s;
+        """
         try:
-            with self._get_cursor() as curr:
-                query = """
-                    INSERT INTO stu_tracker.LLM_usage (organization_id, input_tokens, output_tokens, model, provider, status)
-                    VALUES (%s);
-                """
+            with self._instrument("update_llm_usage", query, f"{len(params)} rows") as result, self._get_cursor() as curr:
                 execute_values(curr, query, params)
+                result["rows"] = curr.rowcount
                 return curr.rowcount
         except (OperationalError, ProgrammingError) as e:
-            logger.error("unable to update llm usage for {e}", e)
+            logger.error("unable to update llm usage: %s", e)
             return None
 
-    def get_assessment_questions(self, ids: int):
-        params = ", ".join([f'{id}' for id in ids])
-        query = f"""
-        SELECT 
-        q.assessment_id AS assessment_id,
-        q.id AS question_id,
-        q.question_text,
-        c.id AS choice_id,
-        c.question_id,
-        c.is_correct,
-        q.points,
-		q.question_type
-        FROM stu_tracker.Choices c
-        INNER JOIN stu_tracker.Questions q ON c.question_id = q.id
-        WHERE q.assessment_id IN ({params}) AND c.is_correct = TRUE
-        ORDER BY c.question_id, c.order_number;
+    def get_grade_cache(self, keys: list[tuple]):
+        """
+            keys: list(tuple(question_id, question_version, answer_key, model_id))
+            One round trip, rows are filtered to the exact keys by the caller.
+        """
+        query = """
+            SELECT question_id, question_version, answer_key, model_id, score, feedback
+            FROM stu_tracker.Grade_cache
+            WHERE question_id = ANY(%s) AND answer_key = ANY(%s) AND model_id = ANY(%s);
+        """
+        params = (list({k[0] for k in keys}), list({k[2] for k in keys}), list({k[3] for k in keys}))
+        data = self.fetch_all(query, params)
+        if data is None:
+            return None
+        return [dict(row) for row in data]
+
+    def upsert_grade_cache(self, params):
+        query = """
+            INSERT INTO stu_tracker.Grade_cache (question_id, question_version, answer_key, model_id, score, feedback)
+            VALUES %s
+            ON CONFLICT (question_id, question_version, answer_key, model_id) DO UPDATE SET
+                score    = EXCLUDED.score,
+                feedback = EXCLUDED.feedback;
+        """
+        try:
+            with self._instrument("upsert_grade_cache", query, f"{len(params)} rows") as result, self._get_cursor() as curr:
+                execute_values(curr, query, params)
+                result["rows"] = curr.rowcount
+                return curr.rowcount
+        except (OperationalError, ProgrammingError) as e:
+            logger.error(f"Failed to execute query: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed") from e
+
+    def delete_grade_cache(self, question_id: int, keep_version: str = None):
+        query = """
+            DELETE FROM stu_tracker.Grade_cache
+            WHERE question_id = %s AND (%s::text IS NULL OR question_version <> %s);
         """
-        data = self.fetch_all(query)
+        return self.execute_res(query, (question_id, keep_version, keep_version))
+
+    def get_assessment_questions(self, ids: int):
+        data = self.fetch_prepared("get_assessment_questions", ([int(i) for i in ids],))
         if data is None:
             return None
         return [dict(row) for row in data]
 
+    def load_grading_context(self, session_token: str, session_id: int, model_id: str, cached_ids: Optional[list] = None):
+        """
+            Everything on_message needs in one round trip (data-modifying CTE):
+            task upsert (attempts + 1) -> grader items and Assessments_students seeded on first delivery
+            -> pending items, the session students, assessments and correct choices.
+            The answers of the pending items are not loaded here, the caller pages them by item key.
+            attempts only counts deliveries, the retry topology decides when a session is parked. Statements in a CTE share one snapshot,
+            so freshly inserted rows are merged from RETURNING rather than read back.
+            Assessments and questions of cached_ids (already in the AssessmentCache) are not loaded.
+            Items are seeded once per task, completed counts the items already checkpointed.
+
+            Returns dict{task, completed, items, students, assessments, questions} or None
+        """
+        query = GRADING_CONTEXT_QUERY
+        params = {"session_token": session_token, "session_id": session_id, "model_id": model_id,
+                  "cached_ids": [int(i) for i in cached_ids or []]}
+        data = self.fetch_one(query, params)
+        if data is None or data["task"] is None:
+            return None
+        return dict(data)
+
     def get_grader_task_items(self, task_id: int):
         query = """
             SELECT id, item_key, task_id, status, attempts FROM stu_tracker.Grader_task_item
@@ -229,6 +653,15 @@ class PostgresClient:
         res = self.fetch_one(query, params)
         return dict(res)
 
+    def release_grader_task_attempt(self, task_id: int):
+        """
+            Give back the attempt taken by create_grader_task when a session is deferred without being graded.
+        """
+        query = """
+            UPDATE stu_tracker.Assessment_grader_task SET attempts = GREATEST(attempts - 1, 0) WHERE id = %s;
+        """
+        return self.execute_res(query, (task_id,))
+
     def delete_grader_task(self, params):
         query = """
             DELETE FROM stu_tracker.Assessment_grader_task WHERE session_token = %s;
@@ -242,64 +675,128 @@ class PostgresClient:
         self.execute(query, (params,))
 
     
-    def create_grader_task_item(self, sessions: list, model: str, task_id: str):
-        rows = []
-        for s in sessions:
-            item_id = s['id']
-            key = f"{model}:{item_id}"
-            rows.append((item_id, task_id, key))
-        placeholder = ", ".join(["(%s, %s, %s)"] * len(rows))
-        query = f"""
+    def create_grader_task_item(self, sessions: Iterable[dict], model: str, task_id: str, page_size: int = TASK_ITEM_PAGE_SIZE) -> int:
+        """
+            Idempotent insert of one Grader_task_item per session answer, page_size rows per statement and transaction.
+            sessions can be a generator, only one page is held in memory and locks are held for one page at a time.
+            Legacy path (State.upsert_assessment_items), on_message seeds its items server side in GRADING_CONTEXT_QUERY.
+            Params: sessions (iterable of dict with id), model (str), task_id, page_size (int)
+
+            Returns int, rows written
+        """
+        query = """
             INSERT INTO stu_tracker.Grader_task_item(item_key, task_id, idempotency_key)
-            VALUES {placeholder} ON CONFLICT (task_id, item_key) DO UPDATE SET idempotency_key = EXCLUDED.idempotency_key;
+            VALUES %s ON CONFLICT (task_id, item_key) DO UPDATE SET idempotency_key = EXCLUDED.idempotency_key;
         """
-        params = [v for row in rows for v in row]
-        self.execute(query, params)
+        rows = ((s['id'], task_id, f"{model}:{s['id']}") for s in sessions)
+        written = 0
+        while True:
+            page = list(itertools.islice(rows, page_size))
+            if not page:
+                return written
+            try:
+                with self._instrument("create_grader_task_item", query, f"{len(page)} rows") as result, self._get_cursor_transaction() as curr:
+                    execute_values(curr, query, page, page_size=page_size)
+                    result["rows"] = curr.rowcount
+                    written += curr.rowcount
+            except (OperationalError, ProgrammingError) as e:
+                logger.error(f"Failed to execute command: {query}")
+                logger.exception(e)
+                raise RuntimeError("Database command failed") from e
 
+    def checkpoint_items(self, an_rows, gr_rows) -> dict:
+        """
+            Persist a chunk of graded items as soon as they are graded: answers upserted and their Grader_task_item
+            marked COMPLETED in one transaction, a redelivery then only grades what is still pending.
+            Params: an_rows list(tuple(assessment_student_id, question_id, choice_id, answer_text, is_correct, feedback, points)),
+                    gr_rows list(tuple(status, updated_at, item_key)).
 
-    def bulk_update(self, an_rows, gr_rows, tr_rows, task_id):
-        current_time = datetime.datetime.now()
-        with self._get_cursor_transaction(cursor_factory=RealDictCursor) as curr:
-            ## id, assessment_student_id, points, is_correct;
-            answers_inserted = self.upsert_assessment_answers(an_rows, curr)
-            logger.info("answers_inserted", answers_inserted)
-            if len(answers_inserted) != len(an_rows):
-                #Fail and try again
-                raise RuntimeError("Unable to upsert_assessment_answers")
-            grader_update_items_count = self.update_grader_task_item(gr_rows, curr)
-            logger.info("grader_update_items_count", grader_update_items_count)
-            if grader_update_items_count != len(an_rows):
-                # Fail try again
-                raise RuntimeError("Unable to commit grader_update_items")
-            parent_id = self.update_grader_assessment('COMPLETED', current_time, task_id, curr)
-            logger.info("parent_id", parent_id)
-            if parent_id is None:
-                raise RuntimeError("Unable to commit update_grader_assessment")
-            
-            update_assessment_session_score = self.update_assessment_student_score(tr_rows, curr)
-            logger.info("update_assessment_session_score", update_assessment_session_score)
-            if update_assessment_session_score is None:
-                raise RuntimeError("Unable to update_assessment_student_score") 
-            return {
-                "answers_upserted": len(answers_inserted),
-                "grader_items_updated": grader_update_items_count,
-                "assessment_task_updated": parent_id,
-                "update_assessment_session_score": update_assessment_session_score
-            }
-    
-    def update_assessment_student_score(self, params, curr):
-        query = """ 
-            INSERT INTO stu_tracker.Assessments_students (
-                student_id, assessment_id, session_id, score
-            )
-            VALUES %s
-            ON CONFLICT (student_id, assessment_id, session_id) DO UPDATE SET
-                score      = EXCLUDED.score
-            RETURNING id, score, student_id, session_id;
+            Returns dict{answers_upserted, grader_items_updated}
+        """
+        use_copy = len(an_rows) >= COPY_THRESHOLD
+        try:
+            with self._instrument("checkpoint_items", f"checkpoint_items ({'copy' if use_copy else 'execute_values'})", f"{len(an_rows)} answers") as result, \
+                    self._get_cursor_transaction(cursor_factory=RealDictCursor) as curr:
+                result["rows"] = len(an_rows)
+                if use_copy:
+                    answers_count = self.copy_assessment_answers(an_rows, curr)
+                    items_count = self.copy_grader_task_item(gr_rows, curr)
+                else:
+                    answers_count = len(self.upsert_assessment_answers(an_rows, curr))
+                    items_count = self.update_grader_task_item(gr_rows, curr)
+                if answers_count != len(an_rows) or items_count != len(gr_rows):
+                    raise RuntimeError(f"Partial checkpoint: {answers_count}/{len(an_rows)} answers, {items_count}/{len(gr_rows)} items")
+                return {"answers_upserted": answers_count, "grader_items_updated": items_count}
+        except (OperationalError, ProgrammingError) as e:
+            logger.error("Checkpoint rolled back: %s", e)
+            raise RuntimeError("Database command failed") from e
+
+    def finalize_grader_task(self, task_id: int, session_id: int) -> dict:
+        """
+            Roll the checkpointed answers up into Assessments_students scores and complete the task,
+            a no-op while items are still pending.
+
+            Returns dict{pending, scores_updated, task_updated}
+        """
+        try:
+            with self._instrument("finalize_grader_task", FINALIZE_GRADER_TASK_QUERY, (task_id, session_id)) as result, \
+                    self._get_cursor_transaction(cursor_factory=RealDictCursor) as curr:
+                curr.execute(FINALIZE_GRADER_TASK_QUERY, {"task_id": task_id, "session_id": session_id})
+                data = dict(curr.fetchone())
+                result["rows"] = data["scores_updated"]
+                return data
+        except (OperationalError, ProgrammingError) as e:
+            logger.error("Finalize rolled back: %s", e)
+            raise RuntimeError("Database command failed") from e
+
+    def _copy_rows(self, curr, table: str, source: str, columns: list, rows: list):
+        """
+            Stage rows in a temp table shaped like source(columns), dropped at commit, through COPY FROM STDIN (CSV).
+        """
+        cols = ", ".join(columns)
+        curr.execute(f"CREATE TEMP TABLE {table} ON COMMIT DROP AS SELECT {cols} FROM {source} WITH NO DATA;")
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([COPY_NULL if v is None else v for v in row])
+        buffer.seek(0)
+        curr.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+    def _merge(self, curr, query: str) -> int:
         """
-        execute_values(curr, query, params)
-        cols = [d.name for d in curr.description]    
-        return [dict(zip(cols, r)) for r in curr.fetchall()]
+            Run a staging merge, returns the rows it touched.
+        """
+        curr.execute(query + ";")
+        return curr.rowcount
+
+    def copy_assessment_answers(self, params, curr):
+        columns = ["assessment_student_id", "question_id", "choice_id", "answer_text", "is_correct", "feedback", "points"]
+        self._copy_rows(curr, "tmp_assessment_answers", "stu_tracker.Assessment_answers", columns, params)
+        query = """
+            INSERT INTO stu_tracker.Assessment_answers (
+                assessment_student_id, question_id, choice_id, answer_text, is_correct, feedback, points
+            )
+            SELECT assessment_student_id, question_id, choice_id, answer_text, is_correct, feedback, points
+            FROM tmp_assessment_answers
+            ON CONFLICT (assessment_student_id, question_id, choice_id) DO UPDATE SET
+                choice_id   = EXCLUDED.choice_id,
+                answer_text = EXCLUDED.answer_text,
+                is_correct  = EXCLUDED.is_correct,
+                feedback    = EXCLUDED.feedback,
+                points      = EXCLUDED.points"""
+        return self._merge(curr, query)
+
+    def copy_grader_task_item(self, params, curr):
+        self._copy_rows(curr, "tmp_grader_task_item", "stu_tracker.Grader_task_item", ["status", "updated_at", "item_key"], params)
+        query = """
+            UPDATE stu_tracker.Grader_task_item AS g
+            SET 
+                status = v.status,
+                attempts = g.attempts + 1,
+                updated_at = v.updated_at
+            FROM tmp_grader_task_item AS v
+            WHERE g.item_key = v.item_key"""
+        return self._merge(curr, query)
 
     def get_assessment_students(self, session_id):
         query = """ SELECT id, student_id, assessment_id FROM stu_tracker.Assessments_students WHERE session_id = %s;"""
@@ -320,9 +817,8 @@ class PostgresClient:
                 points      = EXCLUDED.points
             RETURNING id, assessment_student_id, points, is_correct;
         """
-        execute_values(curr, query, params)
-        cols = [d.name for d in curr.description]    
-        return [dict(zip(cols, r)) for r in curr.fetchall()]
+        # fetch collects RETURNING of every page, fetchall would only see the last one
+        return execute_values(curr, query, params, fetch=True)
     
 
     def update_assessment_students (self, params):
@@ -374,17 +870,10 @@ class PostgresClient:
             FROM (VALUES %s) AS v(status, updated_at, item_key)
             WHERE g.item_key = v.item_key;
         """
-        execute_values(curr, query, params)
+        # One page, rowcount only covers the last statement
+        execute_values(curr, query, params, page_size=max(len(params), 1))
         return curr.rowcount
         
-    def update_grader_assessment(self, STATUS, current_time, task_id, curr):
-        query = """
-            UPDATE stu_tracker.Assessment_grader_task
-            SET status = %s, attempts = attempts + 1, updated_at = %s WHERE id = %s;
-        """
-        curr.execute(query, (STATUS, current_time, task_id))
-        return curr.rowcount
-    
     def query_assessment_grader_task(self, params):
         query = """
             SELECT id, status FROM stu_tracker.Assessment_grader_task WHERE session_token = %s;
@@ -405,6 +894,6 @@ class PostgresClient:
         self.execute(query, params)
                 
     def close(self):
-        if self.conn and not self.conn.closed:
-            self.conn.close()
-            logger.info("PostgreSQL connection closed.")
\ No newline at end of file
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+            logger.info("PostgreSQL connection pool closed.")
\ No newline at end of file
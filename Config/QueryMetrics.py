@@ -0,0 +1,72 @@
+from typing import Optional
+import bisect
+import threading
+import logging
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+# Upper bounds (ms) of the latency histogram buckets, the last bucket is open ended.
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.slow = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.last_plan: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{b}": n for b, n in zip(LATENCY_BUCKETS_MS, self.buckets)}
+        buckets["le_inf"] = self.buckets[-1]
+        return {
+            "count": self.count, "errors": self.errors, "rows": self.rows, "slow": self.slow,
+            "total_ms": round(self.total_ms, 3), "max_ms": round(self.max_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "buckets": buckets, "last_plan": self.last_plan,
+        }
+
+
+class QueryMetrics:
+    """
+        Per query name latency histogram, row and error counts, thread safe.
+        Names are the PostgresClient method that issued the query (get_grader_task_id, checkpoint_items ...).
+    """
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, name: str) -> QueryStats:
+        if name not in self.stats:
+            self.stats[name] = QueryStats()
+        return self.stats[name]
+
+    def record(self, name: str, elapsed_ms: float, rows: int = 0, error: bool = False, slow: bool = False):
+        with self.lock:
+            stats = self._stats(name)
+            stats.count += 1
+            stats.errors += int(error)
+            stats.slow += int(slow)
+            stats.rows += max(rows or 0, 0)
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def record_plan(self, name: str, plan: str):
+        with self.lock:
+            self._stats(name).last_plan = plan
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
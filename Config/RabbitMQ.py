@@ -1,7 +1,9 @@
 
 import os
 import logging
+import copy
 import pika
+from typing import Optional
 from dotenv import load_dotenv
 import boto3
 import ssl
@@ -24,12 +26,55 @@ pika_logger = logging.getLogger('pika')
 pika_logger.setLevel(logging.INFO)
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT"))
+RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
 RABBIT_LOCAL  = os.getenv("RABBIT_LOCAL")
+# Sessions are graded off the I/O thread, the loop answers heartbeats even while a session takes minutes.
+RABBITMQ_HEARTBEAT = int(os.getenv("RABBITMQ_HEARTBEAT", 60))
+RABBITMQ_BLOCKED_TIMEOUT = float(os.getenv("RABBITMQ_BLOCKED_TIMEOUT", 30))
+# x-max-priority of the grading queue, 0 declares it without priorities.
+# Queue arguments cannot change on an existing queue, the queue has to be recreated to turn it on.
+RABBITMQ_MAX_PRIORITY = int(os.getenv("RABBITMQ_MAX_PRIORITY", 0))
+# Seconds a failed session waits in the broker before it is delivered again, one delay queue per step, the last one repeats.
+RETRY_DELAYS = [int(d) for d in os.getenv("RABBITMQ_RETRY_DELAYS", "5,30,120,600").split(",") if d.strip()] or [5]
+# Retries of a delivery, kept next to x-death for brokers that drop x-death from republished messages.
+RETRY_COUNT_HEADER = "x-retry-count"
+# Seconds a deferred session (provider circuit open) waits in the broker, deferrals are not counted as retries.
+DEFER_SECONDS = int(os.getenv("DEFER_SECONDS", 10))
 s3 = boto3.client('s3')
 
+
+def retry_exchange(exchange: str) -> str:
+    return f"{exchange}.retry"
+
+
+def retry_queue(queue: str, step: int) -> str:
+    return f"{queue}.retry.{step}"
+
+
+def parking_queue(queue: str) -> str:
+    return f"{queue}.parking"
+
+
+def defer_queue(queue: str) -> str:
+    return f"{queue}.defer"
+
+
+def retry_count(properties, queue: str) -> int:
+    """
+        Times a delivery went through the delay queues of queue, from the x-death entries the broker
+        adds when a delay queue dead-letters it back (one entry per delay queue, with a count).
+    """
+    headers = getattr(properties, "headers", None) or {}
+    deaths = 0
+    for death in headers.get("x-death") or []:
+        name = death.get("queue", "")
+        name = name.decode() if isinstance(name, bytes) else str(name)
+        if name.startswith(f"{queue}.retry."):
+            deaths += int(death.get("count", 1))
+    return max(deaths, int(headers.get(RETRY_COUNT_HEADER, 0)))
+
 credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
 class RabbitMQ:
     def __init__(self, prefetch_count, exchange, queue, routing_key, exchange_type):
@@ -37,13 +82,14 @@ class RabbitMQ:
             logger.info(f"Attempting to connect to RabbitMQ at host: {RABBITMQ_HOST}:{RABBITMQ_PORT}")
             params = None
             self.queue = queue
+            self.exchange = exchange
             if RABBIT_LOCAL == str(1) or RABBIT_LOCAL == 1:
                 params = pika.ConnectionParameters(
                     host=RABBITMQ_HOST, 
                     port=RABBITMQ_PORT, 
                     credentials=credentials, 
-                    heartbeat=60, 
-                    blocked_connection_timeout=30
+                    heartbeat=RABBITMQ_HEARTBEAT, 
+                    blocked_connection_timeout=RABBITMQ_BLOCKED_TIMEOUT
                 )
             else:
                 ssl_context = ssl.create_default_context()
@@ -52,16 +98,18 @@ class RabbitMQ:
                     port=RABBITMQ_PORT,
                     virtual_host="/",
                     credentials=credentials, 
-                    heartbeat=60, 
-                    blocked_connection_timeout=30,
+                    heartbeat=RABBITMQ_HEARTBEAT, 
+                    blocked_connection_timeout=RABBITMQ_BLOCKED_TIMEOUT,
                     ssl_options=pika.SSLOptions(context=ssl_context)
                 )
             self.connection = pika.BlockingConnection(params)
             logger.info("Successfully established connection to RabbitMQ.")
             self.channel = self.connection.channel()
             self.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type, durable=True)
-            self.channel.queue_declare(queue=queue, durable=True)
+            arguments = {"x-max-priority": RABBITMQ_MAX_PRIORITY} if RABBITMQ_MAX_PRIORITY > 0 else None
+            self.channel.queue_declare(queue=queue, durable=True, arguments=arguments)
             self.channel.queue_bind(exchange=exchange, queue=queue, routing_key=routing_key)
+            self.declare_retry_topology(exchange, queue, routing_key)
             self.channel.basic_qos(prefetch_count=prefetch_count)
             logger.info(f"RabbitMQ channel and queue '{self.queue}' configured successfully.")
         except pika.exceptions.AMQPConnectionError as e:
@@ -72,6 +120,27 @@ class RabbitMQ:
             raise
 
 
+    def declare_retry_topology(self, exchange: str, queue: str, routing_key: str):
+        """
+            <exchange>.retry (direct) routes to one delay queue per RETRY_DELAYS step, to the defer queue and to the parking lot.
+            A delay queue holds a session for its TTL, then dead-letters it back to exchange/routing_key,
+            so the back-off is spent in the broker instead of a worker. The defer queue works the same way
+            but is not counted by retry_count. The parking lot keeps sessions that used up their attempts
+            for inspection or a manual shovel back.
+        """
+        exchange_retry = retry_exchange(exchange)
+        self.channel.exchange_declare(exchange=exchange_retry, exchange_type="direct", durable=True)
+        delays = [(retry_queue(queue, step), delay) for step, delay in enumerate(RETRY_DELAYS)] + [(defer_queue(queue), DEFER_SECONDS)]
+        for name, delay in delays:
+            self.channel.queue_declare(queue=name, durable=True, arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": exchange,
+                "x-dead-letter-routing-key": routing_key,
+            })
+            self.channel.queue_bind(exchange=exchange_retry, queue=name, routing_key=name)
+        self.channel.queue_declare(queue=parking_queue(queue), durable=True)
+        self.channel.queue_bind(exchange=exchange_retry, queue=parking_queue(queue), routing_key=parking_queue(queue))
+
     def set_callback(self, callback_):
         self.channel.basic_consume(queue=self.queue, on_message_callback=callback_)
 
@@ -79,4 +148,85 @@ class RabbitMQ:
         return self.connection
         
     def get_channel(self):
-        return self.channel
\ No newline at end of file
+        return self.channel
+
+    def close(self):
+        """
+            Close the connection, a no-op when the broker already dropped it.
+        """
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except pika.exceptions.AMQPError as e:
+            logger.info("RabbitMQ connection already closed: %s", e)
+
+
+class ThreadsafeChannel:
+    """
+        Channel handed to on_message when it runs on a worker thread. pika's BlockingConnection is not thread safe,
+        acks, nacks and retries are scheduled on the I/O thread with connection.add_callback_threadsafe.
+        A delivery whose channel closed meanwhile is redelivered by the broker, its ack is dropped.
+    """
+    def __init__(self, channel, connection, exchange: Optional[str] = None, queue: Optional[str] = None):
+        self.channel = channel
+        self.connection = connection
+        self.exchange = exchange
+        self.queue = queue
+
+    def _call_threadsafe(self, description: str, call):
+        def _call():
+            if not self.channel.is_open:
+                logger.info("channel closed, dropping %s", description)
+                return
+            call()
+        try:
+            self.connection.add_callback_threadsafe(_call)
+        except (pika.exceptions.ConnectionWrongStateError, pika.exceptions.StreamLostError) as e:
+            logger.error("connection closed, dropping %s: %s", description, e)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False):
+        self._call_threadsafe(f"ack {delivery_tag}", lambda: self.channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple))
+
+    def basic_nack(self, delivery_tag: int, multiple: bool = False, requeue: bool = True):
+        self._call_threadsafe(f"nack {delivery_tag}", lambda: self.channel.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue))
+
+    def republish(self, method, properties, body: bytes, target: str, retries: int):
+        """
+            Publish a copy of the delivery to target on the retry exchange and ack the original,
+            in the same I/O thread callback.
+        """
+        republished = copy.copy(properties) if properties is not None else pika.BasicProperties()
+        republished.headers = dict(republished.headers or {}, **{RETRY_COUNT_HEADER: retries})
+        republished.delivery_mode = pika.DeliveryMode.Persistent.value
+
+        def _republish():
+            self.channel.basic_publish(exchange=retry_exchange(self.exchange), routing_key=target, body=body, properties=republished)
+            self.channel.basic_ack(delivery_tag=method.delivery_tag)
+        self._call_threadsafe(f"republish {method.delivery_tag} to {target}", _republish)
+
+    def defer(self, method, properties, body: bytes) -> str:
+        """
+            Hand a delivery to the defer queue, it comes back after DEFER_SECONDS without spending a retry.
+
+            Returns str, the defer queue
+        """
+        target = defer_queue(self.queue)
+        self.republish(method, properties, body, target, retry_count(properties, self.queue))
+        logger.info("Defer: delivery_tag=%s to %s", method.delivery_tag, target)
+        return target
+
+    def retry(self, method, properties, body: bytes, max_attempts: int) -> str:
+        """
+            Hand a failed delivery to the next delay queue, or to the parking lot once max_attempts deliveries failed.
+            Params: method, properties, body of the delivery, max_attempts (int)
+
+            Returns str, the delay queue or parking lot it was sent to
+        """
+        retries = retry_count(properties, self.queue)
+        if retries + 1 >= max_attempts:
+            target = parking_queue(self.queue)
+        else:
+            target = retry_queue(self.queue, min(retries, len(RETRY_DELAYS) - 1))
+        self.republish(method, properties, body, target, retries + 1)
+        logger.info("Retry %s: delivery_tag=%s to %s", retries + 1, method.delivery_tag, target)
+        return target
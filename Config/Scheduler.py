@@ -0,0 +1,132 @@
+from collections import OrderedDict, deque
+from typing import Optional
+from Config.QueryMetrics import QueryMetrics
+import threading
+import time
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Deliveries published with an AMQP priority at or above this go to the interactive lane (re-grades), the rest is bulk.
+INTERACTIVE_PRIORITY = int(os.getenv("SCHEDULER_INTERACTIVE_PRIORITY", 5))
+# Sessions taken from a lane per turn while both lanes have work, bulk still moves under a steady interactive load.
+LANE_WEIGHTS = {
+    INTERACTIVE: int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", 4)),
+    BULK: int(os.getenv("SCHEDULER_BULK_WEIGHT", 1)),
+}
+# "organization_id:weight,..." sessions an organization gets per round robin turn, others get 1.
+ORGANIZATION_WEIGHTS = {
+    key.strip(): int(weight)
+    for key, weight in (pair.split(":") for pair in os.getenv("SCHEDULER_ORG_WEIGHTS", "").split(",") if ":" in pair)
+}
+
+
+def lane_for(priority: Optional[int]) -> str:
+    return INTERACTIVE if priority is not None and priority >= INTERACTIVE_PRIORITY else BULK
+
+
+class WeightedRoundRobin:
+    """
+        FIFO per key, served in turns of weight(key) items, keys in order of arrival.
+        Not thread safe, FairScheduler holds the lock.
+    """
+    def __init__(self, weight):
+        self.weight = weight
+        self.queues: OrderedDict = OrderedDict()
+        self.credits = {}
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def put(self, key, item):
+        self.queues.setdefault(key, deque()).append(item)
+
+    def pop(self):
+        """
+            Returns (key, item) of the next turn, raises IndexError when empty.
+        """
+        if not self.queues:
+            raise IndexError("pop from an empty WeightedRoundRobin")
+        key, queue = next(iter(self.queues.items()))
+        if self.credits.get(key, 0) <= 0:
+            self.credits[key] = max(self.weight(key), 1)
+        item = queue.popleft()
+        self.credits[key] -= 1
+        if not queue:
+            del self.queues[key]
+            del self.credits[key]
+        elif self.credits[key] <= 0:
+            self.queues.move_to_end(key)
+        return (key, item)
+
+    def sizes(self) -> dict:
+        return {key: len(q) for key, q in self.queues.items()}
+
+
+class FairScheduler:
+    """
+        Orders the prefetched deliveries of this consumer between the pika I/O thread (put) and the worker pool (get).
+        Two priority lanes, weighted against each other, and inside each lane one FIFO per organization
+        served by weighted round robin: a district with thousands of sessions queued takes its turn next to
+        a school with one quiz instead of ahead of it. Only deliveries already prefetched are reordered,
+        PREFETCH_COUNT above WORKER_POOL_SIZE gives the scheduler something to choose from.
+        Time spent queued is recorded per lane and organization.
+    """
+    def __init__(self, lane_weights: dict = None, organization_weights: dict = None, clock=time.monotonic):
+        self.lane_weights = LANE_WEIGHTS if lane_weights is None else lane_weights
+        self.organization_weights = ORGANIZATION_WEIGHTS if organization_weights is None else organization_weights
+        self.clock = clock
+        self.lanes = {lane: WeightedRoundRobin(self.organization_weight) for lane in (INTERACTIVE, BULK)}
+        self.turns = WeightedRoundRobin(lambda lane: self.lane_weights.get(lane, 1))
+        self.cond = threading.Condition()
+        self.wait_metrics = QueryMetrics()
+
+    def organization_weight(self, organization_id) -> int:
+        return self.organization_weights.get(str(organization_id), 1)
+
+    def put(self, organization_id, item, lane: str = BULK):
+        with self.cond:
+            self.lanes[lane].put(organization_id, (self.clock(), item))
+            self.turns.put(lane, lane)
+            self.cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+            Next item in fair order, None after timeout seconds without one.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.turns) > 0, timeout=timeout):
+                return None
+            # One turn entry per queued item, the lane it names always has one
+            _, lane = self.turns.pop()
+            organization_id, (enqueued, item) = self.lanes[lane].pop()
+        self.wait_metrics.record(f"{lane}:{organization_id}", (self.clock() - enqueued) * 1000)
+        return item
+
+    def drain(self) -> list:
+        """
+            Remove and return every queued item, for a consumer that stops taking work.
+        """
+        with self.cond:
+            items = []
+            while len(self.turns) > 0:
+                _, lane = self.turns.pop()
+                items.append(self.lanes[lane].pop()[1][1])
+            return items
+
+    def metrics(self) -> dict:
+        """
+            {queued: {lane: {organization_id: n}}, wait: {"lane:organization_id": {count, avg_ms, max_ms, buckets ...}}}
+        """
+        with self.cond:
+            queued = {lane: {str(k): n for k, n in rr.sizes().items()} for lane, rr in self.lanes.items()}
+        return {"queued": queued, "wait": self.wait_metrics.snapshot()}
+
+
+scheduler = FairScheduler()
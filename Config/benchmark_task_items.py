@@ -0,0 +1,77 @@
+from psycopg2.extensions import adapt
+from contextlib import contextmanager
+from types import SimpleNamespace
+import argparse
+import time
+import tracemalloc
+import Config.PostgresClient as pg
+from Config.QueryMetrics import QueryMetrics
+import logging
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+"""
+    Client side cost of PostgresClient.create_grader_task_item: time and peak memory per item count,
+    answers streamed from a generator. Statements go to a cursor that renders them (mogrify) and drops them,
+    so the numbers cover statement building and paging, not the server.
+    This is the legacy writer. on_message seeds its items server side with the INSERT ... SELECT of
+    GRADING_CONTEXT_QUERY, which sends no rows from the client and is not measured here.
+
+    python -m Config.benchmark_task_items --sizes 1000 10000 100000 --page-size 1000
+"""
+
+
+class _RenderingCursor:
+    def __init__(self):
+        self.connection = SimpleNamespace(encoding="UTF8")
+        self.rowcount = 0
+        self.bytes = 0
+
+    def mogrify(self, template, args):
+        return template % tuple(adapt(a).getquoted() for a in args)
+
+    def execute(self, sql, params=None):
+        self.bytes += len(sql)
+        self.rowcount = sql.count(b"),(") + 1 if isinstance(sql, bytes) else 0
+
+
+class _BenchClient(pg.PostgresClient):
+    def __init__(self):
+        # No pool, only what create_grader_task_item and _instrument use
+        self.cursor = _RenderingCursor()
+        self.metrics = QueryMetrics()
+
+    @contextmanager
+    def _get_cursor_transaction(self, cursor_factory=None):
+        yield self.cursor
+
+
+def answers(count: int):
+    for i in range(count):
+        yield {"id": i + 1, "assessment_id": 1, "student_id": i // 20, "question_id": i % 20}
+
+
+def run(sizes: list, page_size: int):
+    print(f"{'items':>10} {'seconds':>10} {'us/item':>10} {'peak KiB':>10}")
+    for size in sizes:
+        db = _BenchClient()
+        tracemalloc.start()
+        started = time.perf_counter()
+        written = db.create_grader_task_item(answers(size), "bench", 1, page_size=page_size)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert written == size, f"wrote {written} of {size}"
+        print(f"{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>10.2f} {peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="create_grader_task_item scaling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--page-size", type=int, default=pg.TASK_ITEM_PAGE_SIZE)
+    args = parser.parse_args()
+    run(args.sizes, args.page_size)
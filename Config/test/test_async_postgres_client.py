@@ -0,0 +1,187 @@
+# test_async_postgres_client.py
+import asyncio
+import re
+from contextlib import asynccontextmanager
+import pytest
+import asyncpg
+
+import Config.AsyncPostgresClient as mod
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeConn:
+    def __init__(self):
+        self.executed = []
+        self.copied = []
+        self.many = []
+        self.staged = 0
+        self.transactions = 0
+        self.fail = False
+
+    async def execute(self, query, *params):
+        if self.fail:
+            raise asyncpg.PostgresError("boom")
+        self.executed.append((query, params))
+        if "FROM tmp_" in query:
+            return f"UPDATE {self.staged}"
+        if "unnest(" in query:
+            return f"INSERT 0 {len(params[0])}"
+        return "UPDATE 1"
+
+    async def fetch(self, query, *params):
+        self.executed.append((query, params))
+        count = self.staged if "FROM tmp_" in query else len(params[0]) if "unnest(" in query else 1
+        return [{"id": i} for i in range(count)]
+
+    async def fetchrow(self, query, *params):
+        self.executed.append((query, params))
+        return {"task": {"id": 7}, "items": []}
+
+    async def executemany(self, query, rows):
+        self.many.append((query, list(rows)))
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.append((table, list(records), columns))
+        self.staged = len(self.copied[-1][1])
+
+    def transaction(self):
+        conn = self
+
+        @asynccontextmanager
+        async def _tx():
+            conn.transactions += 1
+            yield
+
+        return _tx()
+
+
+class _FakePool:
+    def __init__(self):
+        self.conn = _FakeConn()
+        self.closed = False
+
+    def acquire(self, timeout=None):
+        pool = self
+
+        @asynccontextmanager
+        async def _acquire():
+            yield pool.conn
+
+        return _acquire()
+
+    def get_size(self):
+        return 1
+
+    def get_idle_size(self):
+        return 1
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client():
+    db = mod.AsyncPostgresClient()
+    db.pool = _FakePool()
+    return db
+
+
+# ---------- Tests ----------
+
+def test_positional_rewrites_named_params_in_order():
+    sql = mod.positional("a = %(x)s AND b = %(y)s OR c = %(x)s", ["x", "y"])
+    assert sql == "a = $1 AND b = $2 OR c = $1"
+    assert mod.positional("a = %(x)s AND b = %(y)s", ["x", "y"], {"y": "text"}) == "a = $1 AND b = $2::text"
+
+
+def test_grading_context_query_types_every_parameter():
+    sql = mod._GRADING_CONTEXT_QUERY
+    assert "%(" not in sql
+    # asyncpg cannot infer the type of a bare SELECT DISTINCT $2 or $3 || ':'
+    assert "SELECT DISTINCT $2::bigint, s.student_id" in sql
+    assert "$3::text || ':' || s.id" in sql
+    assert "VALUES ($1::text, $3::text)" in sql
+    assert "$4::int[]" in sql and "::int[]::int[]" not in sql
+    assert re.findall(r"\$\d(?!::)", sql) == []
+
+
+def test_affected_and_columns():
+    assert mod.affected("INSERT 0 5") == 5
+    assert mod.affected("UPDATE 3") == 3
+    assert mod.affected(None) == 0
+    assert mod.columns([(1, "a"), (2, "b")], 2) == [[1, 2], ["a", "b"]]
+    assert mod.columns([], 3) == [[], [], []]
+
+
+def test_fetch_one_records_metrics_and_passes_positional_params(client):
+    data = asyncio.run(client.load_grading_context("tok", 3, "m", cached_ids=["4"]))
+    assert data["task"] == {"id": 7}
+    query, params = client.pool.conn.executed[-1]
+    assert params == ("tok", 3, "m", [4])
+    assert client.get_metrics()["queries"]["load_grading_context"]["count"] == 1
+
+
+def test_errors_are_wrapped_in_runtime_error(client):
+    client.pool.conn.fail = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.execute("DELETE FROM t WHERE id = $1", 1))
+    assert client.get_metrics()["queries"]["execute"]["errors"] == 1
+
+
+def test_create_grader_task_item_pages_through_unnest(client):
+    sessions = ({"id": i} for i in range(5))
+    written = asyncio.run(client.create_grader_task_item(sessions, "m", 9, page_size=2))
+    assert written == 5
+    pages = [params for _, params in client.pool.conn.executed]
+    assert [len(p[0]) for p in pages] == [2, 2, 1]
+    assert pages[0] == ([0, 1], [9, 9], ["m:0", "m:1"])
+
+
+def test_checkpoint_uses_unnest_below_threshold(client):
+    res = asyncio.run(client.checkpoint_items([(1, 2, 3, None, True, "ok", 1.0)], [("COMPLETED", None, 11)]))
+    assert res == {"answers_upserted": 1, "grader_items_updated": 1}
+    assert client.pool.conn.copied == []
+    assert any("unnest(" in q for q, _ in client.pool.conn.executed)
+
+
+def test_checkpoint_copies_at_threshold(client, monkeypatch):
+    monkeypatch.setattr(mod, "COPY_THRESHOLD", 2)
+    an_rows = [(i, 2, 3, None, True, "ok", 1.0) for i in range(3)]
+    gr_rows = [("COMPLETED", None, i) for i in range(3)]
+    res = asyncio.run(client.checkpoint_items(an_rows, gr_rows))
+    assert res == {"answers_upserted": 3, "grader_items_updated": 3}
+    assert [c[0] for c in client.pool.conn.copied] == ["tmp_assessment_answers", "tmp_grader_task_item"]
+    assert any("ON COMMIT DROP" in q for q, _ in client.pool.conn.executed)
+
+
+def test_checkpoint_raises_on_partial_answer_merge(client):
+    client.pool.conn.execute = _short_execute(client.pool.conn.execute)
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.checkpoint_items([(1, 2, 3, None, True, "ok", 1.0)], [("COMPLETED", None, 11)]))
+
+
+def _short_execute(execute):
+    async def _execute(query, *params):
+        await execute(query, *params)
+        return "INSERT 0 0"
+    return _execute
+
+
+def test_update_llm_usage_pipelines_rows(client):
+    rows = [(1, 10, 20, "m", "p", "ok"), (1, 1, 2, "m", "p", "ok")]
+    assert asyncio.run(client.update_llm_usage(rows)) == 2
+    assert client.pool.conn.many[0][1] == rows
+
+
+def test_close_closes_pool(client):
+    pool = client.pool
+    asyncio.run(client.close())
+    assert pool.closed
+
+
+def test_checkpoint_items_in_one_transaction(client):
+    res = asyncio.run(client.checkpoint_items([(1, 2, 3, None, True, "ok", 1.0)], [("COMPLETED", None, 11)]))
+    assert res == {"answers_upserted": 1, "grader_items_updated": 1}
+    assert client.pool.conn.transactions == 1
+    assert "$1" in mod._FINALIZE_GRADER_TASK_QUERY and "%(" not in mod._FINALIZE_GRADER_TASK_QUERY
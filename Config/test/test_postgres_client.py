@@ -0,0 +1,375 @@
+# test_postgres_client.py
+import threading
+import time
+import pytest
+from psycopg2 import OperationalError, ProgrammingError
+import psycopg2.extensions
+
+import Config.PostgresClient as mod
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 1
+
+    def execute(self, query, params=None):
+        if self.conn.fail_next:
+            self.conn.fail_next = False
+            self.conn.closed = 2
+            raise OperationalError("server closed the connection unexpectedly")
+        self.conn.executed.append((query, params) if params is not None else query)
+        # Merges from a staging table touch every staged row
+        self.rowcount = self.conn.staged if "FROM tmp_" in query else 1
+        if not self.conn.autocommit:
+            self.conn.status = psycopg2.extensions.STATUS_IN_TRANSACTION
+
+    def copy_expert(self, sql, buffer):
+        text = buffer.read()
+        self.conn.copied.append((sql, text))
+        self.conn.staged = len(text.splitlines())
+
+    def fetchone(self):
+        return {"ok": 1}
+
+    def fetchall(self):
+        last = self.conn.executed[-1] if self.conn.executed else ""
+        if "EXPLAIN" in (last[0] if isinstance(last, tuple) else last):
+            return [("Seq Scan on t",)]
+        return [{"ok": 1}]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self._autocommit = False
+        self.status = psycopg2.extensions.STATUS_READY
+        self.executed = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_next = False
+        self.last_used = 0.0
+        self.prepared = set()
+        self.copied = []
+        self.staged = 0
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        # Same as psycopg2
+        if self.status != psycopg2.extensions.STATUS_READY:
+            raise ProgrammingError("set_session cannot be used inside a transaction")
+        self._autocommit = value
+
+    def cursor(self, cursor_factory=None):
+        return _FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+
+class _FakePool:
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.idle = []
+        self.created = []
+        self.discarded = []
+        self.closed = False
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        conn = _FakeConn()
+        self.created.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        if close:
+            self.discarded.append(conn)
+        else:
+            self.idle.append(conn)
+
+    def closeall(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(mod, "ThreadedConnectionPool", _FakePool)
+    return mod.PostgresClient(min_size=1, max_size=2, timeout=0.2)
+
+
+# ---------- Tests ----------
+
+def test_connection_is_reused_in_autocommit(db):
+    db.fetch_one("SELECT 1")
+    db.execute("UPDATE t SET x = 1")
+    assert len(db.pool.created) == 1
+    conn = db.pool.created[0]
+    assert conn.autocommit is True
+
+
+def test_transaction_scoped_to_checkout(db):
+    with db._get_cursor_transaction() as curr:
+        curr.execute("INSERT 1")
+    conn = db.pool.created[0]
+    assert conn.commits == 1 and conn.autocommit is True
+
+    with pytest.raises(ValueError):
+        with db._get_cursor_transaction() as curr:
+            curr.execute("INSERT 2")
+            raise ValueError("boom")
+    assert conn.rollbacks == 1 and conn.status == psycopg2.extensions.STATUS_READY
+    assert db.pool.idle == [conn]
+
+
+def test_broken_connection_is_discarded(db):
+    db.fetch_one("SELECT 1")
+    conn = db.pool.created[0]
+    conn.fail_next = True
+    with pytest.raises(RuntimeError):
+        db.fetch_one("SELECT 1")
+    assert db.pool.discarded == [conn]
+    db.fetch_one("SELECT 1")
+    assert len(db.pool.created) == 2
+
+
+def test_idle_connection_is_pinged(db, monkeypatch):
+    db.fetch_one("SELECT 1")
+    conn = db.pool.created[0]
+    monkeypatch.setattr(mod, "POSTGRES_HEALTH_CHECK_IDLE", 0)
+    conn.fail_next = True
+    db.fetch_one("SELECT 2")
+    # The ping failed, the request went to a fresh connection
+    assert db.pool.discarded == [conn]
+    assert db.pool.created[1].executed[-1] == "SELECT 2"
+
+
+def test_fresh_connection_is_pinged_in_autocommit(db, monkeypatch):
+    monkeypatch.setattr(mod, "POSTGRES_HEALTH_CHECK_IDLE", 0)
+    assert db.fetch_one("SELECT 2") == {"ok": 1}
+    conn = db.pool.created[0]
+    assert conn.executed[0] == "SELECT 1;" and conn.autocommit is True
+
+
+def test_failed_prepare_returns_the_connection(db, monkeypatch):
+    prepare = db._prepare
+    failing = [True]
+
+    def _prepare(conn):
+        if failing[0]:
+            raise ProgrammingError("syntax error")
+        prepare(conn)
+    monkeypatch.setattr(db, "_prepare", _prepare)
+    for _ in range(db.max_size + 1):
+        with pytest.raises(RuntimeError):
+            db.get_assessments([1])
+    # Every connection went back closed and its slot was released
+    assert db.pool.discarded == db.pool.created
+    assert db.get_metrics()["pool"]["in_use"] == 0
+    failing[0] = False
+    assert db.get_assessments([1]) == [{"ok": 1}]
+
+
+def test_checkout_waits_for_a_free_connection(db):
+    held = threading.Event()
+    release = threading.Event()
+
+    def _hold():
+        with db._checkout():
+            held.set()
+            release.wait(1)
+
+    threads = [threading.Thread(target=_hold) for _ in range(2)]
+    for t in threads:
+        t.start()
+    held.wait(1)
+    time.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        db.fetch_one("SELECT 1")
+    release.set()
+    for t in threads:
+        t.join()
+    assert db.fetch_one("SELECT 1") == {"ok": 1}
+
+
+def test_close_closes_pool(db):
+    db.close()
+    assert db.pool.closed is True
+
+
+def test_hot_queries_are_prepared_once_per_connection(db):
+    db.get_assessments([3, 1])
+    db.get_assessment_questions([3])
+    conn = db.pool.created[0]
+    prepares = [q for q in conn.executed if isinstance(q, str) and q.startswith("PREPARE")]
+    assert len(prepares) == 1
+    assert "PREPARE get_assessments (int[]) AS SELECT" in prepares[0] and "ANY($1)" in prepares[0]
+    assert conn.executed[-2:] == [
+        ("EXECUTE get_assessments (%s);", ([3, 1],)),
+        ("EXECUTE get_assessment_questions (%s);", ([3],)),
+    ]
+
+
+def test_registered_statement_prepared_on_next_checkout(db):
+    db.get_assessments([1])
+    db.register_prepared("get_students", ("int",), "SELECT id FROM stu_tracker.Assessments_students WHERE session_id = %s")
+    db.fetch_prepared("get_students", (9,))
+    conn = db.pool.created[0]
+    assert conn.executed[-2] == "PREPARE get_students (int) AS SELECT id FROM stu_tracker.Assessments_students WHERE session_id = $1;"
+    assert conn.executed[-1] == ("EXECUTE get_students (%s);", (9,))
+
+
+def test_prepared_statements_can_be_disabled(db, monkeypatch):
+    monkeypatch.setattr(mod, "POSTGRES_PREPARED", False)
+    db.get_session_answers_by_item_key([5])
+    query, params = db.pool.created[0].executed[-1]
+    assert "id = ANY(%s)" in query and params == ([5],)
+
+
+def test_checkpoint_streams_large_chunks_with_copy(db, monkeypatch):
+    monkeypatch.setattr(mod, "COPY_THRESHOLD", 2)
+    an_rows = [(1, 10, None, "it's \"fine\", ok", True, "", 2), (1, 11, 99, None, False, None, 0)]
+    gr_rows = [("COMPLETED", "2026-01-01 00:00:00", 1), ("COMPLETED", "2026-01-01 00:00:00", 2)]
+
+    res = db.checkpoint_items(an_rows, gr_rows)
+
+    conn = db.pool.created[0]
+    assert res == {"answers_upserted": 2, "grader_items_updated": 2}
+    assert conn.commits == 1
+    answers_csv = conn.copied[0][1].splitlines()
+    # NULL marker keeps NULL apart from the empty feedback string
+    assert answers_csv[0] == '1,10,\\N,"it\'s ""fine"", ok",True,,2'
+    assert answers_csv[1] == "1,11,99,\\N,False,\\N,0"
+    assert any("ON COMMIT DROP" in q for q in conn.executed if isinstance(q, str))
+    assert not any("RETURNING" in q for q in conn.executed if isinstance(q, str) and "tmp_" in q)
+
+
+def _paged_execute_values(cur, sql, argslist, template=None, page_size=100, fetch=False):
+    # Same paging as psycopg2: one statement per page, rowcount only covers the last page
+    result = []
+    for i in range(0, len(argslist), page_size):
+        page = argslist[i:i + page_size]
+        cur.execute(sql, page)
+        cur.rowcount = len(page)
+        result.extend({"id": row[0]} for row in page)
+    return result if fetch else None
+
+
+def test_checkpoint_of_more_than_one_page(db, monkeypatch):
+    monkeypatch.setattr(mod, "execute_values", _paged_execute_values)
+    an_rows = [(i, 10, None, "a", True, "f", 1) for i in range(250)]
+    gr_rows = [("COMPLETED", None, i) for i in range(250)]
+    assert db.checkpoint_items(an_rows, gr_rows) == {"answers_upserted": 250, "grader_items_updated": 250}
+    assert db.pool.created[0].commits == 1
+
+
+def test_checkpoint_marks_items_completed_in_one_transaction(db, monkeypatch):
+    monkeypatch.setattr(mod, "COPY_THRESHOLD", 1)
+    res = db.checkpoint_items([(1, 10, None, "a", True, "f", 1)], [("COMPLETED", None, 1)])
+    conn = db.pool.created[0]
+    assert res == {"answers_upserted": 1, "grader_items_updated": 1}
+    assert conn.commits == 1
+    assert [sql.split()[1] for sql, _ in conn.copied] == ["tmp_assessment_answers", "tmp_grader_task_item"]
+
+
+def test_partial_checkpoint_rolls_back(db, monkeypatch):
+    monkeypatch.setattr(mod, "COPY_THRESHOLD", 1)
+    # The item row is gone (task deleted meanwhile), nothing of the chunk is kept
+    monkeypatch.setattr(db, "copy_grader_task_item", lambda params, curr: 0)
+    with pytest.raises(RuntimeError):
+        db.checkpoint_items([(1, 10, None, "a", True, "f", 1)], [("COMPLETED", None, 1)])
+    conn = db.pool.created[0]
+    assert conn.rollbacks == 1 and conn.commits == 0
+
+
+def test_finalize_rolls_up_in_a_transaction(db, monkeypatch):
+    monkeypatch.setattr(_FakeCursor, "fetchone", lambda self: {"pending": 0, "scores_updated": 2, "task_updated": 1})
+    assert db.finalize_grader_task(7, 5) == {"pending": 0, "scores_updated": 2, "task_updated": 1}
+    conn = db.pool.created[0]
+    query, params = conn.executed[-1]
+    assert params == {"task_id": 7, "session_id": 5}
+    assert conn.commits == 1
+    assert db.get_metrics()["queries"]["finalize_grader_task"]["rows"] == 2
+
+
+def test_task_items_written_in_pages_from_a_generator(db, monkeypatch):
+    pages = []
+    monkeypatch.setattr(mod, "execute_values", lambda curr, query, rows, page_size=None: pages.append(rows) or setattr(curr, "rowcount", len(rows)))
+    pulled = []
+
+    def _answers():
+        for i in range(5):
+            pulled.append(i)
+            yield {"id": i}
+
+    written = db.create_grader_task_item(_answers(), "GOOGLE", 3, page_size=2)
+    assert written == 5
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert pages[0][1] == (1, 3, "GOOGLE:1")
+    # One transaction per page
+    assert db.pool.created[0].commits == 3
+
+
+def test_queries_are_timed_per_caller(db):
+    def get_grader_task_id():
+        return db.fetch_one("SELECT id FROM t WHERE x = %s", (1,))
+
+    get_grader_task_id()
+    get_grader_task_id()
+    db.fetch_all("SELECT 1", name="custom")
+    db.get_assessments([1])
+    queries = db.get_metrics()["queries"]
+    assert queries["get_grader_task_id"]["count"] == 2 and queries["get_grader_task_id"]["rows"] == 2
+    assert sum(queries["get_grader_task_id"]["buckets"].values()) == 2
+    assert queries["custom"]["rows"] == 1
+    assert queries["get_assessments"]["count"] == 1
+    assert db.get_metrics()["pool"]["max_size"] == 2
+
+
+def test_errors_are_counted(db):
+    db.fetch_one("SELECT 1")
+    db.pool.created[0].fail_next = True
+    with pytest.raises(RuntimeError):
+        db.execute("UPDATE t SET x = 1", name="update_t")
+    assert db.get_metrics()["queries"]["update_t"]["errors"] == 1
+
+
+def test_slow_selects_are_logged_and_explained(db, monkeypatch, caplog):
+    monkeypatch.setattr(mod, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(mod, "EXPLAIN_SAMPLE_RATE", 1.0)
+    db.fetch_one("SELECT 1")
+    conn = db.pool.created[0]
+    conn.executed.clear()
+    with caplog.at_level("WARNING"):
+        db.fetch_all("SELECT * FROM t WHERE id = %s", (5,), name="slow_read")
+        db.execute("UPDATE t SET x = %s", (2,), name="slow_write")
+    explains = [q for q in conn.executed if "EXPLAIN" in (q[0] if isinstance(q, tuple) else q)]
+    assert explains == [("EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM t WHERE id = %s", (5,))]
+    assert "Slow query slow_write" in caplog.text and "params: (2,)" in caplog.text
+    assert db.get_metrics()["queries"]["slow_read"]["slow"] == 1
+
+
+def test_is_select():
+    assert mod.is_select("  select 1")
+    assert mod.is_select("WITH a AS (SELECT 1) SELECT * FROM a")
+    assert not mod.is_select("WITH t AS (INSERT INTO x VALUES (1) RETURNING id) SELECT * FROM t")
+    assert not mod.is_select("UPDATE t SET x = 1")
@@ -0,0 +1,169 @@
+# test_rabbitmq.py
+import threading
+import pika
+
+import Config.RabbitMQ as mod
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.calls = []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.calls.append(("publish", exchange, routing_key, body, properties))
+
+    def exchange_declare(self, exchange, exchange_type, durable=False):
+        self.calls.append(("exchange", exchange, exchange_type))
+
+    def queue_declare(self, queue, durable=False, arguments=None):
+        self.calls.append(("queue", queue, arguments))
+
+    def queue_bind(self, exchange, queue, routing_key=None):
+        self.calls.append(("bind", exchange, queue, routing_key))
+
+
+class _Method:
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+
+class _FakeConnection:
+    """Queues threadsafe callbacks until the test plays the I/O loop."""
+    def __init__(self):
+        self.callbacks = []
+        self.callback_threads = []
+        self.open = True
+
+    def add_callback_threadsafe(self, callback):
+        if not self.open:
+            raise pika.exceptions.ConnectionWrongStateError("closed")
+        self.callback_threads.append(threading.get_ident())
+        self.callbacks.append(callback)
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+# ---------- Tests ----------
+
+def test_acks_from_a_worker_run_on_the_io_thread():
+    channel, connection = _FakeChannel(), _FakeConnection()
+    threadsafe = mod.ThreadsafeChannel(channel, connection)
+
+    worker = threading.Thread(target=lambda: (threadsafe.basic_ack(delivery_tag=1), threadsafe.basic_nack(delivery_tag=2, requeue=False)))
+    worker.start()
+    worker.join()
+
+    # Nothing touches the channel until the I/O loop runs the callbacks
+    assert channel.calls == []
+    connection.run_callbacks()
+    assert channel.calls == [("ack", 1), ("nack", 2, False)]
+
+
+def test_ack_on_a_closed_channel_is_dropped():
+    channel, connection = _FakeChannel(), _FakeConnection()
+    threadsafe = mod.ThreadsafeChannel(channel, connection)
+    threadsafe.basic_ack(delivery_tag=1)
+    channel.is_open = False
+    connection.run_callbacks()
+    assert channel.calls == []
+
+
+def test_ack_on_a_closed_connection_does_not_raise():
+    connection = _FakeConnection()
+    connection.open = False
+    mod.ThreadsafeChannel(_FakeChannel(), connection).basic_nack(delivery_tag=1)
+
+
+def test_close_is_quiet_once_the_broker_dropped_the_connection():
+    class _Dropped:
+        is_open = True
+
+        def close(self):
+            raise pika.exceptions.StreamLostError("lost")
+
+    mq = mod.RabbitMQ.__new__(mod.RabbitMQ)
+    mq.connection = _Dropped()
+    mq.close()
+
+
+def test_retry_count_from_x_death_and_header():
+    assert mod.retry_count(None, "grade") == 0
+    properties = pika.BasicProperties(headers={"x-death": [
+        {"queue": "grade.retry.0", "count": 1},
+        {"queue": b"grade.retry.1", "count": 2},
+        {"queue": "other.retry.0", "count": 5},
+    ]})
+    assert mod.retry_count(properties, "grade") == 3
+    assert mod.retry_count(pika.BasicProperties(headers={mod.RETRY_COUNT_HEADER: 4}), "grade") == 4
+
+
+def test_retry_publishes_to_the_next_delay_queue_then_acks(monkeypatch):
+    monkeypatch.setattr(mod, "RETRY_DELAYS", [5, 30])
+    channel, connection = _FakeChannel(), _FakeConnection()
+    threadsafe = mod.ThreadsafeChannel(channel, connection, "ex", "grade")
+    properties = pika.BasicProperties(priority=9, headers={mod.RETRY_COUNT_HEADER: 3})
+
+    assert threadsafe.retry(_Method(1), pika.BasicProperties(), b"s1", max_attempts=10) == "grade.retry.0"
+    # Past the last step the longest delay repeats
+    assert threadsafe.retry(_Method(2), properties, b"s2", max_attempts=10) == "grade.retry.1"
+    assert channel.calls == []
+    connection.run_callbacks()
+
+    (_, exchange, key, body, sent), ack = channel.calls[0], channel.calls[1]
+    assert (exchange, key, body, ack) == ("ex.retry", "grade.retry.0", b"s1", ("ack", 1))
+    assert sent.headers[mod.RETRY_COUNT_HEADER] == 1 and sent.delivery_mode == 2
+    sent = channel.calls[2][4]
+    assert sent.priority == 9 and sent.headers[mod.RETRY_COUNT_HEADER] == 4
+    assert properties.headers[mod.RETRY_COUNT_HEADER] == 3
+
+
+def test_retry_parks_after_max_attempts():
+    channel, connection = _FakeChannel(), _FakeConnection()
+    threadsafe = mod.ThreadsafeChannel(channel, connection, "ex", "grade")
+    properties = pika.BasicProperties(headers={mod.RETRY_COUNT_HEADER: 2})
+    assert threadsafe.retry(_Method(1), properties, b"s", max_attempts=3) == "grade.parking"
+    connection.run_callbacks()
+    assert [c[0] for c in channel.calls] == ["publish", "ack"]
+
+
+def test_defer_is_not_counted_as_a_retry():
+    channel, connection = _FakeChannel(), _FakeConnection()
+    threadsafe = mod.ThreadsafeChannel(channel, connection, "ex", "grade")
+    properties = pika.BasicProperties(headers={mod.RETRY_COUNT_HEADER: 2})
+    assert threadsafe.defer(_Method(1), properties, b"s") == "grade.defer"
+    connection.run_callbacks()
+    (_, exchange, key, _, sent), ack = channel.calls
+    assert (exchange, key, ack) == ("ex.retry", "grade.defer", ("ack", 1))
+    assert sent.headers[mod.RETRY_COUNT_HEADER] == 2
+    # Dead-lettered back from the defer queue, x-death names it but retry_count skips it
+    sent.headers["x-death"] = [{"queue": "grade.defer", "count": 4}]
+    assert mod.retry_count(sent, "grade") == 2
+
+
+def test_declare_retry_topology(monkeypatch):
+    monkeypatch.setattr(mod, "RETRY_DELAYS", [5, 30])
+    mq = mod.RabbitMQ.__new__(mod.RabbitMQ)
+    mq.channel = _FakeChannel()
+    mq.declare_retry_topology("ex", "grade", "grade.key")
+    calls = mq.channel.calls
+    assert calls[0] == ("exchange", "ex.retry", "direct")
+    assert ("queue", "grade.retry.1", {
+        "x-message-ttl": 30000, "x-dead-letter-exchange": "ex", "x-dead-letter-routing-key": "grade.key",
+    }) in calls
+    assert ("bind", "ex.retry", "grade.retry.0", "grade.retry.0") in calls
+    assert ("bind", "ex.retry", "grade.parking", "grade.parking") in calls
+    assert ("queue", "grade.defer", {
+        "x-message-ttl": mod.DEFER_SECONDS * 1000, "x-dead-letter-exchange": "ex", "x-dead-letter-routing-key": "grade.key",
+    }) in calls
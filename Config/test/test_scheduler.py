@@ -0,0 +1,96 @@
+# test_scheduler.py
+import threading
+import pytest
+
+from Config.Scheduler import FairScheduler, WeightedRoundRobin, lane_for, INTERACTIVE, BULK
+
+
+# ---------- Fakes / helpers ----------
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+def _drain_order(scheduler):
+    order = []
+    while True:
+        item = scheduler.get(timeout=0)
+        if item is None:
+            return order
+        order.append(item)
+
+
+# ---------- Tests ----------
+
+def test_round_robin_respects_weights():
+    rr = WeightedRoundRobin(lambda key: 2 if key == "a" else 1)
+    for i in range(4):
+        rr.put("a", f"a{i}")
+    for i in range(2):
+        rr.put("b", f"b{i}")
+    assert [rr.pop()[1] for _ in range(6)] == ["a0", "a1", "b0", "a2", "a3", "b1"]
+    with pytest.raises(IndexError):
+        rr.pop()
+
+
+def test_small_organization_is_not_stuck_behind_a_backlog():
+    scheduler = FairScheduler(lane_weights={INTERACTIVE: 1, BULK: 1}, organization_weights={})
+    for i in range(100):
+        scheduler.put(1, f"district-{i}")
+    scheduler.put(2, "school-quiz")
+    order = _drain_order(scheduler)
+    assert order.index("school-quiz") == 1
+    assert len(order) == 101
+
+
+def test_interactive_lane_is_weighted_over_bulk():
+    scheduler = FairScheduler(lane_weights={INTERACTIVE: 3, BULK: 1}, organization_weights={})
+    for i in range(4):
+        scheduler.put(1, f"bulk-{i}", BULK)
+    for i in range(6):
+        scheduler.put(1, f"regrade-{i}", INTERACTIVE)
+    order = _drain_order(scheduler)
+    # bulk arrived first and gets its turn, then three re-grades per bulk session
+    assert order[:5] == ["bulk-0", "regrade-0", "regrade-1", "regrade-2", "bulk-1"]
+    assert len(order) == 10
+
+
+def test_queue_wait_is_recorded_per_lane_and_organization():
+    clock = _Clock()
+    scheduler = FairScheduler(lane_weights={}, organization_weights={}, clock=clock)
+    scheduler.put(7, "a", INTERACTIVE)
+    scheduler.put(8, "b")
+    assert scheduler.metrics()["queued"] == {INTERACTIVE: {"7": 1}, BULK: {"8": 1}}
+    clock.now = 0.25
+    _drain_order(scheduler)
+    wait = scheduler.metrics()["wait"]
+    assert wait["interactive:7"]["count"] == 1 and wait["interactive:7"]["max_ms"] == 250.0
+    assert wait["bulk:8"]["count"] == 1
+
+
+def test_get_waits_for_a_put():
+    scheduler = FairScheduler(lane_weights={}, organization_weights={})
+    assert scheduler.get(timeout=0) is None
+    got = []
+    worker = threading.Thread(target=lambda: got.append(scheduler.get(timeout=2)))
+    worker.start()
+    scheduler.put(1, "x")
+    worker.join()
+    assert got == ["x"]
+
+
+def test_drain_empties_every_lane():
+    scheduler = FairScheduler(lane_weights={}, organization_weights={})
+    scheduler.put(1, "a")
+    scheduler.put(2, "b", INTERACTIVE)
+    assert sorted(scheduler.drain()) == ["a", "b"]
+    assert scheduler.get(timeout=0) is None
+
+
+def test_lane_for_priority():
+    assert lane_for(None) == BULK
+    assert lane_for(0) == BULK
+    assert lane_for(9) == INTERACTIVE
@@ -0,0 +1,141 @@
+from typing import Optional
+import threading
+import time
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+# Requests/tokens per minute, 0 disables the bucket.
+PROVIDER_LIMITS = {
+    "GOOGLE": {"rpm": int(os.getenv("GOOGLE_RPM", 0)), "tpm": int(os.getenv("GOOGLE_TPM", 0))},
+    "AMZN": {"rpm": int(os.getenv("AMZN_RPM", 0)), "tpm": int(os.getenv("AMZN_TPM", 0))},
+}
+ORGANIZATION_LIMITS = {"rpm": int(os.getenv("ORG_RPM", 0)), "tpm": int(os.getenv("ORG_TPM", 0))}
+# Output tokens charged up front, corrected with real usage in settle()
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("EXPECTED_OUTPUT_TOKENS", 400))
+
+
+class TokenBucket:
+    """
+        capacity units refilled at capacity / 60 per second (a per minute limit with a one minute burst).
+        The level can go negative when real usage exceeds the estimate, later callers then wait it off.
+    """
+    def __init__(self, per_minute: int, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.clock = clock
+        self.level = float(per_minute)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+            Seconds until amount can be taken, requests above capacity only wait for a full bucket.
+        """
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {"capacity": self.capacity, "available": round(self.level, 2)}
+
+
+class Ticket:
+    def __init__(self, provider: str, organization_id, estimated_tokens: int, queued_seconds: float):
+        self.provider = provider
+        self.organization_id = organization_id
+        self.estimated_tokens = estimated_tokens
+        self.queued_seconds = queued_seconds
+
+
+class AdmissionController:
+    """
+        Process wide admission for model calls.
+        Every call takes 1 request and its estimated tokens from the provider buckets and from the
+        (provider, organization) buckets, and waits in line while any of them is short.
+    """
+    def __init__(self, provider_limits: dict = None, organization_limits: dict = None, clock=time.monotonic):
+        self.provider_limits = PROVIDER_LIMITS if provider_limits is None else provider_limits
+        self.organization_limits = ORGANIZATION_LIMITS if organization_limits is None else organization_limits
+        self.clock = clock
+        self.buckets = {}
+        self.cond = threading.Condition()
+        self.counters = {"admitted": 0, "waiting": 0, "queued_seconds": 0.0, "corrections": 0}
+
+    def _buckets_for(self, provider: str, organization_id) -> list:
+        keys = []
+        for kind in ("rpm", "tpm"):
+            if self.provider_limits.get(provider, {}).get(kind):
+                keys.append(((provider, kind), self.provider_limits[provider][kind]))
+            if organization_id is not None and self.organization_limits.get(kind):
+                keys.append(((provider, organization_id, kind), self.organization_limits[kind]))
+        buckets = []
+        for key, limit in keys:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(limit, clock=self.clock)
+            buckets.append((key[-1], self.buckets[key]))
+        return buckets
+
+    def acquire(self, provider: str, organization_id, estimated_tokens: int) -> Ticket:
+        """
+            Block until the call fits every bucket, then charge it.
+            Params: provider (str), organization_id (int), estimated_tokens (int)
+
+            Returns Ticket, pass it to settle() with the real token usage.
+        """
+        started = self.clock()
+        with self.cond:
+            self.counters["waiting"] += 1
+            try:
+                while True:
+                    buckets = self._buckets_for(provider, organization_id)
+                    wait = max([b.wait_time(1 if kind == "rpm" else estimated_tokens) for kind, b in buckets] + [0.0])
+                    if wait <= 0:
+                        break
+                    self.cond.wait(timeout=wait)
+                for kind, b in buckets:
+                    b.take(1 if kind == "rpm" else estimated_tokens)
+            finally:
+                self.counters["waiting"] -= 1
+            queued = self.clock() - started
+            self.counters["admitted"] += 1
+            self.counters["queued_seconds"] += queued
+        if queued > 1:
+            logger.info("admission %s org %s queued %.2fs", provider, organization_id, queued)
+        return Ticket(provider, organization_id, estimated_tokens, queued)
+
+    def settle(self, ticket: Optional[Ticket], actual_tokens: Optional[int]):
+        """
+            Correct the token buckets with the real usage of an admitted call.
+        """
+        if ticket is None or actual_tokens is None:
+            return
+        delta = actual_tokens - ticket.estimated_tokens
+        with self.cond:
+            for kind, b in self._buckets_for(ticket.provider, ticket.organization_id):
+                if kind == "tpm":
+                    b.take(delta)
+            self.counters["corrections"] += 1
+            # Refunds may let queued callers in earlier
+            self.cond.notify_all()
+
+    def metrics(self) -> dict:
+        with self.cond:
+            buckets = {":".join(str(k) for k in key): b.snapshot() for key, b in self.buckets.items()}
+            return dict(self.counters, buckets=buckets)
+
+
+admission = AdmissionController()
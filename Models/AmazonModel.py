@@ -1,7 +1,12 @@
 import os
 import json
+import asyncio
+from typing import Optional
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
+from Models.Provider import GenerationConfig, model_loop, run_sync, MODEL_POOL_SIZE, MODEL_TIMEOUT
+from Models.Schemas import tool_name
 from dotenv import load_dotenv
 import logging
 load_dotenv()
@@ -14,78 +19,184 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 MODEL_ID = os.getenv("MODEL_ID")
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
+bedrock = boto3.client("bedrock-runtime", region_name="us-east-1",
+                       config=Config(max_pool_connections=MODEL_POOL_SIZE, read_timeout=MODEL_TIMEOUT, connect_timeout=10,
+                                     retries={"mode": "standard", "max_attempts": 1}))
 
+
+class AmazonProvider:
+    """
+        Async interface over the shared bedrock-runtime client.
+        boto3 is blocking, calls run on the shared model io pool and are awaited with a timeout,
+        cancelling the awaiting task frees the caller right away.
+    """
+    def request(self, prompt: str, config: GenerationConfig) -> tuple:
+        if config.system_prefix or config.response_schema is not None:
+            kwargs = dict(
+                modelId=MODEL_ID,
+                messages=[{"role": "user", "content": [{"text": prompt}]}],
+                inferenceConfig={"maxTokens": config.max_gen_len, "temperature": config.temp, "topP": config.top_p}
+            )
+            if config.system_prefix:
+                # Converse with a cachePoint after the system prefix (Bedrock prompt caching),
+                # repeated prefixes are billed and processed once while the cache is warm.
+                kwargs["system"] = [{"text": config.system_prefix}, {"cachePoint": {"type": "default"}}]
+            if config.response_schema is not None:
+                # Structured output: a single tool with the schema as input, and the model is forced to call it
+                name = tool_name(config.response_schema)
+                kwargs["toolConfig"] = {
+                    "tools": [{"toolSpec": {"name": name, "inputSchema": {"json": config.response_schema.model_json_schema()}}}],
+                    "toolChoice": {"tool": {"name": name}}
+                }
+            return (bedrock.converse, kwargs)
+        return (bedrock.invoke_model, dict(
+            modelId=MODEL_ID,
+            body=json.dumps({
+                "inputText": prompt,
+                "textGenerationConfig": {
+                    "maxTokenCount": config.max_gen_len,
+                    "temperature": config.temp
+                }
+            })
+        ))
+
+    async def agenerate(self, prompt: str, config: GenerationConfig) -> dict:
+        """
+            Returns the raw invoke_model / converse response, raises provider errors and asyncio.TimeoutError.
+        """
+        fn, kwargs = self.request(prompt, config)
+        return await asyncio.wait_for(model_loop.call_blocking(fn, **kwargs), timeout=config.timeout)
+
+    async def astream(self, prompt: str, config: GenerationConfig):
+        """
+            Async generator of text chunks (invoke_model_with_response_stream, converse_stream with a cached prefix).
+            Every blocking read runs on the io pool, closing the generator closes the event stream.
+        """
+        _, kwargs = self.request(prompt, config)
+        converse = "messages" in kwargs
+        fn = bedrock.converse_stream if converse else bedrock.invoke_model_with_response_stream
+        response = await asyncio.wait_for(model_loop.call_blocking(fn, **kwargs), timeout=config.timeout)
+        events = response["stream"] if converse else response["body"]
+        iterator = iter(events)
+        try:
+            while True:
+                event = await asyncio.wait_for(model_loop.call_blocking(next, iterator, None), timeout=config.timeout)
+                if event is None:
+                    break
+                text = self.event_text(event)
+                if text:
+                    yield text
+        finally:
+            events.close()
+
+    @staticmethod
+    def event_text(event: dict) -> Optional[str]:
+        if "chunk" in event:
+            return json.loads(event["chunk"]["bytes"]).get("outputText")
+        if "contentBlockDelta" in event:
+            delta = event["contentBlockDelta"].get("delta", {})
+            # Forced tool calls stream their input as JSON fragments
+            return delta.get("text") or delta.get("toolUse", {}).get("input")
+        return None
+
+
+amazon_provider = AmazonProvider()
+_PENDING = object()
+
+
+# Sync wrapper over AmazonProvider.agenerate
 class AmazonModel:
-    def __init__(self, prompt: str, temp: float, top_p: float, max_gen_len: int):
+    def __init__(self, prompt: str, temp: float, top_p: float, max_gen_len: int, system_prefix: str = None,
+                 response_schema: type = None, response=_PENDING):
         self.prompt = prompt 
         self.temp = temp
         self.top_p = top_p
         self.max_gen_len = max_gen_len
-        # Build the response
-        self.response = self._invoke_model()
+        # When set, prompt only carries the suffix and the prefix is sent as a cached system block.
+        self.config = GenerationConfig(temp=temp, top_p=top_p, max_gen_len=max_gen_len, system_prefix=system_prefix,
+                                       response_schema=response_schema)
+        # Last provider error, used by the retry policy to classify failures
+        self.error = None
+        # Build the response, unless it was already awaited by acreate()
+        self.response = self._invoke_model() if response is _PENDING else response
         self.parsed_response = None
         # Verify the response and append
         if self.response:
             self.parsed_response = self._parse_response()
 
+    @classmethod
+    async def acreate(cls, prompt: str, temp: float, top_p: float, max_gen_len: int, system_prefix: str = None,
+                      response_schema: type = None) -> "AmazonModel":
+        """
+            Async constructor, awaits the provider instead of blocking the caller.
+        """
+        config = GenerationConfig(temp=temp, top_p=top_p, max_gen_len=max_gen_len, system_prefix=system_prefix,
+                                  response_schema=response_schema)
+        response, error = None, None
+        try:
+            response = await amazon_provider.agenerate(prompt, config)
+        except Exception as e:
+            logger.error(f"An error occurred while invoking model '{MODEL_ID}': {e}")
+            error = e
+        model = cls(prompt, temp, top_p, max_gen_len, system_prefix=system_prefix, response_schema=response_schema, response=response)
+        model.error = error
+        return model
 
     def _invoke_model(self) -> dict:
         try:
-            response = bedrock.invoke_model(
-                modelId=MODEL_ID,
-                body=json.dumps({
-                    "inputText": self.prompt,
-                    "textGenerationConfig": {
-                        "maxTokenCount": self.max_gen_len,
-                        "temperature": self.temp
-                    }
-                })
-            )
+            response = run_sync(amazon_provider.agenerate(self.prompt, self.config))
             logger.info(f"Successfully invoked model '{MODEL_ID}'.")
             logger.info(f"Successfully response '{response}'.")
             return response
         except ClientError as e:
+            self.error = e
             logger.error(f"Bedrock ClientError invoking model '{MODEL_ID}': {e.response['Error']['Message']}")
             return None
         except ValueError as e:
+            self.error = e
             logger.error(f"ValueError while invoking model: {e}")
             return None
         except Exception as e:
+            self.error = e
             logger.error(f"An unexpected error occurred while invoking model '{MODEL_ID}': {e}")
             return None
 
-    def input_token(self):
+    def _usage(self, key: str):
+        # The body stream can only be read once, usage is taken from the parsed response.
         try:
-            response_body = json.loads(self.response.get("body").read())
-            usage = response_body.get("usage")
-            return usage.get("inputTokens")
-        except (AttributeError, json.JSONDecodeError) as e:
-            logger.error(f"output token error {e}")
+            return self.parsed_response.get("usage").get(key)
+        except AttributeError as e:
+            logger.error(f"token usage error {e}")
             return None
 
+    def input_token(self):
+        return self._usage("inputTokens")
+
     def output_token(self):
-        try:
-            response_body = json.loads(self.response.get("body").read())
-            usage = response_body.get("usage")
-            return usage.get("outputTokens")
-        except (AttributeError, json.JSONDecodeError) as e:
-            logger.error(f"output token error {e}")
-            return None
+        return self._usage("outputTokens")
         
     def total_token(self):
-        try:
-            response_body = json.loads(self.response.get("body").read())
-            usage = response_body.get("usage")
-            return usage.get("totalTokens")
-        except (AttributeError, json.JSONDecodeError) as e:
-            logger.error(f"output token error {e}")
-            return None
+        return self._usage("totalTokens")
+
+    @staticmethod
+    def _block_text(block: dict) -> str:
+        # toolUse blocks carry the structured output as an already parsed object
+        if "toolUse" in block:
+            return json.dumps(block["toolUse"].get("input"))
+        return block.get("text", "")
 
     def _parse_response(self):
         if not self.response:
             logger.warning("No response to parse. The model invocation may have failed.")
             return None
+        if "output" in self.response:
+            # Converse shape, normalized to the invoke_model body shape
+            try:
+                text = "".join(self._block_text(block) for block in self.response["output"]["message"]["content"])
+                return {"results": [{"outputText": text}], "usage": self.response.get("usage")}
+            except (AttributeError, KeyError, TypeError) as e:
+                logger.error(f"Error accessing converse output: {e}")
+                return None
         try:
             parsed_body = json.loads(self.response.get("body").read())
             logger.debug("Successfully parsed model response body.")
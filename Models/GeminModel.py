@@ -1,9 +1,13 @@
 import os
 import json
+import asyncio
+import httpx
 import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
+from Models.Provider import GenerationConfig, run_sync, MODEL_POOL_SIZE
 import logging
 
 logging.basicConfig(
@@ -15,27 +19,108 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+_limits = httpx.Limits(max_connections=MODEL_POOL_SIZE, max_keepalive_connections=MODEL_POOL_SIZE)
+client = genai.Client(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    http_options=types.HttpOptions(client_args={"limits": _limits}, async_client_args={"limits": _limits})
+)
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+
+def create_cached_content(prefix: str, ttl_seconds: int) -> str:
+    """
+        Register a prompt prefix with Gemini context caching.
+        Returns the cached content name to pass as cached_content, raises on provider errors.
+    """
+    cache = client.caches.create(
+        model=GEMINI_MODEL,
+        config=types.CreateCachedContentConfig(contents=[prefix], ttl=f"{ttl_seconds}s")
+    )
+    return cache.name
+
+
+def count_tokens(text: str) -> int:
+    """
+        Tokens of text for GEMINI_MODEL as counted by the provider.
+    """
+    return client.models.count_tokens(model=GEMINI_MODEL, contents=text).total_tokens
+
+class GeminiProvider:
+    """
+        Async interface over the shared genai client (client.aio), one pooled httpx connection pool per process.
+    """
+    def request(self, prompt: str, config: GenerationConfig) -> dict:
+        kwargs = dict(model=GEMINI_MODEL, contents=prompt)
+        options = {}
+        if config.cached_content:
+            options["cached_content"] = config.cached_content
+        if config.response_schema is not None:
+            # Constrained decoding, the reply is JSON that follows the schema
+            options["response_mime_type"] = "application/json"
+            options["response_schema"] = config.response_schema
+        if options:
+            kwargs["config"] = types.GenerateContentConfig(**options)
+        return kwargs
+
+    async def agenerate(self, prompt: str, config: GenerationConfig):
+        """
+            Returns the raw GenerateContentResponse, raises provider errors and asyncio.TimeoutError.
+            With config.cached_content the prompt only carries the suffix, the prefix is served from the provider cache.
+        """
+        kwargs = self.request(prompt, config)
+        return await asyncio.wait_for(client.aio.models.generate_content(**kwargs), timeout=config.timeout)
+
+    async def astream(self, prompt: str, config: GenerationConfig):
+        """
+            Async generator of text chunks (generate_content_stream), closing it cancels the stream.
+        """
+        kwargs = self.request(prompt, config)
+        stream = await asyncio.wait_for(client.aio.models.generate_content_stream(**kwargs), timeout=config.timeout)
+        try:
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            await stream.aclose()
+
+
+gemini_provider = GeminiProvider()
+_PENDING = object()
 
 """
     This will be used for testing since Amazon On-demand will charge!!!
     This is Free for development pusposes
 """
 class GeminiModel:
-    def __init__(self, prompt: str):
+    def __init__(self, prompt: str, cached_content: str = None, response_schema: type = None, response=_PENDING):
         self.prompt = prompt 
-        self.response = self.generate_gemini()
+        self.cached_content = cached_content
+        self.config = GenerationConfig(cached_content=cached_content, response_schema=response_schema)
+        # Last provider error, used by the retry policy to classify failures
+        self.error = None
+        # Sync wrapper over GeminiProvider.agenerate, unless the response was already awaited by acreate()
+        self.response = self.generate_gemini() if response is _PENDING else response
         self.parsed_response = None
 
+    @classmethod
+    async def acreate(cls, prompt: str, cached_content: str = None, response_schema: type = None) -> "GeminiModel":
+        response, error = None, None
+        try:
+            response = await gemini_provider.agenerate(prompt, GenerationConfig(cached_content=cached_content, response_schema=response_schema))
+        except Exception as e:
+            logger.error("Error: Can't invoke. Reason: %s", e)
+            error = e
+        model = cls(prompt, cached_content=cached_content, response_schema=response_schema, response=response)
+        model.error = error
+        return model
+
     def generate_gemini(self) -> dict:
         try:
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=self.prompt
-            )
+            response = run_sync(gemini_provider.agenerate(self.prompt, self.config))
             print(response)
             return response
         except (ClientError, Exception) as e:
+            self.error = e
             print(f"Error: Can't invoke. Reason: '{e}''")
     
 
@@ -0,0 +1,75 @@
+from typing import Optional
+import json
+import logging
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class JsonScanner:
+    """
+        Incremental scanner for the first complete JSON value in a streamed generation.
+        feed() only looks at the new characters, tracking depth and string/escape state while inside a value,
+        so prose and code fences around the JSON are skipped without buffering the whole reply.
+        open_char: "{" for an object, "[" for an array. required: keys an object must carry to be accepted.
+    """
+    def __init__(self, open_char: str = "{", required: tuple = ()):
+        self.open_char = open_char
+        self.close_char = "}" if open_char == "{" else "]"
+        self.required = required
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.result = None
+        self.json_text = None
+        self.text = ""
+
+    def feed(self, chunk: Optional[str]):
+        """
+            Returns the parsed value once complete, None until then.
+        """
+        if self.result is not None or not chunk:
+            return self.result
+        self.text += chunk
+        for ch in chunk:
+            if self.depth == 0:
+                if ch == self.open_char:
+                    self.buffer, self.depth = [ch], 1
+                continue
+            self.buffer.append(ch)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0 and self._accept("".join(self.buffer)):
+                    return self.result
+        return None
+
+    def _accept(self, candidate: str) -> bool:
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            logger.debug("skipping unparsable candidate %s", candidate[:80])
+            return False
+        if isinstance(value, dict) and any(k not in value for k in self.required):
+            return False
+        self.result = value
+        self.json_text = candidate
+        return True
+
+    def done(self) -> bool:
+        return self.result is not None
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from typing import Optional
+import asyncio
+import threading
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+# Shared connection pool size for every provider client of the process
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", 32))
+# Per call timeout in seconds
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", 120))
+
+
+class GenerationConfig:
+    """
+        Per call settings for agenerate(prompt, config).
+        cached_content: Gemini cached content name, system_prefix: Bedrock prefix sent before a cachePoint.
+        response_schema: pydantic model class the reply must follow (structured output).
+    """
+    def __init__(self, temp: Optional[float] = None, top_p: Optional[float] = None, max_gen_len: Optional[int] = None,
+                 timeout: float = MODEL_TIMEOUT, cached_content: Optional[str] = None, system_prefix: Optional[str] = None,
+                 response_schema: Optional[type] = None):
+        self.temp = temp
+        self.top_p = top_p
+        self.max_gen_len = max_gen_len
+        self.timeout = timeout
+        self.cached_content = cached_content
+        self.system_prefix = system_prefix
+        self.response_schema = response_schema
+
+
+class ModelLoop:
+    """
+        One background event loop per process that owns the async provider clients and their pools.
+        Sync callers (AmazonModel, GeminiModel, grader threads) submit coroutines to it, so every thread
+        shares the same sockets. Started lazily, which keeps it fork safe.
+    """
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.blocking_pool: Optional[ThreadPoolExecutor] = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None or self.pid != os.getpid():
+                self.loop = asyncio.new_event_loop()
+                self.blocking_pool = ThreadPoolExecutor(max_workers=MODEL_POOL_SIZE, thread_name_prefix="model-io")
+                self.pid = os.getpid()
+                threading.Thread(target=self.loop.run_forever, name="model-loop", daemon=True).start()
+            return self.loop
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """
+            Run coro on the model loop and wait for it, the coroutine is cancelled when timeout is hit.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"model call exceeded {timeout}s")
+
+    async def call_blocking(self, fn, *args, **kwargs):
+        """
+            Await a blocking client call (boto3) on the shared io pool.
+        """
+        self.get_loop()
+        return await asyncio.get_running_loop().run_in_executor(self.blocking_pool, partial(fn, *args, **kwargs))
+
+
+model_loop = ModelLoop()
+
+
+def run_sync(coro, timeout: Optional[float] = None):
+    return model_loop.run(coro, timeout)
+
+
+async def stream_json(stream, scanner) -> tuple:
+    """
+        Feed a provider text stream to a JsonScanner and stop reading as soon as the first value is complete.
+        Leaving the loop closes the async generator, which cancels the rest of the provider stream.
+        Params: stream (async iterator of str), scanner (JsonScanner)
+
+        Returns Tuple
+        (json_text (str) or None, text read so far (str))
+    """
+    try:
+        async for chunk in stream:
+            if scanner.feed(chunk) is not None:
+                break
+    finally:
+        await stream.aclose()
+    return (scanner.json_text, scanner.text)
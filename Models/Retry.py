@@ -0,0 +1,173 @@
+from botocore.exceptions import ClientError
+from google.genai import errors as genai_errors
+from typing import Optional
+import asyncio
+import random
+import threading
+import time
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 20))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+
+THROTTLE = 'THROTTLE'
+SERVER = 'SERVER'
+TIMEOUT = 'TIMEOUT'
+PARSE = 'PARSE'
+FATAL = 'FATAL'
+# Kinds that say something about provider health and count against the circuit breaker
+PROVIDER_FAILURES = (THROTTLE, SERVER, TIMEOUT)
+_THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+_SERVER_CODES = {"InternalServerException", "ServiceUnavailableException", "ModelNotReadyException", "ModelTimeoutException", "ModelErrorException"}
+
+
+class CircuitOpenError(Exception):
+    """
+        Raised instead of calling a provider whose breaker is open.
+        Not a RuntimeError on purpose, so it is not swallowed by the graders and reaches the consumer,
+        which defers the session instead of spending an attempt on it.
+    """
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"circuit open for {provider}, retry in {retry_in:.1f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+def classify(error: Optional[BaseException]) -> str:
+    """
+        Map a provider error to THROTTLE, SERVER, TIMEOUT or FATAL.
+        No error (an empty or invalid generation) counts as SERVER.
+    """
+    if error is None:
+        return SERVER
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        if code in _THROTTLE_CODES or status == 429:
+            return THROTTLE
+        if code in _SERVER_CODES or status >= 500:
+            return SERVER
+        return FATAL
+    if isinstance(error, genai_errors.APIError):
+        if error.code == 429:
+            return THROTTLE
+        if error.code is not None and error.code >= 500:
+            return SERVER
+        return FATAL
+    # Connection resets and other transport errors
+    return SERVER
+
+
+class RetryPolicy:
+    """
+        Exponential backoff with full jitter: sleep uniform(0, min(cap, base * 2^attempt)).
+        Throttling backs off twice as long, FATAL errors are not retried.
+    """
+    def __init__(self, max_attempts: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY,
+                 sleep=time.sleep, rand=random.random):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.sleep = sleep
+        self.rand = rand
+
+    def retryable(self, kind: str) -> bool:
+        return kind != FATAL
+
+    def delay(self, attempt: int, kind: str) -> float:
+        base = self.base * (2 if kind == THROTTLE else 1)
+        return self.rand() * min(self.cap, base * (2 ** attempt))
+
+    def wait(self, attempt: int, kind: str):
+        delay = self.delay(attempt, kind)
+        logger.info("retry backoff %.2fs after %s (attempt %s)", delay, kind, attempt + 1)
+        self.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+        CLOSED -> OPEN after `failures` consecutive provider failures.
+        OPEN fails fast for `reset_seconds`, then HALF_OPEN lets a single probe through:
+        success closes the circuit, failure opens it again.
+    """
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, provider: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.provider = provider
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_seconds - self.clock())
+
+    def is_open(self) -> bool:
+        """
+            True while calls would be refused, does not consume the half open probe.
+        """
+        return self.retry_in() > 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state, self.probing = self.HALF_OPEN, False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def before_call(self):
+        if not self.allow():
+            raise CircuitOpenError(self.provider, max(self.retry_in(), 1.0))
+
+    def record_success(self):
+        with self.lock:
+            self.state, self.consecutive, self.probing = self.CLOSED, 0, False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or self.consecutive >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning("circuit breaker OPEN for %s after %s failures", self.provider, self.consecutive)
+                self.state, self.opened_at, self.probing = self.OPEN, self.clock(), False
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """
+        Process wide breaker per provider, shared by every grading thread.
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
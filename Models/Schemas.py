@@ -0,0 +1,87 @@
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional
+import json
+import logging
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+# Structured output schemas, sent to the providers (Gemini response_schema, Bedrock tool input schema)
+# and used to validate their replies. Providers want an object at the top level, lists are wrapped.
+class GradeResult(BaseModel):
+    score: float = Field(description="Points awarded, between 0 and the question points")
+    feedback: str = Field(description="Short feedback for the student")
+
+
+class GradeBatchItem(GradeResult):
+    id: int = Field(description="Id of the graded response")
+
+
+class GradeBatch(BaseModel):
+    results: List[GradeBatchItem]
+
+
+class QuestionChoice(BaseModel):
+    choice_text: str
+    is_correct: bool
+
+
+class GeneratedQuestion(BaseModel):
+    question_text: str
+    question_type: str
+    points: float
+    choices: List[QuestionChoice] = []
+    answer_text: Optional[str] = None
+
+
+class QuestionSet(BaseModel):
+    questions: List[GeneratedQuestion]
+
+
+def tool_name(schema: type) -> str:
+    """
+        Bedrock tool name for a schema, the model is forced to call it with the schema as input.
+    """
+    return f"record_{schema.__name__.lower()}"
+
+
+def validate_json(schema: type, text: Optional[str]):
+    """
+        Params: schema (pydantic model class), text (str)
+
+        Returns the validated model or None
+    """
+    if text is None:
+        return None
+    try:
+        return schema.model_validate_json(text)
+    except ValidationError as e:
+        logger.error("reply does not match %s: %s", schema.__name__, e.errors()[:3])
+        return None
+
+
+def batch_rows(text: Optional[str]) -> list:
+    """
+        Rows of a batch grading reply, {"results": [...]} (structured output) or a bare array (prompt only).
+        Rows that do not match GradeBatchItem are dropped so the rest of the batch is kept.
+    """
+    try:
+        payload = json.loads(text) if text is not None else None
+    except json.JSONDecodeError as e:
+        logger.error("unable to parse batch reply: %s", e)
+        return []
+    if isinstance(payload, dict):
+        payload = payload.get("results")
+    if not isinstance(payload, list):
+        return []
+    rows = []
+    for row in payload:
+        try:
+            rows.append(GradeBatchItem.model_validate(row))
+        except ValidationError as e:
+            logger.info("dropping batch row %s: %s", row, e.errors()[:1])
+    return rows
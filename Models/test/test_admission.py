@@ -0,0 +1,78 @@
+# test_admission.py
+import threading
+import time
+import pytest
+
+from Models.Admission import AdmissionController, TokenBucket
+
+
+# ---------- Fakes / helpers ----------
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+# ---------- Tests ----------
+
+def test_bucket_refills_per_minute():
+    clock = _Clock()
+    bucket = TokenBucket(60, clock=clock)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now = 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now = 120
+    assert bucket.snapshot()["available"] == 60
+
+
+def test_bucket_oversized_request_waits_for_full_bucket():
+    clock = _Clock()
+    bucket = TokenBucket(60, clock=clock)
+    bucket.take(30)
+    assert bucket.wait_time(10_000) == pytest.approx(30.0)
+
+
+def test_unlimited_provider_never_waits():
+    controller = AdmissionController(provider_limits={}, organization_limits={})
+    ticket = controller.acquire("GOOGLE", 1, 10**9)
+    assert ticket.queued_seconds < 0.1
+    assert controller.metrics()["buckets"] == {}
+
+
+def test_settle_corrects_estimate():
+    clock = _Clock()
+    controller = AdmissionController(provider_limits={"GOOGLE": {"rpm": 0, "tpm": 1000}}, organization_limits={}, clock=clock)
+    ticket = controller.acquire("GOOGLE", 1, 400)
+    controller.settle(ticket, 100)
+    assert controller.metrics()["buckets"]["GOOGLE:tpm"]["available"] == 900
+
+
+def test_organization_bucket_queues_calls():
+    # 600 rpm per organization: one request every 0.1s once the burst is spent
+    controller = AdmissionController(provider_limits={}, organization_limits={"rpm": 600, "tpm": 0})
+    for _ in range(600):
+        controller.acquire("GOOGLE", 1, 10)
+
+    started = time.monotonic()
+    controller.acquire("GOOGLE", 1, 10)
+    assert time.monotonic() - started >= 0.05
+
+    # Another organization is not held back
+    started = time.monotonic()
+    controller.acquire("GOOGLE", 2, 10)
+    assert time.monotonic() - started < 0.05
+    assert controller.metrics()["admitted"] == 602
+
+
+def test_waiters_are_released_by_refunds():
+    clock = _Clock()
+    controller = AdmissionController(provider_limits={"AMZN": {"rpm": 0, "tpm": 60}}, organization_limits={}, clock=clock)
+    ticket = controller.acquire("AMZN", None, 60)
+    done = threading.Event()
+    threading.Thread(target=lambda: (controller.acquire("AMZN", None, 30), done.set()), daemon=True).start()
+    assert not done.wait(0.1)
+    controller.settle(ticket, 20)
+    assert done.wait(1)
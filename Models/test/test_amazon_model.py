@@ -134,4 +134,50 @@ def test_usage_fields_present(monkeypatch):
     assert m.get_generation() == "OK"
     assert m.input_token() == 2
     assert m.output_token() == 5
-    assert m.total_token() == 7
\ No newline at end of file
+    assert m.total_token() == 7
+
+
+def test_async_create(monkeypatch):
+    import asyncio
+    monkeypatch.setattr(main, "bedrock", _BedrockOK(output_text="async"))
+
+    m = asyncio.run(main.AmazonModel.acreate(prompt="p", temp=0.1, top_p=0.9, max_gen_len=8))
+    assert m.valid_response() is True
+    assert m.get_generation() == "async"
+
+
+def test_async_create_error(monkeypatch):
+    import asyncio
+    monkeypatch.setattr(main, "bedrock", _BedrockRaisesClientError())
+
+    m = asyncio.run(main.AmazonModel.acreate(prompt="p", temp=0.1, top_p=0.9, max_gen_len=8))
+    assert m.response is None
+    assert m.valid_response() is False
+
+
+class _BedrockConverseTool:
+    """Fake bedrock.converse answering with a forced tool call."""
+    def __init__(self, tool_input):
+        self.tool_input = tool_input
+        self.kwargs = None
+
+    def converse(self, **kwargs):
+        self.kwargs = kwargs
+        return {
+            "output": {"message": {"content": [{"toolUse": {"toolUseId": "t1", "name": "record_graderesult", "input": self.tool_input}}]}},
+            "usage": {"inputTokens": 3, "outputTokens": 4, "totalTokens": 7},
+        }
+
+
+def test_structured_output_forces_tool(monkeypatch):
+    from Models.Schemas import GradeResult
+    fake = _BedrockConverseTool({"score": 1.0, "feedback": "ok"})
+    monkeypatch.setattr(main, "bedrock", fake)
+
+    m = main.AmazonModel(prompt="grade", temp=0.1, top_p=0.9, max_gen_len=64, response_schema=GradeResult)
+    tool_config = fake.kwargs["toolConfig"]
+    assert tool_config["toolChoice"] == {"tool": {"name": "record_graderesult"}}
+    assert tool_config["tools"][0]["toolSpec"]["inputSchema"]["json"]["required"] == ["score", "feedback"]
+    assert "system" not in fake.kwargs
+    assert GradeResult.model_validate_json(m.get_generation()) == GradeResult(score=1.0, feedback="ok")
+    assert m.total_token() == 7
@@ -19,9 +19,15 @@ class _FakeModels:
         return types.SimpleNamespace(text=self._text)
 
 
+class _FakeAsyncModels(_FakeModels):
+    async def generate_content(self, model=None, contents=None):
+        return _FakeModels.generate_content(self, model=model, contents=contents)
+
+
 class _FakeClient:
     def __init__(self, text=None, exc=None):
         self.models = _FakeModels(text=text, exc=exc)
+        self.aio = types.SimpleNamespace(models=_FakeAsyncModels(text=text, exc=exc))
 
 
 # ---- Tests ----
@@ -75,4 +81,44 @@ def test_exception_path(monkeypatch):
     with pytest.raises(AttributeError):
         _ = m.get_text_length()
     with pytest.raises(AttributeError):
-        _ = m.total_token()
\ No newline at end of file
+        _ = m.total_token()
+
+def test_async_create(monkeypatch):
+    import asyncio
+    monkeypatch.setattr(mod, "client", _FakeClient(text="async text"))
+
+    m = asyncio.run(mod.GeminiModel.acreate(prompt="p"))
+    assert m.valid_response() is True
+    assert m.get_generation() == "async text"
+
+
+def test_timeout_cancels_call(monkeypatch):
+    import asyncio
+
+    class _SlowModels:
+        async def generate_content(self, model=None, contents=None):
+            await asyncio.sleep(10)
+
+    fake = _FakeClient(text="never")
+    fake.aio = types.SimpleNamespace(models=_SlowModels())
+    monkeypatch.setattr(mod, "client", fake)
+
+    config = mod.GenerationConfig(timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        mod.run_sync(mod.gemini_provider.agenerate("p", config))
+
+
+def test_structured_output_config(monkeypatch):
+    from Models.Schemas import GradeResult
+    seen = {}
+
+    class _SchemaModels:
+        async def generate_content(self, model=None, contents=None, config=None):
+            seen["config"] = config
+            return types.SimpleNamespace(text='{"score": 2, "feedback": "ok"}')
+
+    monkeypatch.setattr(mod, "client", types.SimpleNamespace(aio=types.SimpleNamespace(models=_SchemaModels())))
+    m = mod.GeminiModel(prompt="grade", response_schema=GradeResult)
+    assert seen["config"].response_mime_type == "application/json"
+    assert seen["config"].response_schema is GradeResult
+    assert GradeResult.model_validate_json(m.get_generation()).score == 2
@@ -0,0 +1,92 @@
+# test_json_scanner.py
+import json
+
+import Models.AmazonModel as amazon
+from Models.JsonScanner import JsonScanner
+from Models.Provider import GenerationConfig, run_sync, stream_json
+
+
+# ---------- Fakes / helpers ----------
+
+def _chunks(text, size=3):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class _FakeEventStream:
+    """Mimic botocore EventStream: iterable of {"chunk": {"bytes": ...}} events with close()."""
+    def __init__(self, texts):
+        self.events = [{"chunk": {"bytes": json.dumps({"outputText": t}).encode()}} for t in texts]
+        self.read = 0
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            self.read += 1
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class _BedrockStream:
+    def __init__(self, texts):
+        self.stream = _FakeEventStream(texts)
+
+    def invoke_model(self, **kwargs):
+        raise AssertionError("streaming path should not call invoke_model")
+
+    def invoke_model_with_response_stream(self, modelId=None, body=None):
+        return {"body": self.stream}
+
+
+# ---------- Tests ----------
+
+def test_object_split_across_chunks():
+    scanner = JsonScanner("{", required=("score", "feedback"))
+    text = 'Sure, here it is: ```json {"score": 1.5, "feedback": "use \\"full\\" sentences {ok}"} ``` and more words'
+    results = [scanner.feed(c) for c in _chunks(text)]
+    assert results[-1] == {"score": 1.5, "feedback": 'use "full" sentences {ok}'}
+    assert scanner.json_text.startswith('{"score"')
+
+
+def test_skips_objects_without_required_keys():
+    scanner = JsonScanner("{", required=("score", "feedback"))
+    assert scanner.feed('{"note": 1} then {"score": 2, "feedback": "f"}') == {"score": 2, "feedback": "f"}
+
+
+def test_incomplete_object_returns_none():
+    scanner = JsonScanner("{", required=("score",))
+    assert scanner.feed('{"score": 2, "feedback": "unterminated') is None
+    assert not scanner.done()
+
+
+def test_array_mode():
+    scanner = JsonScanner("[")
+    assert scanner.feed('[{"id": 1, "score": 1, "feedback": "a]"}, {"id": 2') is None
+    assert scanner.feed(', "score": 0, "feedback": "b"}] trailing') == [
+        {"id": 1, "score": 1, "feedback": "a]"}, {"id": 2, "score": 0, "feedback": "b"}]
+
+
+def test_stream_stops_after_first_object():
+    seen = []
+
+    async def _stream():
+        for chunk in ['{"score": 1, ', '"feedback": "x"}', " rambling", " on and on"]:
+            seen.append(chunk)
+            yield chunk
+
+    json_text, read = run_sync(stream_json(_stream(), JsonScanner("{", required=("score", "feedback"))))
+    assert json.loads(json_text) == {"score": 1, "feedback": "x"}
+    assert len(seen) == 2 and read == '{"score": 1, "feedback": "x"}'
+
+
+def test_bedrock_stream_is_closed_early(monkeypatch):
+    fake = _BedrockStream(['{"score": 3,', ' "feedback": "good"}', " extra", " extra"])
+    monkeypatch.setattr(amazon, "bedrock", fake)
+    config = GenerationConfig(temp=0.1, top_p=0.9, max_gen_len=16)
+    scanner = JsonScanner("{", required=("score", "feedback"))
+
+    json_text, _ = run_sync(stream_json(amazon.amazon_provider.astream("p", config), scanner))
+    assert json.loads(json_text)["score"] == 3
+    assert fake.stream.closed is True
+    assert fake.stream.read == 2
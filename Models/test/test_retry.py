@@ -0,0 +1,99 @@
+# test_retry.py
+import asyncio
+import pytest
+from botocore.exceptions import ClientError
+from google.genai import errors as genai_errors
+
+import Models.Retry as retry
+
+
+# ---------- Fakes / helpers ----------
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+
+def _client_error(code, status=400):
+    return ClientError(
+        error_response={"Error": {"Code": code, "Message": "x"}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation_name="InvokeModel",
+    )
+
+
+# ---------- Tests ----------
+
+@pytest.mark.parametrize("error,kind", [
+    (_client_error("ThrottlingException", 429), retry.THROTTLE),
+    (_client_error("ServiceUnavailableException", 503), retry.SERVER),
+    (_client_error("ValidationException", 400), retry.FATAL),
+    (genai_errors.APIError(429, {}), retry.THROTTLE),
+    (genai_errors.APIError(500, {}), retry.SERVER),
+    (genai_errors.APIError(403, {}), retry.FATAL),
+    (asyncio.TimeoutError(), retry.TIMEOUT),
+    (ConnectionResetError(), retry.SERVER),
+    (None, retry.SERVER),
+])
+def test_classify(error, kind):
+    assert retry.classify(error) == kind
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = retry.RetryPolicy(max_attempts=5, base=1, cap=4, rand=lambda: 1.0)
+    assert [policy.delay(a, retry.SERVER) for a in range(4)] == [1, 2, 4, 4]
+    assert policy.delay(0, retry.THROTTLE) == 2
+    assert retry.RetryPolicy(max_attempts=1, base=1, rand=lambda: 0.25).delay(2, retry.SERVER) == 1
+    assert policy.retryable(retry.PARSE) and not policy.retryable(retry.FATAL)
+
+
+def test_breaker_opens_and_recovers():
+    clock = _Clock()
+    breaker = retry.CircuitBreaker("GOOGLE", failures=2, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open() and not breaker.allow()
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.before_call()
+
+    clock.now = 10
+    assert not breaker.is_open()
+    assert breaker.allow()          # single half open probe
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot()["state"] == retry.CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens():
+    clock = _Clock()
+    breaker = retry.CircuitBreaker("AMZN", failures=1, reset_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 5
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open() and breaker.retry_in() == 5
+
+
+def test_generator_stops_on_open_circuit(monkeypatch):
+    import Actions.GraderGenerator as gen
+    from Prompt.Prompt import Prompt
+
+    breaker = retry.CircuitBreaker("GOOGLE", failures=2, reset_seconds=60)
+    monkeypatch.setattr(gen, "get_breaker", lambda provider: breaker)
+    sleeps = []
+    monkeypatch.setattr(retry.RetryPolicy, "wait", lambda self, attempt, kind: sleeps.append(kind))
+    calls = []
+
+    def _call_model(self, prompt):
+        calls.append(prompt)
+        self.last_error = _client_error("ThrottlingException", 429)
+        return None
+
+    monkeypatch.setattr(gen.GraderGenerator, "call_model", _call_model)
+    prompt = Prompt({"title": "t"}, {"question_id": 1, "question_text": "q", "points": 1}, "a")
+    with pytest.raises(retry.CircuitOpenError):
+        gen.GraderGenerator("GOOGLE", prompt).run_grade_model()
+    assert len(calls) == 2
+    assert sleeps == [retry.THROTTLE, retry.THROTTLE]
@@ -45,4 +45,32 @@ def get_examples_prompt():
             Try to focus on using complete sentences, correct verb tense, and subject - verb agreement.
             For example, instead of writing “He go buy on TikTok because easy,” you could write:
             “He buys things on TikTok because it is easy."}
-    """
\ No newline at end of file
+    """
+
+def get_batch_instructions_prompt():
+    return """
+    ## Instructions
+    Generate a response for every student response given below, each one is tagged with an id.
+    The appropriate response is a JSON array with exactly one object per id, in any order.
+    A appropriate structure will be [{"id": int, "score": float, "feedback": str }, ...]
+    """
+
+def set_batch_question_context(question, answer, points, responses):
+    block = f"""
+        Question: {question},
+        Question_answer: {answer},
+        Max_points: {points},
+        Student_responses:
+    """
+    for id, student_response in responses:
+        block += f"""
+            - id: {id}, Student_response: {student_response}
+        """
+    return block
+
+def get_batch_examples_prompt():
+    return """
+    ## Example response:
+    json: [{ "id": 41, "score": 0.9, "feedback": "You understood the question well, try to use complete sentences." },
+           { "id": 42, "score": 0.2, "feedback": "Your answer is off topic, re-read the question and the lesson notes." }]
+    """
@@ -1,35 +1,111 @@
 from Prompt.Identity import get_context, get_identity_prompt, get_rules, get_instructions_prompt, get_examples_prompt, set_question_context
+from Prompt.Identity import get_batch_instructions_prompt, set_batch_question_context, get_batch_examples_prompt
+from functools import lru_cache
 from typing import Optional
 
 
+def estimate_tokens(text: str) -> int:
+    compressed = "".join(text.split())
+    return (len(compressed) + 2) // 3
+
+
+# Prompts are assembled as prefix + suffix.
+# prefix: static identity/instructions/rules/examples + the assessment context, identical for every answer of a session.
+# suffix: the question and student response.
+# Prefixes are built once per process and can be registered with the provider context cache (Prompt/PromptCache.py).
+@lru_cache(maxsize=2)
+def get_static_prefix(batch: bool = False) -> str:
+    if batch:
+        return get_identity_prompt() + get_batch_instructions_prompt() + get_rules() + get_batch_examples_prompt()
+    return get_identity_prompt() + get_instructions_prompt() + get_rules() + get_examples_prompt()
+
+
+@lru_cache(maxsize=1024)
+def get_assessment_prefix(title, description, subject, max_points, batch: bool = False) -> tuple:
+    """
+        Returns Tuple
+        (prefix (str), estimated tokens (int))
+    """
+    prefix = get_static_prefix(batch) + get_context(title, description, subject, max_points)
+    return (prefix, estimate_tokens(prefix))
+
+
+def assessment_prefix(assessment_build: Optional[dict], batch: bool = False) -> tuple:
+    return get_assessment_prefix(assessment_build.get("title"), assessment_build.get("description"),
+                                 assessment_build.get("subject_title"), assessment_build.get("max_score"), batch)
+
+
 class Prompt:
-    def __init__(self, assessment_build: Optional[dict], questions: Optional[dict], student_response: Optional[str]): 
+    def __init__(self, assessment_build: Optional[dict], questions: Optional[dict], student_response: Optional[str]):
         self.assessment_build: Optional[dict] = assessment_build
         self.questions = questions
         self.prompt = None
         self.student_response = student_response
+        self.prefix, self.prefix_tokens = assessment_prefix(assessment_build)
+        self.suffix = set_question_context(self.questions.get("question_text"), self.questions.get("answer_text"), self.questions.get("points"), self.student_response)
         self.prompt = self.build_prompt()
-            
+
 
     def build_prompt(self)-> str:
-        return (
-            get_identity_prompt()
-            + get_instructions_prompt()
-            + get_context(self.assessment_build.get("title"), self.assessment_build.get("description"), self.assessment_build.get("subject_title"), self.assessment_build.get("max_score"))
-            + get_rules()
-            + set_question_context(self.questions.get("question_text"), self.questions.get("answer_text"), self.questions.get("points"), self.student_response)
-            + get_examples_prompt()
-        )
+        return self.prefix + self.suffix
 
     def get_prompt(self) ->str:
         return self.prompt
 
+    def get_prefix(self) -> str:
+        return self.prefix
+
+    def get_suffix(self) -> str:
+        return self.suffix
+
     def get_token_length(self) ->int:
-        compressed = "".join(self.prompt.split())
-        return (len(compressed) + 2) // 3
+        return self.get_input_length()
 
     def get_input_length(self) ->int:
-        compressed = "".join(self.prompt.split())
-        return (len(compressed) + 2) // 3
-    
-    
\ No newline at end of file
+        return self.prefix_tokens + estimate_tokens(self.suffix)
+
+
+class BatchPrompt:
+    """
+        Pack several student responses of one assessment into a single prompt.
+        entries: list of (id, question, student_response), responses to the same question share one question block.
+    """
+    def __init__(self, assessment_build: Optional[dict], entries: Optional[list]):
+        self.assessment_build: Optional[dict] = assessment_build
+        self.entries = entries
+        self.prefix, self.prefix_tokens = assessment_prefix(assessment_build, batch=True)
+        self.suffix = self.build_suffix()
+        self.prompt = self.build_prompt()
+
+    def build_suffix(self) -> str:
+        blocks = {}
+        for id, question, student_response in self.entries:
+            key = question.get("question_id")
+            if key not in blocks:
+                blocks[key] = (question, [])
+            blocks[key][1].append((id, student_response))
+        return "".join(set_batch_question_context(q.get("question_text"), q.get("answer_text"), q.get("points"), responses) for q, responses in blocks.values())
+
+    def build_prompt(self) -> str:
+        return self.prefix + self.suffix
+
+    def subset(self, ids) -> "BatchPrompt":
+        """
+            Build a new prompt with only the given ids, used to re-request missing responses.
+        """
+        return BatchPrompt(self.assessment_build, [e for e in self.entries if e[0] in ids])
+
+    def get_ids(self) -> list:
+        return [e[0] for e in self.entries]
+
+    def get_prompt(self) -> str:
+        return self.prompt
+
+    def get_prefix(self) -> str:
+        return self.prefix
+
+    def get_suffix(self) -> str:
+        return self.suffix
+
+    def get_input_length(self) -> int:
+        return self.prefix_tokens + estimate_tokens(self.suffix)
@@ -0,0 +1,119 @@
+from Models.GeminModel import create_cached_content, count_tokens
+from typing import Optional
+import hashlib
+import threading
+import time
+import logging
+import os
+# --- Python logger ---
+logging.basicConfig(
+    level=logging.INFO, # Adjust to logging.DEBUG for more verbose logs
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "0") == "1"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", 3600))
+# Providers refuse to cache short prefixes, 1024 tokens is the explicit cache minimum of gemini-2.5-flash.
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 1024))
+
+
+class ContextCache:
+    """
+        Registers prompt prefixes with a provider context cache and remembers the handles.
+        provider: object with create_cache(prefix (str), ttl_seconds (int)) -> handle (str),
+        optionally count_tokens(prefix (str)) -> int.
+        Failed or too short prefixes are remembered as uncacheable until the ttl runs out.
+        The prefix size is estimated locally, prefixes within a factor of 2 of min_tokens are counted
+        once by the provider so the gate does not hinge on the estimate.
+    """
+    def __init__(self, provider, ttl: int = PROMPT_CACHE_TTL, min_tokens: int = PROMPT_CACHE_MIN_TOKENS):
+        self.provider = provider
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.handles = {}
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "registered": 0, "skipped": 0, "failed": 0, "counted": 0}
+
+    def measure(self, key: str, prefix: str, prefix_tokens: int) -> int:
+        """
+            Provider token count of prefix, remembered per key. The estimate when it is far below
+            min_tokens, the provider cannot count or the count fails.
+        """
+        count = getattr(self.provider, "count_tokens", None)
+        if count is None or prefix_tokens < self.min_tokens // 2:
+            return prefix_tokens
+        with self.lock:
+            if key in self.tokens:
+                return self.tokens[key]
+        try:
+            tokens = int(count(prefix))
+        except Exception as e:
+            logger.error("unable to count prompt prefix tokens: %s", e)
+            return prefix_tokens
+        with self.lock:
+            self.tokens[key] = tokens
+            self.counters["counted"] += 1
+        return tokens
+
+    def handle_for(self, prefix: str, prefix_tokens: int) -> Optional[str]:
+        """
+            Params: prefix (str), prefix_tokens (int)
+
+            Returns the provider handle for prefix, None when the full prompt must be sent.
+        """
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        if self.measure(key, prefix, prefix_tokens) < self.min_tokens:
+            with self.lock:
+                self.counters["skipped"] += 1
+            return None
+        now = time.monotonic()
+        with self.lock:
+            cached = self.handles.get(key)
+            if cached is not None and cached[1] > now:
+                self.counters["hits"] += 1
+                return cached[0]
+        try:
+            handle = self.provider.create_cache(prefix, self.ttl)
+            with self.lock:
+                self.counters["registered"] += 1
+        except Exception as e:
+            logger.error("unable to register prompt prefix with provider cache: %s", e)
+            handle = None
+            with self.lock:
+                self.counters["failed"] += 1
+        with self.lock:
+            # Renew a little before the provider expires the entry
+            self.handles[key] = (handle, now + self.ttl * 0.9)
+        return handle
+
+    def metrics(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+            counters["size"] = len(self.handles)
+        return counters
+
+
+class GeminiContextProvider:
+    def create_cache(self, prefix: str, ttl_seconds: int) -> str:
+        return create_cached_content(prefix, ttl_seconds)
+
+    def count_tokens(self, prefix: str) -> int:
+        return count_tokens(prefix)
+
+
+_context_caches = {}
+_context_caches_lock = threading.Lock()
+
+
+def get_context_cache(model_type: str) -> Optional[ContextCache]:
+    """
+        Process wide ContextCache per provider, None when provider caching is off or handle based caching
+        does not apply (Bedrock caches implicitly through cachePoint blocks).
+    """
+    if not PROMPT_CACHE or model_type != "GOOGLE":
+        return None
+    with _context_caches_lock:
+        if model_type not in _context_caches:
+            _context_caches[model_type] = ContextCache(GeminiContextProvider())
+        return _context_caches[model_type]
@@ -0,0 +1,139 @@
+# test_prompt_cache.py
+import types
+
+import Models.GeminModel as gemini
+import Actions.GraderGenerator as gen
+import Prompt.PromptCache as cache_mod
+from Prompt.Prompt import Prompt, BatchPrompt
+
+
+# ---------- Fakes / helpers ----------
+
+_ASSESSMENT = {"title": "Plants", "description": "Unit 3", "subject_title": "Biology", "max_score": 10}
+_QUESTION = {"question_id": 1, "question_text": "What is photosynthesis?", "answer_text": None, "points": 2}
+
+
+class _LocalProvider:
+    """Stand-in provider context cache."""
+    def __init__(self, fail=False):
+        self.created = []
+        self.fail = fail
+
+    def create_cache(self, prefix, ttl_seconds):
+        if self.fail:
+            raise RuntimeError("too short")
+        self.created.append(prefix)
+        return f"cachedContents/{len(self.created)}"
+
+
+class _CountingProvider(_LocalProvider):
+    """Provider that counts more tokens than the local estimate."""
+    def __init__(self, tokens):
+        super().__init__()
+        self.tokens = tokens
+        self.counted = []
+
+    def count_tokens(self, prefix):
+        self.counted.append(prefix)
+        return self.tokens
+
+
+class _FakeModels:
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model=None, contents=None, config=None):
+        self.calls.append((contents, config))
+        return types.SimpleNamespace(text='{"score": 1, "feedback": "ok"}')
+
+
+class _FakeAsyncModels:
+    def __init__(self, models):
+        self.sync = models
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        return self.sync.generate_content(model=model, contents=contents, config=config)
+
+
+class _FakeCaches:
+    def __init__(self):
+        self.created = []
+
+    def create(self, model=None, config=None):
+        self.created.append(config)
+        return types.SimpleNamespace(name="cachedContents/abc")
+
+
+class _FakeClient:
+    def __init__(self):
+        self.models = _FakeModels()
+        self.caches = _FakeCaches()
+        self.aio = types.SimpleNamespace(models=_FakeAsyncModels(self.models))
+
+
+# ---------- Tests ----------
+
+def test_prefix_is_shared_across_items():
+    a = Prompt(_ASSESSMENT, _QUESTION, "light to sugar")
+    b = Prompt(_ASSESSMENT, dict(_QUESTION, question_id=2), "no idea")
+    assert a.get_prefix() is b.get_prefix()
+    assert a.get_prompt() == a.get_prefix() + a.get_suffix()
+    assert "Student_response: light to sugar" in a.get_suffix()
+    assert "Biology" in a.get_prefix() and "light to sugar" not in a.get_prefix()
+    assert BatchPrompt(_ASSESSMENT, [(1, _QUESTION, "x")]).get_prefix() != a.get_prefix()
+
+
+def test_context_cache_registers_once():
+    provider = _LocalProvider()
+    cache = cache_mod.ContextCache(provider, ttl=60, min_tokens=0)
+    prompt = Prompt(_ASSESSMENT, _QUESTION, "x")
+    first = cache.handle_for(prompt.get_prefix(), prompt.prefix_tokens)
+    second = cache.handle_for(prompt.get_prefix(), prompt.prefix_tokens)
+    assert first == second == "cachedContents/1"
+    assert len(provider.created) == 1
+    assert cache.metrics()["hits"] == 1
+
+
+def test_context_cache_skips_short_and_failed_prefixes():
+    provider = _LocalProvider()
+    assert cache_mod.ContextCache(provider, min_tokens=10**6).handle_for("short", 2) is None
+    assert provider.created == []
+
+    failing = cache_mod.ContextCache(_LocalProvider(fail=True), min_tokens=0)
+    assert failing.handle_for("prefix", 5000) is None
+    assert failing.handle_for("prefix", 5000) is None
+    assert failing.metrics()["failed"] == 1
+
+
+def test_context_cache_gates_on_the_provider_count():
+    provider = _CountingProvider(tokens=1500)
+    cache = cache_mod.ContextCache(provider, min_tokens=1024)
+    # Estimated below the minimum, counted above it by the provider
+    assert cache.handle_for("prefix", 600) == "cachedContents/1"
+    assert cache.handle_for("prefix", 600) == "cachedContents/1"
+    assert provider.counted == ["prefix"]
+    # Far below the minimum, no count round trip
+    assert cache.handle_for("short", 100) is None
+    assert provider.counted == ["prefix"]
+
+    small = _CountingProvider(tokens=400)
+    assert cache_mod.ContextCache(small, min_tokens=1024).handle_for("prefix", 600) is None
+    assert small.created == []
+
+
+def test_gemini_call_sends_only_suffix(monkeypatch):
+    fake = _FakeClient()
+    monkeypatch.setattr(gemini, "client", fake)
+    monkeypatch.setattr(cache_mod, "PROMPT_CACHE", True)
+    monkeypatch.setattr(cache_mod, "PROMPT_CACHE_MIN_TOKENS", 0)
+    monkeypatch.setattr(cache_mod, "_context_caches", {"GOOGLE": cache_mod.ContextCache(cache_mod.GeminiContextProvider(), min_tokens=0)})
+
+    for answer in ["a", "b"]:
+        prompt = Prompt(_ASSESSMENT, _QUESTION, answer)
+        res = gen.GraderGenerator("GOOGLE", prompt).run_grade_model()
+        assert res["response"] == {"score": 1, "feedback": "ok"}
+
+    assert len(fake.caches.created) == 1
+    contents, config = fake.models.calls[1]
+    assert contents == Prompt(_ASSESSMENT, _QUESTION, "b").get_suffix()
+    assert config.cached_content == "cachedContents/abc"
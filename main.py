@@ -1,10 +1,23 @@
 import os
-from Config.RabbitMQ import RabbitMQ
+import json
+import time
+import signal
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import pika
+from Config.RabbitMQ import RabbitMQ, ThreadsafeChannel
+from Config.Scheduler import lane_for, scheduler
 from Config.PostgresClient import PostgresClient
 from Config.Client import Client
 from dotenv import load_dotenv
 from Actions.Grader import Grader
 from Actions.State import State
+from Actions.AssessmentCache import get_assessment_cache
+from Actions.GradeCache import get_grade_cache
+from Models.Admission import admission
+from Models.Retry import CircuitOpenError, get_breaker
 import logging
 
 load_dotenv()
@@ -18,13 +31,87 @@ EXCHANGE     = os.getenv("EXCHANGE")
 QUEUE        = os.getenv("QUEUE")
 ROUTING_KEY  = os.getenv("ROUTING_KEY")
 RABBIT_LOCAL  = os.getenv("RABBIT_LOCAL")
-PREFETCH_COUNT = 1
+# Sessions graded concurrently per consumer, 0 runs on_message on the pika I/O thread, one session at a time.
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 1))
+# Unacked deliveries per consumer, the ones beyond WORKER_POOL_SIZE are what the FairScheduler reorders.
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", 4 * max(WORKER_POOL_SIZE, 1)))
 EXCHANGE_TYPE = "direct"
 DONE = 'DONE'
 ZERO = 0
 ERROR = 'ERROR'
 MODEL = "GOOGLE"
+# Deliveries of a session before it is parked, counted by the broker (x-death of the retry queues).
 MAX_ATTEMPTS = 6
+# How often query, cache and admission metrics are logged as JSON, 0 disables.
+METRICS_LOG_SECONDS = float(os.getenv("METRICS_LOG_SECONDS", 60))
+_metrics_logged_at = time.monotonic()
+# Reconnect back-off after a lost RabbitMQ connection, doubling from 1s up to this cap.
+RECONNECT_MAX_SECONDS = float(os.getenv("RABBITMQ_RECONNECT_MAX_SECONDS", 30))
+# Seconds a stopping consumer gives the sessions in flight (ECS stopTimeout defaults to 30s).
+DRAIN_SECONDS = float(os.getenv("CONSUMER_DRAIN_SECONDS", 25))
+# Forked consumer processes run by supervise(), each with its own RabbitMQ connection and DB pool.
+CONSUMER_PROCESSES = int(os.getenv("CONSUMER_PROCESSES", 1))
+_stop = threading.Event()
+_consumer = {"mq": None}
+_session_locks = {}
+_session_locks_lock = threading.Lock()
+
+
+@contextmanager
+def session_lock(body: bytes):
+    """
+        One delivery of a session at a time in this process. A session redelivered after a reconnect waits
+        for the copy still grading, then finds its items checkpointed and only rolls up and acks.
+    """
+    with _session_locks_lock:
+        entry = _session_locks.setdefault(body, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _session_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _session_locks[body]
+
+
+def log_metrics(db):
+    """
+        Export point for the worker metrics: one JSON line per METRICS_LOG_SECONDS.
+    """
+    global _metrics_logged_at
+    if METRICS_LOG_SECONDS <= 0 or time.monotonic() - _metrics_logged_at < METRICS_LOG_SECONDS:
+        return
+    _metrics_logged_at = time.monotonic()
+    metrics = {
+        "postgres": db.get_metrics(),
+        "assessment_cache": get_assessment_cache(db).metrics(),
+        "grade_cache": get_grade_cache(db).metrics(),
+        "admission": admission.metrics(),
+        "scheduler": scheduler.metrics(),
+    }
+    logger.info("metrics %s", json.dumps(metrics, default=str))
+
+
+def defer(channel, method, properties, body, retry_in):
+    """
+        Provider circuit is open: hand the session to the defer queue without spending an attempt on it,
+        the broker delivers it again after DEFER_SECONDS and no worker waits meanwhile.
+    """
+    logger.info("Defer: circuit closes in %.1fs", retry_in)
+    channel.defer(method, properties, body)
+
+def finalize(channel, method, properties, body, state_manager, task_id):
+    """
+        Score roll-up from the checkpointed items, ack once the task completed, retry later while items are pending.
+    """
+    finalized = state_manager.finalize_grader_task(task_id)
+    logger.info("Finalize: task %s %s", task_id, finalized)
+    if finalized is None or finalized['pending'] > ZERO:
+        channel.retry(method, properties, body, MAX_ATTEMPTS)
+        return
+    channel.basic_ack(delivery_tag=method.delivery_tag)
 
 def create_callback(db):
     def on_message(channel, method, properties, body):
@@ -33,45 +120,56 @@ def create_callback(db):
             try: 
                 client = Client(body)
                 grade_paper, state_manager = Grader(db, client), State(db, client)
-                ## idempotent insert, increments if found.
-                insert_assessment_task_res = state_manager.upsert_assessment_task()
-                if insert_assessment_task_res is None:
-                    delete_assessment_task, delete_assessment_sessions = state_manager.delete_session_grader_task(), state_manager.delete_assessment_sessions()
+                breaker = get_breaker(MODEL)
+                if breaker.is_open():
+                    logger.info("Defer: %s circuit open, session %s", MODEL, client.get_session_token())
+                    defer(channel, method, properties, body, breaker.retry_in())
+                    return
+                ## idempotent task upsert (increments attempts), item seeding and reads in one round trip.
+                assessment_cache = get_assessment_cache(db)
+                context = state_manager.load_grading_context(assessment_cache.cached_ids())
+                ## None: no session to grade. A failed query raises RuntimeError and the delivery is retried below.
+                if context is None:
+                    delete_assessment_task, delete_assessment_sessions = state_manager.delete_session_grader_task(client.get_session_token()), state_manager.delete_assessment_sessions(client.get_session_token())
                     logger.info("Remove: delete_assessment_task: %s, delete_assessment_sessions %s", delete_assessment_task, delete_assessment_sessions)
                     channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)    
                     return 
-                if insert_assessment_task_res['attempts'] >= MAX_ATTEMPTS:
-                    delete_assessment_task, delete_assessment_sessions = state_manager.delete_session_grader_task(), state_manager.delete_assessment_sessions()
-                    logger.info("Remove: delete_assessment_task: %s, delete_assessment_sessions %s", delete_assessment_task, delete_assessment_sessions)
-                    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                ## attempts only counts deliveries, channel.retry parks the session after MAX_ATTEMPTS failures.
+                insert_assessment_task_res = context['task']
+                if len(context['items']) == ZERO and context['completed'] > ZERO:
+                    ## every item was checkpointed by an earlier delivery, only the roll-up is left.
+                    finalize(channel, method, properties, body, state_manager, int(insert_assessment_task_res['id']))
                     return
-
-                item_tasks = state_manager.get_item_tasks(insert_assessment_task_res['id'])
-                ## If no session items, try to set the values
-                if len(item_tasks) == ZERO:
-                    session_answers = state_manager.get_sessions_answers()
-                    assessment_students, state_items = state_manager.upsert_assessment_students(session_answers, client.get_session_id()), state_manager.upsert_assessment_items(session_answers, insert_assessment_task_res['id'])
-                    logger.info("Idempotent insert on get_session_answers %s, upsert_assessment_students: %s, upsert_assessment_items", session_answers, assessment_students, state_items)
-
-                # This can be dangerous ? to insert then call suddently (early)
-                item_tasks = state_manager.get_item_tasks(insert_assessment_task_res['id'])
-                if item_tasks is None or len(item_tasks) == 0:
+                if len(context['items']) == ZERO:
                     delete_assessment_sessions = state_manager.delete_assessment_sessions(client.get_session_token())
                     logger.info("Remove: delete_assessment_sssions: %s", delete_assessment_sessions)
                     channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
                     return
                 
-                task_ids, task_map = [i['item_key'] for i in item_tasks], {i['item_key']: i for i in item_tasks}
-                student_session_answers, assessment_students = state_manager.get_session_answers_by_item_key(task_ids), state_manager.get_assessment_students(client.get_session_id())
-                assessment_ids = [ int(value['assessment_id']) for _, value in assessment_students.items()]
-
-                assessments, assessment_questions = state_manager.get_assessments(assessment_ids), state_manager.get_assessment_questions(assessment_ids)
-                assessment_build = grade_paper.build_assessment_(assessments, assessment_questions)
+                task_map, assessment_students = context['task_map'], context['students']
+                assessment_build = assessment_cache.resolve(context['assessment_ids'], context['assessments'], context['questions'],
+                                                            grade_paper.build_assessment_, state_manager.load_assessments)
                 if assessment_build is None:
                     logger.info("Retry: assessment build, graded, will try again.")
-                    channel.basic_ack(delivery_tag=method.delivery_tag, requeue=True)
+                    channel.retry(method, properties, body, MAX_ATTEMPTS)
+                    return
+                checkpoint = lambda graded: state_manager.checkpoint_grader_results(graded, task_map, assessment_students)
+                ## answers are paged by item key and graded one page at a time, each page is checkpointed as it is graded.
+                session_items_graded, model_insert = [], []
+                try:
+                    for student_session_answers in state_manager.iter_session_answers(list(task_map)):
+                        graded = grade_paper.grade_(assessment_build, student_session_answers, checkpoint)
+                        page_graded, page_usage = graded if graded else (None, [])
+                        model_insert.extend(page_usage)
+                        if page_graded is None:
+                            session_items_graded = None
+                            break
+                        session_items_graded.extend(page_graded)
+                except CircuitOpenError as e:
+                    logger.info("Defer: %s, session %s", e, client.get_session_token())
+                    state_manager.release_assessment_task_attempt(insert_assessment_task_res['id'])
+                    defer(channel, method, properties, body, e.retry_in)
                     return
-                session_items_graded, model_insert = grade_paper.grade_(assessment_build, student_session_answers)
                 if len(model_insert) >= 1:
                     logger.info("LLM usage: %s", model_insert)
                     update_llm_usage = state_manager.update_llm_usage(model_insert)
@@ -79,42 +177,212 @@ def create_callback(db):
 
                 if session_items_graded is None:
                     logger.info("Retry: no items, graded, will try again.")
-                    channel.basic_ack(delivery_tag=method.delivery_tag, requeue=True)
-                    return
-                session_items_graded_details, commit_changes = grade_paper.graded_details(session_items_graded), None
-                commit_changes = state_manager.upsert_grader_results(session_items_graded, int(insert_assessment_task_res['id']), task_map, assessment_students, session_items_graded_details)
-                if commit_changes is None:
-                    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                    channel.retry(method, properties, body, MAX_ATTEMPTS)
                     return
-                logger.info("removing from queue %s", client.get_session_token())
-                channel.basic_ack(delivery_tag=method.delivery_tag)
+                ## graded items are already checkpointed, roll the scores up and complete the task.
+                finalize(channel, method, properties, body, state_manager, int(insert_assessment_task_res['id']))
                 return
             except RuntimeError as e:
-                # Requeue
-                logger.error("unable to grade assessment with session_token %s", client.get_session_token())
-                return 
+                logger.error("unable to grade assessment with session_token %s: %s", client.get_session_token(), e)
+                channel.retry(method, properties, body, MAX_ATTEMPTS)
+                return
         except KeyboardInterrupt as e:
             logger.error("Error found", e)
             return
+        finally:
+            log_metrics(db)
     return on_message
 
 
+def create_dispatcher(callback, mq: RabbitMQ, executor: Optional[ThreadPoolExecutor], in_flight: set):
+    """
+        pika on_message_callback: on_message gets a ThreadsafeChannel and runs on the worker pool,
+        the I/O thread goes straight back to heartbeats and the next delivery (up to PREFETCH_COUNT in flight).
+        Deliveries wait in the FairScheduler, every worker task runs whichever session is next in fair order.
+        Without a pool on_message runs inline, as before.
+    """
+    def run():
+        delivery = scheduler.get(timeout=0)
+        if delivery is None:
+            # Taken back by a stopping consumer
+            return
+        threadsafe, method, properties, body = delivery
+        if not threadsafe.channel.is_open:
+            # Lost with its channel, the broker delivers it again
+            return
+        try:
+            with session_lock(body):
+                callback(threadsafe, method, properties, body)
+        except Exception as e:
+            logger.error("on_message failed for delivery_tag=%s: %r", method.delivery_tag, e)
+            threadsafe.retry(method, properties, body, MAX_ATTEMPTS)
+
+    def on_delivery(channel, method, properties, body):
+        threadsafe = ThreadsafeChannel(channel, mq.get_connection(), mq.exchange, mq.queue)
+        if executor is None:
+            callback(threadsafe, method, properties, body)
+            return
+        lane = lane_for(getattr(properties, "priority", None))
+        scheduler.put(Client(body).get_orgainzation_id(), (threadsafe, method, properties, body), lane)
+        future = executor.submit(run)
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+    return on_delivery
+
+
+def drain(connection, in_flight: set, deadline: float):
+    """
+        Keep the I/O loop running until the sessions in flight finished and their acks went out, or the deadline passed.
+        Sessions still grading then are redelivered once the connection closes, their checkpointed items are kept.
+    """
+    while in_flight and connection.is_open and time.monotonic() < deadline:
+        connection.process_data_events(time_limit=min(1, max(deadline - time.monotonic(), 0)))
+    if connection.is_open:
+        connection.process_data_events(time_limit=0)
+    if in_flight:
+        logger.info("Drain: %s sessions still in flight after the deadline", len(in_flight))
+
+
+def stop_and_drain(mq, in_flight: set):
+    """
+        Stop taking deliveries, release the ones not started yet and wait up to DRAIN_SECONDS for the rest.
+    """
+    if mq is None or not mq.get_connection().is_open:
+        return
+    mq.get_channel().stop_consuming()
+    for future in list(in_flight):
+        future.cancel()
+    # Not started yet, hand them to another consumer right away
+    for threadsafe, method, _, _ in scheduler.drain():
+        threadsafe.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    drain(mq.get_connection(), in_flight, time.monotonic() + DRAIN_SECONDS)
+
+
+def request_stop(signum=None, frame=None):
+    """
+        SIGTERM handler: start_consuming returns on the I/O thread, the consumer then drains and exits.
+    """
+    logger.info("Stop requested (signal %s)", signum)
+    _stop.set()
+    mq = _consumer["mq"]
+    if mq is None:
+        return
+    try:
+        mq.get_connection().add_callback_threadsafe(mq.get_channel().stop_consuming)
+    except pika.exceptions.AMQPError as e:
+        logger.info("connection already closed: %s", e)
+
+
+def consume(callback, executor: Optional[ThreadPoolExecutor], in_flight: set):
+    """
+        Consume until stopped, reconnecting with back-off whenever the connection or channel is lost.
+        Deliveries of a lost channel are redelivered by the broker, the acks of their workers are dropped
+        with the old ThreadsafeChannel so a stale delivery tag never reaches the new channel.
+    """
+    delay = 1
+    while not _stop.is_set():
+        mq = None
+        try:
+            mq = RabbitMQ(PREFETCH_COUNT, EXCHANGE, QUEUE, ROUTING_KEY, EXCHANGE_TYPE)
+            _consumer["mq"] = mq
+            mq.set_callback(create_dispatcher(callback, mq, executor, in_flight))
+            delay = 1
+            print(f"RabbitMQ consuming on {QUEUE} with routing key {ROUTING_KEY}, prefetch {PREFETCH_COUNT}, workers {WORKER_POOL_SIZE}")
+            if not _stop.is_set():
+                mq.get_channel().start_consuming()
+            stop_and_drain(mq, in_flight)
+            return
+        except KeyboardInterrupt as e:
+            print(e)
+            stop_and_drain(mq, in_flight)
+            return
+        except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError) as e:
+            logger.error("RabbitMQ connection lost (%s sessions in flight): %r, reconnecting in %ss", len(in_flight), e, delay)
+            _stop.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+        finally:
+            _consumer["mq"] = None
+            if mq is not None:
+                mq.close()
+
+
 def main():##
-    mq = RabbitMQ(PREFETCH_COUNT, EXCHANGE, QUEUE, ROUTING_KEY, EXCHANGE_TYPE)
+    signal.signal(signal.SIGTERM, request_stop)
     db = PostgresClient()
     callback = create_callback(db)
-    mq.set_callback(callback)
-    channel = mq.get_channel()
-    connection = mq.get_connection()
+    executor = ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix="consumer") if WORKER_POOL_SIZE > 0 else None
+    in_flight = set()
     try:
-        print(f"RabbitMQ consuming on {QUEUE} with routing key {ROUTING_KEY}")
-        channel.start_consuming()
-    except KeyboardInterrupt as e:
-        print(e)
+        consume(callback, executor, in_flight)
     finally:
-        channel.close()
-        connection.close()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
         db.close()
 
+def supervise(processes: int = CONSUMER_PROCESSES):
+    """
+        Fork processes consumers running main() and restart the ones that exit, with back-off when they crash at start.
+        SIGTERM / SIGINT are forwarded to the consumers, which drain within DRAIN_SECONDS; stragglers are killed after that.
+    """
+    children = {}
+    restart_delay = {}
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                main()
+            except Exception:
+                logger.exception("consumer %s crashed", slot)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (slot, time.monotonic())
+        logger.info("consumer %s started, pid %s", slot, pid)
+
+    def stop(signum, frame):
+        logger.info("Supervisor stopping (signal %s), draining %s consumers", signum, len(children))
+        _stop.set()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(processes):
+        spawn(slot)
+    deadline = None
+    while children:
+        if _stop.is_set() and deadline is None:
+            deadline = time.monotonic() + DRAIN_SECONDS + 5
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in list(children):
+                logger.error("consumer pid %s did not drain in time, killing", pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            deadline = float("inf")
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            _stop.wait(0.5)
+            continue
+        slot, started = children.pop(pid)
+        if _stop.is_set():
+            logger.info("consumer %s exited (status %s)", slot, status)
+            continue
+        # A consumer dying right after start (broker or database down) backs off up to RECONNECT_MAX_SECONDS
+        uptime = time.monotonic() - started
+        restart_delay[slot] = 1 if uptime > RECONNECT_MAX_SECONDS else min(restart_delay.get(slot, 0.5) * 2, RECONNECT_MAX_SECONDS)
+        logger.error("consumer %s (pid %s) exited with status %s after %.0fs, restarting in %ss", slot, pid, status, uptime, restart_delay[slot])
+        _stop.wait(restart_delay[slot])
+        if not _stop.is_set():
+            spawn(slot)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    supervise() if CONSUMER_PROCESSES > 1 else main()
\ No newline at end of file
@@ -0,0 +1,169 @@
+# test_main.py
+import json
+import logging
+import threading
+import types
+
+import main
+
+
+# ---------- Fakes / helpers ----------
+
+class _FakeDB:
+    def get_metrics(self):
+        return {"queries": {"load_grading_context": {"count": 1}}}
+
+
+class _FakeCache:
+    def metrics(self):
+        return {"hits": 2}
+
+
+class _FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def retry(self, method, properties, body, max_attempts):
+        self.calls.append(("retry", method.delivery_tag))
+
+    def defer(self, method, properties, body):
+        self.calls.append(("defer", method.delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+    def basic_ack(self, delivery_tag):
+        self.calls.append(("ack", delivery_tag))
+
+
+class _Method:
+    delivery_tag = 1
+    routing_key = "grade"
+
+
+class _PagedState:
+    """Two pages of answers, records what main does with them."""
+    def __init__(self):
+        self.pages = [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+        self.usage = []
+
+    def load_grading_context(self, cached_ids):
+        items = [{"item_key": i} for i in (1, 2, 3)]
+        return {"task": {"id": 7}, "completed": 0, "items": items, "task_map": {i["item_key"]: i for i in items},
+                "students": {}, "assessment_ids": [], "assessments": [], "questions": []}
+
+    def load_assessments(self, assessment_ids):
+        return ([], [])
+
+    def iter_session_answers(self, item_keys):
+        assert item_keys == [1, 2, 3]
+        yield from self.pages
+
+    def update_llm_usage(self, usage):
+        self.usage.extend(usage)
+        return len(usage)
+
+    def finalize_grader_task(self, task_id):
+        return {"pending": 0}
+
+
+class _PagedGrader:
+    build_assessment_ = None
+
+    def __init__(self, fail_page=None):
+        self.graded = []
+        self.fail_page = fail_page
+
+    def grade_(self, assessment, session, checkpoint):
+        self.graded.append([a["id"] for a in session])
+        if len(self.graded) == self.fail_page:
+            return (None, [("usage", len(self.graded))])
+        return (list(session), [("usage", len(self.graded))])
+
+
+def _on_message(monkeypatch, state, circuit_open=False, grader=None):
+    monkeypatch.setattr(main, "State", lambda db, client: state)
+    monkeypatch.setattr(main, "Grader", lambda db, client: grader)
+    monkeypatch.setattr(main, "get_breaker", lambda model: types.SimpleNamespace(is_open=lambda: circuit_open, retry_in=lambda: 3.0))
+    monkeypatch.setattr(main, "get_assessment_cache", lambda db: types.SimpleNamespace(cached_ids=lambda: [], resolve=lambda *args: {}))
+    monkeypatch.setattr(main, "log_metrics", lambda db: None)
+    return main.create_callback(None)
+
+
+# ---------- Tests ----------
+
+def test_session_lock_serializes_one_session_and_cleans_up():
+    order = []
+
+    def _second():
+        with main.session_lock(b"s1"):
+            order.append("second")
+
+    with main.session_lock(b"s1"):
+        worker = threading.Thread(target=_second)
+        worker.start()
+        worker.join(timeout=0.2)
+        # The second delivery of the same session waits for the first
+        assert worker.is_alive()
+        order.append("first")
+    worker.join()
+    assert order == ["first", "second"]
+    assert b"s1" not in main._session_locks
+
+
+def test_log_metrics_logs_one_json_line(monkeypatch, caplog):
+    monkeypatch.setattr(main, "METRICS_LOG_SECONDS", 1)
+    monkeypatch.setattr(main, "_metrics_logged_at", 0.0)
+    monkeypatch.setattr(main, "get_assessment_cache", lambda db: _FakeCache())
+    monkeypatch.setattr(main, "get_grade_cache", lambda db: _FakeCache())
+    with caplog.at_level(logging.INFO, logger=main.logger.name):
+        main.log_metrics(_FakeDB())
+        # Within METRICS_LOG_SECONDS of the last line nothing is logged
+        main.log_metrics(_FakeDB())
+    lines = [r.getMessage() for r in caplog.records if r.getMessage().startswith("metrics ")]
+    assert len(lines) == 1
+    metrics = json.loads(lines[0][len("metrics "):])
+    assert set(metrics) == {"postgres", "assessment_cache", "grade_cache", "admission", "scheduler"}
+    assert metrics["postgres"]["queries"]["load_grading_context"]["count"] == 1
+
+
+def test_failed_context_query_retries_instead_of_deleting(monkeypatch):
+    class _State:
+        deleted = []
+
+        def load_grading_context(self, cached_ids):
+            raise RuntimeError("Database query failed")
+
+        def delete_session_grader_task(self, token):
+            self.deleted.append(token)
+
+        def delete_assessment_sessions(self, token):
+            self.deleted.append(token)
+
+    state, channel = _State(), _FakeChannel()
+    _on_message(monkeypatch, state)(channel, _Method(), None, json.dumps({"session_token": "tok"}).encode())
+    assert channel.calls == [("retry", 1)]
+    assert state.deleted == []
+
+
+def test_open_circuit_defers_through_the_broker(monkeypatch):
+    channel = _FakeChannel()
+    _on_message(monkeypatch, None, circuit_open=True)(channel, _Method(), None, json.dumps({"session_token": "tok"}).encode())
+    assert channel.calls == [("defer", 1)]
+
+
+def test_session_is_graded_one_page_at_a_time(monkeypatch):
+    state, grader, channel = _PagedState(), _PagedGrader(), _FakeChannel()
+    _on_message(monkeypatch, state, grader=grader)(channel, _Method(), None, json.dumps({"session_token": "tok"}).encode())
+    assert grader.graded == [[1, 2], [3]]
+    assert state.usage == [("usage", 1), ("usage", 2)]
+    assert channel.calls == [("ack", 1)]
+
+
+def test_failed_page_stops_grading_and_retries(monkeypatch):
+    state, grader, channel = _PagedState(), _PagedGrader(fail_page=1), _FakeChannel()
+    _on_message(monkeypatch, state, grader=grader)(channel, _Method(), None, json.dumps({"session_token": "tok"}).encode())
+    # The pages left stay pending for the retry, the usage of the failed page is still recorded
+    assert grader.graded == [[1, 2]]
+    assert state.usage == [("usage", 1)]
+    assert channel.calls == [("retry", 1)]